@@ -0,0 +1,134 @@
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+from cart.models import CartItem, ShoppingCart
+from payments.models import WebhookEvent
+from proyecto_gps_25_26_ga02_pagos.db import SQLITE_PROFILES, sqlite_options
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara perfiles de SQLite (ver SQLITE_PROFILE) con escrituras concurrentes: hilos que "
+        "añaden artículos a su carrito, leen el carrito y guardan eventos de webhook en una BBDD "
+        "temporal. Ej: python manage.py benchmark_sqlite --threads 16 --duration 10"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="Conexiones concurrentes")
+        parser.add_argument('--duration', type=float, default=5, help="Segundos por perfil")
+        parser.add_argument('--profiles', nargs='+', default=list(SQLITE_PROFILES),
+                            help="Perfiles a comparar (por defecto todos)")
+
+    def handle(self, *args, **options):
+        unknown = set(options['profiles']) - set(SQLITE_PROFILES)
+        if unknown:
+            raise CommandError(f"Perfiles desconocidos: {', '.join(sorted(unknown))}")
+        if options['threads'] < 1:
+            raise CommandError("--threads debe ser al menos 1")
+
+        self.stdout.write(f"{options['threads']} hilos, {options['duration']}s por perfil")
+        self.stdout.write(f"{'perfil':<12} {'operaciones':>11} {'op/s':>8} {'bloqueos':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        for profile in options['profiles']:
+            result = self.run_profile(profile, options['threads'], options['duration'])
+            self.stdout.write(
+                f"{profile:<12} {result['operations']:>11} {result['throughput']:>8.0f} {result['locked']:>9} "
+                f"{result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f}"
+            )
+
+    def run_profile(self, profile: str, threads: int, duration: float) -> dict:
+        """
+        Ejecuta la carga contra un fichero SQLite nuevo con el perfil indicado.
+        """
+        directory = tempfile.mkdtemp(prefix='benchmark-sqlite-')
+        alias = f'benchmark_{profile}'
+        connections.settings[alias] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+            alias: {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': str(Path(directory) / 'db.sqlite3'),
+                'OPTIONS': sqlite_options(profile),
+            },
+        })[alias]
+        try:
+            carts = self.create_schema(alias, threads)
+            deadline = time.monotonic() + duration
+            results = [None] * threads
+            workers = [
+                threading.Thread(target=self.worker, args=(alias, cart, deadline, results, i))
+                for i, cart in enumerate(carts)
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            connections[alias].close()
+            del connections.settings[alias]
+            shutil.rmtree(directory, ignore_errors=True)
+
+        latencies = sorted(latency for worker_latencies, _ in results for latency in worker_latencies)
+        return {
+            'operations': len(latencies),
+            'throughput': len(latencies) / duration,
+            'locked': sum(locked for _, locked in results),
+            'p50_ms': statistics.median(latencies) * 1000 if latencies else 0.0,
+            'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0,
+        }
+
+    def create_schema(self, alias: str, threads: int):
+        """
+        Crea solo las tablas que toca la carga y un usuario con su carrito por hilo.
+        """
+        User = get_user_model()
+        with connections[alias].schema_editor() as editor:
+            for model in (User, ShoppingCart, CartItem, WebhookEvent):
+                editor.create_model(model)
+        users = User.objects.using(alias).bulk_create(User(username=f'benchmark-{i}') for i in range(threads))
+        return ShoppingCart.objects.using(alias).bulk_create(ShoppingCart(user=user) for user in users)
+
+    def worker(self, alias: str, cart, deadline: float, results: list, index: int):
+        """
+        Bucle de un hilo: 3 de cada 4 operaciones escriben (lectura + escritura
+        dentro de la misma transacción, como al añadir al carrito), la cuarta
+        lee el carrito. Cuenta las operaciones que fallan con "database is locked".
+        """
+        latencies, locked = [], 0
+        i = 0
+        try:
+            while time.monotonic() < deadline:
+                i += 1
+                start = time.perf_counter()
+                try:
+                    if i % 4 == 0:
+                        list(CartItem.objects.using(alias).filter(cart=cart))
+                    else:
+                        self.add_to_cart(alias, cart, product_id=i % 20, webhook=i % 5 == 0)
+                except OperationalError:
+                    locked += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+        finally:
+            connections[alias].close()
+        results[index] = (latencies, locked)
+
+    def add_to_cart(self, alias: str, cart, product_id: int, webhook: bool):
+        # Como CartItemAddAPIView: se lee el artículo y luego se escribe
+        with transaction.atomic(using=alias):
+            item = CartItem.objects.using(alias).filter(cart=cart, product_id=product_id).first()
+            if item:
+                item.quantity += 1
+                item.save(using=alias, update_fields=['quantity'])
+            else:
+                CartItem.objects.using(alias).create(cart=cart, product_id=product_id, price_at_addition='9.99')
+            if webhook:
+                WebhookEvent.objects.using(alias).create(
+                    event_id=f'evt_benchmark_{cart.pk}_{product_id}', event_type='payment_intent.succeeded', payload={}
+                )
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-19 16:21
+
+from django.db import migrations, models
+
+from pricing.money import backfill_minor_units
+
+
+def backfill_cart_items(apps, schema_editor):
+    backfill_minor_units(apps.get_model('cart', 'CartItem'), {'price_at_addition': 'price_at_addition_minor'})
+
+
+class Migration(migrations.Migration):
+    # El relleno va por lotes, cada uno en su transacción
+    atomic = False
+
+    dependencies = [
+        ('cart', '0003_alter_cartitem_price_at_addition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='price_at_addition_minor',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_cart_items, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,8 @@ from django.db import models
 from django.conf import settings
 from decimal import Decimal
 
+from pricing.money import MinorUnitsModel
+
 class ShoppingCart(models.Model):
     """
         Modelo que representa el carrito de un usuario.
@@ -29,7 +31,7 @@ class ShoppingCart(models.Model):
     def __str__(self):
         return f"Carrito de {self.user.username}"
 
-class CartItem(models.Model):
+class CartItem(MinorUnitsModel):
     """
         Modelo que representa un ítem dentro del carrito de compras
     """
@@ -53,6 +55,10 @@ class CartItem(models.Model):
         help_text="Precio del producto al momento de agregar al carrito",
         default=Decimal('0.00')
     )
+    # El mismo precio en céntimos (el carrito va en la divisa por defecto)
+    price_at_addition_minor = models.BigIntegerField(default=0)
+
+    MINOR_UNIT_FIELDS = {'price_at_addition': 'price_at_addition_minor'}
 
     class Meta:
         # Evita duplicados del mismo producto en el carrito
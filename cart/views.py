@@ -1,6 +1,8 @@
 from rest_framework import status, generics
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import prefetch_related_objects
 from django.shortcuts import get_object_or_404
 
 from .models import ShoppingCart, CartItem
@@ -12,18 +14,23 @@ from .serializers import (
 
 def get_or_create_cart(user):
     """ Función helper para obtener/crear el carrito activo """
+    # Siempre en la principal, también en el GET que lee de la réplica: una
+    # réplica con retraso no vería un carrito recién creado, y crearíamos otro
+    # (ShoppingCart.user es OneToOne) o borraríamos uno que el usuario aún tiene
+    carts = ShoppingCart.objects.using(DEFAULT_DB_ALIAS)
     try:
         # 1. Intenta obtener el carrito activo
-        cart = ShoppingCart.objects.get(user=user, status=ShoppingCart.CartStatus.ACTIVE)
+        cart = carts.get(user=user, status=ShoppingCart.CartStatus.ACTIVE)
     except ShoppingCart.DoesNotExist:
-        # 2. Si no existe, busca si hay uno 'ORDERED'
-        ShoppingCart.objects.filter(
-            user=user,
-            status=ShoppingCart.CartStatus.ORDERED
-        ).delete()
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            # 2. Si no existe, busca si hay uno 'ORDERED'
+            carts.filter(
+                user=user,
+                status=ShoppingCart.CartStatus.ORDERED
+            ).delete()
 
-        # 3. (Ya sea que no existía o que borramos el 'ORDERED'), creamos uno nuevo
-        cart = ShoppingCart.objects.create(user=user, status=ShoppingCart.CartStatus.ACTIVE)
+            # 3. (Ya sea que no existía o que borramos el 'ORDERED'), creamos uno nuevo
+            cart = carts.create(user=user, status=ShoppingCart.CartStatus.ACTIVE)
 
     return cart
 
@@ -32,12 +39,21 @@ class CartRetrieveAPIView(generics.RetrieveAPIView):
     Corresponde a: GET /api/v1/cart/
     Obtiene el carrito completo del usuario, con totales e impuestos.
     """
+    # Consultas por petición, sesión y autenticación incluidas (ver RequestTimingMiddleware)
+    query_budget = 6
+    psp_call_budget = 0
+    # GET desde la réplica (ver ReplicaRoutingMiddleware), salvo el propio
+    # carrito: get_or_create_cart lo busca y lo crea en la principal
+    read_replica = True
     permission_classes = [IsAuthenticated]
     serializer_class = ShoppingCartSerializer
 
     def get_object(self):
-        # Devuelve el carrito activo del usuario que hace la petición
-        return get_or_create_cart(self.request.user)
+        # Devuelve el carrito activo del usuario que hace la petición.
+        # Los items se cargan una vez para el serializer y para el cálculo de totales.
+        cart = get_or_create_cart(self.request.user)
+        prefetch_related_objects([cart], 'items')
+        return cart
 
     def get_serializer_context(self):
         # Pasamos la 'region_code' del query param (ej. ?region=ES-CN)
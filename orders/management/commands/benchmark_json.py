@@ -0,0 +1,96 @@
+import io
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+
+def order_history_payload(orders: int, lines: int) -> list:
+    """
+    Lista de pedidos con la forma de OrderResponseSerializer.
+    """
+    return [
+        {
+            'order_id': str(uuid.uuid4()),
+            'user_id': 1,
+            'amount': f"{Decimal(lines) * Decimal('12.10'):.2f}",
+            'currency': 'EUR',
+            'status': 'PAID',
+            'created_at': '2025-11-03T10:15:42.123Z',
+            'lines': [
+                {'order_line_id': i * lines + j, 'item_type': 'PRODUCT', 'item_id': str(j),
+                 'qty': 1 + j % 3, 'unit_price': '10.00'}
+                for j in range(lines)
+            ],
+        }
+        for i in range(orders)
+    ]
+
+
+def cart_payload(items: int) -> dict:
+    """
+    Carrito con la forma de ShoppingCartSerializer: los totales de pricing
+    llegan al renderer como Decimal.
+    """
+    subtotal = Decimal('9.99') * items
+    tax = (subtotal * Decimal('0.21')).quantize(Decimal('0.01'))
+    return {
+        'id': 1, 'user': 1, 'status': 'ACTIVE',
+        'items': [{'id': i, 'product_id': i, 'quantity': 1, 'price_at_addition': '9.99'} for i in range(items)],
+        'subtotal': subtotal, 'tax_rate_name': 'IVA General', 'tax_rate_percent': Decimal('21.00'),
+        'tax_amount': tax, 'total': subtotal + tax,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara el renderer y el parser JSON de DRF (y su variante con Decimal como string) con los de orjson "
+        "(proyecto_gps_25_26_ga02_pagos.fastjson) "
+        "sobre un historial de pedidos y un carrito grandes: ms por render/parse y bytes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=200, help="Pedidos del historial")
+        parser.add_argument('--lines', type=int, default=10, help="Líneas por pedido")
+        parser.add_argument('--cart-items', type=int, default=500, help="Productos del carrito")
+        parser.add_argument('--iterations', type=int, default=50, help="Repeticiones de cada medición")
+
+    def handle(self, *args, **options):
+        from proyecto_gps_25_26_ga02_pagos.fastjson import DecimalJSONRenderer, ORJSONParser, ORJSONRenderer
+
+        try:
+            fast = ('orjson', ORJSONRenderer(), ORJSONParser())
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        implementations = [
+            ('drf', JSONRenderer(), JSONParser()),
+            # Lo que sirve la API si orjson no está instalado
+            ('stdlib', DecimalJSONRenderer(), JSONParser()),
+            fast,
+        ]
+        payloads = [
+            ('pedidos', order_history_payload(options['orders'], options['lines'])),
+            ('carrito', cart_payload(options['cart_items'])),
+        ]
+        iterations = options['iterations']
+
+        self.stdout.write(f"{'payload':<10} {'json':<8} {'bytes':>9} {'render ms':>10} {'parse ms':>9}")
+        for payload_name, data in payloads:
+            for name, renderer, parser in implementations:
+                body = renderer.render(data)
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    renderer.render(data)
+                render_ms = (time.perf_counter() - start) * 1000 / iterations
+
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    parser.parse(io.BytesIO(body), parser_context={})
+                parse_ms = (time.perf_counter() - start) * 1000 / iterations
+
+                self.stdout.write(f"{payload_name:<10} {name:<8} {len(body):>9} {render_ms:>10.2f} {parse_ms:>9.2f}")
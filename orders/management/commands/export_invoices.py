@@ -0,0 +1,52 @@
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.services import invoices_for_export, iter_invoice_zip, month_date_range
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Exporta a un ZIP las facturas PDF de un usuario y/o rango de fechas. "
+        "Ej: python manage.py export_invoices --user 7 --month 2025-11 --output facturas.zip"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', required=True, help="Ruta del fichero ZIP a escribir")
+        parser.add_argument('--user', help="ID o username del usuario")
+        parser.add_argument('--month', help="Mes en formato YYYY-MM")
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help="Fecha inicial (YYYY-MM-DD)")
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help="Fecha final (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        user_id = None
+        if options['user']:
+            lookup = {'pk': options['user']} if options['user'].isdigit() else {'username': options['user']}
+            try:
+                user_id = User.objects.only('pk').get(**lookup).pk
+            except User.DoesNotExist:
+                raise CommandError(f"No existe el usuario '{options['user']}'")
+
+        date_from, date_to = options['date_from'], options['date_to']
+        if options['month']:
+            if date_from or date_to:
+                raise CommandError("Usa --month o --from/--to, no ambos.")
+            try:
+                date_from, date_to = month_date_range(options['month'])
+            except ValueError:
+                raise CommandError("--month debe tener el formato YYYY-MM")
+
+        if user_id is None and not (date_from or date_to):
+            raise CommandError("Indica al menos --user o un rango de fechas (--month, --from, --to).")
+
+        invoices = invoices_for_export(user_id=user_id, date_from=date_from, date_to=date_to)
+        written = 0
+        with open(options['output'], 'wb') as fh:
+            for chunk in iter_invoice_zip(invoices):
+                fh.write(chunk)
+                written += len(chunk)
+
+        self.stdout.write(self.style.SUCCESS(f"ZIP escrito en {options['output']} ({written} bytes)"))
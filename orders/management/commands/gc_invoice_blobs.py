@@ -0,0 +1,74 @@
+from datetime import timedelta
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from orders.models import Invoice
+
+INVOICES_ROOT = 'invoices'
+
+
+def iter_stored_files(storage, path):
+    """
+    Recorre el storage directorio a directorio (sin listar todo de golpe).
+    """
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield f"{path}/{name}"
+    for directory in directories:
+        yield from iter_stored_files(storage, f"{path}/{directory}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra los PDF de factura que ya no referencia ninguna Invoice "
+        "(blobs huérfanos tras regenerar facturas). Se procesa por lotes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Ficheros comprobados contra la BBDD por consulta")
+        parser.add_argument('--min-age-minutes', type=int, default=60,
+                            help="No borrar ficheros más recientes (puede haber una factura guardándose)")
+        parser.add_argument('--dry-run', action='store_true', help="Solo informa, no borra nada")
+
+    def handle(self, *args, **options):
+        storage = Invoice._meta.get_field('invoice_pdf').storage
+        if not storage.exists(INVOICES_ROOT):
+            self.stdout.write("No hay facturas almacenadas.")
+            return
+
+        cutoff = timezone.now() - timedelta(minutes=options['min_age_minutes'])
+        files = iter_stored_files(storage, INVOICES_ROOT)
+        scanned = deleted = freed = 0
+
+        while batch := list(islice(files, options['batch_size'])):
+            scanned += len(batch)
+            referenced = set(
+                Invoice.objects.filter(invoice_pdf__in=batch).values_list('invoice_pdf', flat=True)
+            )
+            for name in batch:
+                if name in referenced or storage.get_modified_time(name) > cutoff:
+                    continue
+                size = storage.size(name)
+                if not options['dry_run']:
+                    if self.in_use(storage, name, cutoff):
+                        continue
+                    storage.delete(name)
+                deleted += 1
+                freed += size
+
+        action = "Se borrarían" if options['dry_run'] else "Borrados"
+        self.stdout.write(self.style.SUCCESS(
+            f"Revisados {scanned} ficheros. {action} {deleted} blobs huérfanos ({freed} bytes)."
+        ))
+
+    @staticmethod
+    def in_use(storage, name, cutoff) -> bool:
+        """
+        Se vuelve a comprobar justo antes de borrar: store_invoice_pdf puede
+        haber reutilizado el blob (y renovado su fecha) después de la consulta del lote.
+        """
+        return (storage.get_modified_time(name) > cutoff
+                or Invoice.objects.filter(invoice_pdf=name).exists())
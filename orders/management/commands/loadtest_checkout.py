@@ -0,0 +1,216 @@
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+import requests
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.middleware.csrf import CSRF_ALLOWED_CHARS, CSRF_SECRET_LENGTH
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from payments.fake_stripe import FakeStripe, FakeStripeServer
+
+# Pasos de cada compra, en orden
+CHECKOUT_STEPS = ['add_to_cart', 'get_cart', 'create_order', 'payment_intent', 'webhook']
+
+
+def percentile(sorted_values, percent: float) -> float:
+    """
+    Percentil por rango más cercano de una lista ya ordenada.
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)]
+
+
+class WebhookMailbox:
+    """
+    Recoge los webhooks que emite el Stripe falso, por PaymentIntent, para que
+    cada usuario virtual entregue el suyo al servidor.
+    """
+    def __init__(self):
+        self._events = {}
+        self._condition = threading.Condition()
+
+    def deliver(self, payload: bytes, signature: str):
+        intent_id = json.loads(payload)['data']['object']['id']
+        with self._condition:
+            self._events[intent_id] = (payload, signature)
+            self._condition.notify_all()
+
+    def take(self, intent_id: str, timeout: float = 10):
+        with self._condition:
+            if not self._condition.wait_for(lambda: intent_id in self._events, timeout=timeout):
+                raise TimeoutError(f"El Stripe falso no emitió el webhook de {intent_id}")
+            return self._events.pop(intent_id)
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga de la compra completa: usuarios virtuales concurrentes que añaden al carrito, "
+        "lo consultan, crean el pedido, pagan y entregan el webhook, contra un servidor local. "
+        "Arranca su propio Stripe falso: el servidor debe tener STRIPE_API_BASE=http://127.0.0.1:<--stripe-port>, "
+        "STRIPE_SECRET_KEY=sk_test_fake y el mismo STRIPE_WEBHOOK_SECRET. Usa la misma BBDD que el servidor "
+        "(mismos settings) para crear los usuarios."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help="URL del servidor a probar")
+        parser.add_argument('--users', type=int, default=10, help="Usuarios virtuales concurrentes")
+        parser.add_argument('--checkouts', type=int, default=10, help="Compras por usuario virtual")
+        parser.add_argument('--stripe-port', type=int, default=12111, help="Puerto del Stripe falso")
+        parser.add_argument('--stripe-latency', type=float, default=0.05,
+                            help="Segundos de espera del Stripe falso por petición")
+        parser.add_argument('--timeout', type=float, default=30, help="Timeout de cada petición HTTP")
+        parser.add_argument('--json', dest='json_output',
+                            help="Guarda también el resultado en este fichero JSON (para comparar ejecuciones)")
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['checkouts'] < 1:
+            raise CommandError("--users y --checkouts deben ser al menos 1")
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            raise CommandError("Configura STRIPE_WEBHOOK_SECRET (el mismo que usa el servidor)")
+
+        self.base_url = options['base_url'].rstrip('/')
+        self.timeout = options['timeout']
+        self.mailbox = WebhookMailbox()
+        fake = FakeStripe(latency=options['stripe_latency'], webhook_secret=settings.STRIPE_WEBHOOK_SECRET,
+                          deliver_webhook=self.mailbox.deliver)
+        stripe_server = FakeStripeServer(('127.0.0.1', options['stripe_port']), fake)
+        threading.Thread(target=stripe_server.serve_forever, daemon=True).start()
+        self.stdout.write(f"Stripe falso en {stripe_server.api_base}; servidor {self.base_url}; "
+                          f"{options['users']} usuarios x {options['checkouts']} compras")
+
+        # {paso: [ms, ...]} y {paso: errores}, compartidos por todos los hilos
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+        try:
+            sessions = [self.login(f"loadtest-{i}") for i in range(options['users'])]
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['users']) as executor:
+                completed = sum(executor.map(lambda session: self.run_user(session, options['checkouts']), sessions))
+            elapsed = time.perf_counter() - start
+        finally:
+            stripe_server.shutdown()
+            stripe_server.server_close()
+
+        self.report(completed, options['users'] * options['checkouts'], elapsed, options)
+
+    # ----- Usuarios virtuales -----
+
+    def login(self, username: str) -> requests.Session:
+        """
+        Crea (o reutiliza) el usuario y le abre una sesión directamente en la
+        BBDD, sin pasar por el hash de la contraseña en cada petición.
+        """
+        user, _ = get_user_model().objects.get_or_create(username=username)
+        session_store = import_module(settings.SESSION_ENGINE).SessionStore()
+        session_store[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        session_store[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session_store[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session_store.save()
+
+        csrf_token = get_random_string(CSRF_SECRET_LENGTH, allowed_chars=CSRF_ALLOWED_CHARS)
+        session = requests.Session()
+        session.cookies.set(settings.SESSION_COOKIE_NAME, session_store.session_key)
+        session.cookies.set(settings.CSRF_COOKIE_NAME, csrf_token)
+        session.headers['X-CSRFToken'] = csrf_token
+        session.headers['Referer'] = self.base_url + '/'
+
+        payment_method = self.request(session, 'add_payment_method', 'post', reverse('payment-method-list-create'),
+                                      expected=201, json={'token': 'pm_card_visa', 'make_default': True})
+        session.payment_method_id = payment_method['payment_method_id']
+        session.stripe = requests.Session()
+        return session
+
+    def request(self, session, step: str, method: str, path: str, expected: int = 200, **kwargs):
+        """
+        Hace una petición cronometrada. Lanza RuntimeError si el código no es
+        el esperado (el error ya queda contado).
+        """
+        start = time.perf_counter()
+        try:
+            response = session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            response, error = None, str(e)
+        elapsed = (time.perf_counter() - start) * 1000
+
+        with self.lock:
+            self.timings[step].append(elapsed)
+            if response is None or response.status_code != expected:
+                self.errors[step] += 1
+        if response is None:
+            raise RuntimeError(f"{step}: {error}")
+        if response.status_code != expected:
+            raise RuntimeError(f"{step}: {response.status_code} {response.text[:200]}")
+        return response.json() if response.content else None
+
+    def checkout(self, session, product_id: int):
+        self.request(session, 'add_to_cart', 'post', reverse('cart-item-add'), expected=201,
+                     json={'product_id': product_id, 'quantity': 1, 'price_at_addition': '9.99'})
+        self.request(session, 'get_cart', 'get', reverse('cart-retrieve'))
+        order = self.request(session, 'create_order', 'post', reverse('orders:order-list-create'), expected=202)
+        intent = self.request(session, 'payment_intent', 'post', reverse('payment-intent-create'),
+                              json={'order_id': order['order_id'], 'payment_method_id': session.payment_method_id})
+
+        # El webhook llega como lo mandaría Stripe: sin la sesión del usuario
+        payload, signature = self.mailbox.take(intent['payment_id'])
+        self.request(session.stripe, 'webhook', 'post', reverse('webhook-stripe'), data=payload,
+                     headers={'Content-Type': 'application/json', 'Stripe-Signature': signature})
+
+    def run_user(self, session, checkouts: int) -> int:
+        completed = 0
+        for i in range(checkouts):
+            try:
+                self.checkout(session, product_id=i + 1)
+                completed += 1
+            except (RuntimeError, TimeoutError) as e:
+                self.stderr.write(f"Compra fallida: {e}")
+        return completed
+
+    # ----- Informe -----
+
+    def report(self, completed: int, attempted: int, elapsed: float, options):
+        steps = {}
+        for step in ['add_payment_method'] + CHECKOUT_STEPS:
+            timings = sorted(self.timings.get(step, []))
+            steps[step] = {
+                'requests': len(timings),
+                'errors': self.errors.get(step, 0),
+                'p50_ms': round(percentile(timings, 50), 1),
+                'p95_ms': round(percentile(timings, 95), 1),
+                'p99_ms': round(percentile(timings, 99), 1),
+            }
+        requests_made = sum(step['requests'] for step in steps.values())
+        result = {
+            'database': connection.vendor,
+            'base_url': self.base_url,
+            'users': options['users'],
+            'checkouts_attempted': attempted,
+            'checkouts_completed': completed,
+            'elapsed_s': round(elapsed, 2),
+            'checkouts_per_s': round(completed / elapsed, 2) if elapsed else 0.0,
+            'error_rate': round(sum(step['errors'] for step in steps.values()) / requests_made, 4) if requests_made else 0.0,
+            'steps': steps,
+        }
+
+        self.stdout.write(f"\n{'paso':<20} {'peticiones':>10} {'errores':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for step, data in steps.items():
+            self.stdout.write(f"{step:<20} {data['requests']:>10} {data['errors']:>8} "
+                              f"{data['p50_ms']:>8.1f} {data['p95_ms']:>8.1f} {data['p99_ms']:>8.1f}")
+        self.stdout.write(
+            f"\nBBDD {result['database']}: {completed}/{attempted} compras en {result['elapsed_s']}s -> "
+            f"{result['checkouts_per_s']} compras/s, tasa de error {result['error_rate']:.2%}"
+        )
+        if options['json_output']:
+            with open(options['json_output'], 'w') as output:
+                json.dump(result, output, indent=2)
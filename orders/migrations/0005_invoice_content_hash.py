@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-19 15:56
+
+import django.db.models.deletion
+import orders.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_remove_order_invoice_pdf_invoice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='invoice_pdf',
+            field=models.FileField(upload_to=orders.models.invoice_pdf_upload_to),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pendiente'), ('PAID', 'Pagado'), ('FAILED', 'Fallido'), ('REFUNDED', 'Reembolsado')], default='PENDING', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='total_paid',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='orders.order'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_invoice_content_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pendiente'), ('PAID', 'Pagado'), ('FAILED', 'Fallido'), ('REFUNDED', 'Reembolsado'), ('DISPUTED', 'En disputa')], default='PENDING', max_length=10),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.7 on 2026-10-19 16:21
+
+from django.db import migrations, models
+
+from pricing.money import backfill_minor_units
+
+
+def backfill_orders(apps, schema_editor):
+    backfill_minor_units(
+        apps.get_model('orders', 'Order'),
+        {'amount': 'amount_minor', 'subtotal': 'subtotal_minor',
+         'tax_total': 'tax_total_minor', 'total_paid': 'total_paid_minor'},
+        currency=lambda order: order.currency,
+    )
+    backfill_minor_units(
+        apps.get_model('orders', 'OrderItem'),
+        {'unit_price': 'unit_price_minor'},
+        currency=lambda item: item.order.currency,
+        select_related=['order'],
+    )
+
+
+class Migration(migrations.Migration):
+    # El relleno va por lotes, cada uno en su transacción
+    atomic = False
+
+    dependencies = [
+        ('orders', '0006_alter_order_status_disputed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='amount_minor',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal_minor',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='tax_total_minor',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_paid_minor',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price_minor',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_orders, migrations.RunPython.noop),
+    ]
@@ -3,7 +3,9 @@ from django.db import models
 from django.conf import settings
 from typing import Any
 
-class Order(models.Model):
+from pricing.money import MinorUnitsModel
+
+class Order(MinorUnitsModel):
     """
     Representa un pedido completo
     Esto es lo que se convierte en factura
@@ -13,6 +15,7 @@ class Order(models.Model):
         PAID = 'PAID', 'Pagado'
         FAILED = 'FAILED', 'Fallido'
         REFUNDED = 'REFUNDED', 'Reembolsado'
+        DISPUTED = 'DISPUTED', 'En disputa'
 
     order_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -33,13 +36,26 @@ class Order(models.Model):
     tax_name = models.CharField(max_length=100, default="N/A")
     total_paid = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
 
+    # Los mismos importes en unidades menores de 'currency' (se rellenan al guardar)
+    amount_minor = models.BigIntegerField(default=0)
+    subtotal_minor = models.BigIntegerField(default=0)
+    tax_total_minor = models.BigIntegerField(default=0)
+    total_paid_minor = models.BigIntegerField(default=0)
+
+    MINOR_UNIT_FIELDS = {
+        'amount': 'amount_minor',
+        'subtotal': 'subtotal_minor',
+        'tax_total': 'tax_total_minor',
+        'total_paid': 'total_paid_minor',
+    }
+
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __dir__(self):
         return f"Pedido {self.order_id} - Usuario: {self.user.username} - Estado: {self.status}"
 
 
-class OrderItem(models.Model):
+class OrderItem(MinorUnitsModel):
     """
     Los articulos dentro de un pedido
     """
@@ -58,6 +74,12 @@ class OrderItem(models.Model):
     product_id = models.IntegerField()
     quantity = models.PositiveIntegerField()
     unit_price = models.DecimalField(max_digits=10, decimal_places=2, help_text='Unidad del producto')
+    unit_price_minor = models.BigIntegerField(default=0)
+
+    MINOR_UNIT_FIELDS = {'unit_price': 'unit_price_minor'}
+
+    def minor_units_currency(self) -> str:
+        return self.order.currency
 
     @property
     def line_total(self):
@@ -67,12 +89,22 @@ class OrderItem(models.Model):
         return f"Producto {self.product_id} - Cantidad: {self.quantity} - Precio Unitario: {self.unit_price}"
 
 
+def invoice_pdf_upload_to(instance, filename):
+    """
+    Ruta direccionada por contenido: el PDF se guarda bajo su hash SHA-256,
+    así dos facturas con los mismos bytes comparten un único fichero.
+    """
+    return f"invoices/sha256/{instance.content_hash[:2]}/{instance.content_hash}.pdf"
+
+
 class Invoice(models.Model):
     """
     Representa la factura generada DESPUÉS de un pago exitoso.
     """
     order = models.OneToOneField(Order, on_delete=models.PROTECT, related_name='invoice')
-    invoice_pdf = models.FileField(upload_to='invoices/%Y/%m/')
+    invoice_pdf = models.FileField(upload_to=invoice_pdf_upload_to)
+    # SHA-256 del PDF guardado (vacío en facturas antiguas, guardadas en invoices/%Y/%m/)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -48,7 +48,7 @@ class OrderLineResponseSerializer(serializers.ModelSerializer):
 # Serializer para la respuesta del pedido
 class OrderResponseSerializer(serializers.ModelSerializer):
     lines = OrderLineResponseSerializer(many=True, read_only=True)
-    user_id = serializers.IntegerField(source='user.id')
+    user_id = serializers.IntegerField()  # El FK, sin cargar el usuario
 
     class Meta:
         model = Order
@@ -66,4 +66,21 @@ class OrderResponseSerializer(serializers.ModelSerializer):
 class OrderAcceptedResponseSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
-        fields = ['order_id', 'status']
\ No newline at end of file
+        fields = ['order_id', 'status']
+
+
+# Serializer para los filtros de la descarga de facturas en ZIP
+class InvoiceBundleRequestSerializer(serializers.Serializer):
+    month = serializers.RegexField(r'^\d{4}-(0[1-9]|1[0-2])$', required=False)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    user_id = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        if 'month' in data and ('date_from' in data or 'date_to' in data):
+            raise serializers.ValidationError("Usa 'month' o 'date_from'/'date_to', no ambos.")
+        if not ('month' in data or 'date_from' in data or 'date_to' in data):
+            raise serializers.ValidationError("Indica 'month' o un rango 'date_from'/'date_to'.")
+        if data.get('date_from') and data.get('date_to') and data['date_from'] > data['date_to']:
+            raise serializers.ValidationError("'date_from' no puede ser posterior a 'date_to'.")
+        return data
\ No newline at end of file
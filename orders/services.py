@@ -1,6 +1,5 @@
 from django.template.loader import render_to_string
 from django.core.files.base import ContentFile
-from weasyprint import HTML
 import logging
 from decimal import Decimal
 from django.db import transaction
@@ -2,11 +2,36 @@ from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
+from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.cache import cache
+from django.test import override_settings
+from django.core.management import call_command
+from django.utils import timezone
+from datetime import timedelta
 from decimal import Decimal
+from unittest.mock import patch
+import io
+import os
+import time
+import shutil
+from pathlib import Path
+import tempfile
+import json
+import socket
+import zipfile
+import unittest
+import uuid
+from importlib.util import find_spec
+
+from payments.psp import stripe
+from django.test import LiveServerTestCase
 
 from cart.models import ShoppingCart, CartItem
 from pricing.models import TaxRate, RegionTaxRule
-from orders.models import Order, OrderItem
+from orders.models import Order, OrderItem, Invoice
+from payments.services import generate_invoice_pdf_for_order
+from payments.models import WebhookEvent
 
 User = get_user_model()
 
@@ -15,6 +40,8 @@ class OrderRefactorTests(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpassword123')
         self.client.force_authenticate(user=self.user)
+        # TestCase no confirma la transacción: la caché de tasas no se invalida sola
+        cache.clear()
 
         # Impuestos usando Decimal
         tax = TaxRate.objects.create(name="IVA Test", rate=Decimal("10.00"))
@@ -61,4 +88,239 @@ class OrderRefactorTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['order_id'], str(order.order_id))
-        self.assertEqual(response.data['amount'], "220.00") # <- Campo 'amount'
\ No newline at end of file
+        self.assertEqual(response.data['amount'], "220.00") # <- Campo 'amount'
+
+
+@unittest.skipUnless(find_spec('orjson'), "orjson no está instalado")
+class FastJSONTests(APITestCase):
+
+    def test_renderer_matches_drf_except_decimals(self):
+        from rest_framework.renderers import JSONRenderer
+        from proyecto_gps_25_26_ga02_pagos.fastjson import ORJSONRenderer
+
+        data = {
+            'order_id': uuid.UUID('6f1c0c43-4a3a-4b8e-9a33-b0f1d2d6b6a1'),
+            'created_at': timezone.datetime(2025, 11, 3, 10, 15, 42, 123456, tzinfo=timezone.get_fixed_timezone(0)),
+            'lines': [{'qty': 2, 'unit_price': '10.00', 'name': 'Café'}],
+            'total': Decimal('242.00'),
+        }
+        fast = json.loads(ORJSONRenderer().render(data))
+        drf = json.loads(JSONRenderer().render(data))
+        self.assertEqual(fast['total'], '242.00')  # DRF: 242.0
+        del fast['total'], drf['total']
+        self.assertEqual(fast, drf)
+
+    def test_stdlib_fallback_has_same_format(self):
+        from proyecto_gps_25_26_ga02_pagos.fastjson import DecimalJSONRenderer, ORJSONRenderer
+
+        data = {
+            'order_id': uuid.UUID('6f1c0c43-4a3a-4b8e-9a33-b0f1d2d6b6a1'),
+            'created_at': timezone.datetime(2025, 11, 3, 10, 15, 42, 123456, tzinfo=timezone.get_fixed_timezone(0)),
+            'subtotal': Decimal('200.00'), 'tax_rate_percent': Decimal('21.00'), 'total': Decimal('242.00'),
+        }
+        self.assertEqual(json.loads(DecimalJSONRenderer().render(data)), json.loads(ORJSONRenderer().render(data)))
+
+    def test_parser(self):
+        from rest_framework.exceptions import ParseError
+        from proyecto_gps_25_26_ga02_pagos.fastjson import ORJSONParser
+
+        parsed = ORJSONParser().parse(io.BytesIO('{"product_id": 1, "price": "9.99", "nota": "ñ"}'.encode()))
+        self.assertEqual(parsed, {'product_id': 1, 'price': '9.99', 'nota': 'ñ'})
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(io.BytesIO(b'{"product_id": '))
+
+    def test_cart_totals_as_exact_strings(self):
+        user = User.objects.create_user(username='jsonuser', password='testpassword123')
+        self.client.force_authenticate(user=user)
+        cart = ShoppingCart.objects.create(user=user, status=ShoppingCart.CartStatus.ACTIVE)
+        CartItem.objects.create(cart=cart, product_id=1, quantity=3, price_at_addition="0.10")
+
+        # El cuerpo JSON pasa por ORJSONParser
+        response = self.client.post(reverse('cart-item-add'), content_type='application/json',
+                                    data='{"product_id": 2, "quantity": 1, "price_at_addition": "0.20"}')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        body = self.client.get(reverse('cart-retrieve')).json()
+        self.assertEqual(body['subtotal'], '0.50')
+
+
+class TempMediaRootMixin:
+    """
+    Guarda los ficheros de cada test en un MEDIA_ROOT temporal.
+    """
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=self.media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+
+class InvoiceBundleTests(TempMediaRootMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='b2buser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+
+        # Una factura con PDF guardado y otra sin fichero (se renderiza al vuelo)
+        self.stored_order = Order.objects.create(user=self.user, status=Order.OrderStatus.PAID, amount=Decimal("10.00"))
+        stored = Invoice.objects.create(order=self.stored_order)
+        stored.invoice_pdf.save('factura.pdf', ContentFile(b'%PDF-guardado'), save=True)
+
+        self.missing_order = Order.objects.create(user=self.user, status=Order.OrderStatus.PAID, amount=Decimal("20.00"))
+        Invoice.objects.create(order=self.missing_order)
+
+        other_user = User.objects.create_user(username='otro', password='password')
+        Invoice.objects.create(order=Order.objects.create(user=other_user, status=Order.OrderStatus.PAID))
+
+        self.bundle_url = reverse('orders:invoice-bundle')
+        self.month = timezone.now().strftime('%Y-%m')
+
+    @patch('payments.services.render_invoice_pdf', return_value=b'%PDF-renderizado')
+    def test_bundle_streams_stored_zip_of_user_invoices(self, mock_render):
+        response = self.client.get(self.bundle_url, {'month': self.month})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(
+            sorted(archive.namelist()),
+            sorted([f'factura_{self.stored_order.order_id}.pdf', f'factura_{self.missing_order.order_id}.pdf'])
+        )
+        self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist()))
+        self.assertEqual(archive.read(f'factura_{self.stored_order.order_id}.pdf'), b'%PDF-guardado')
+        self.assertEqual(archive.read(f'factura_{self.missing_order.order_id}.pdf'), b'%PDF-renderizado')
+        mock_render.assert_called_once()
+
+    def test_bundle_of_other_user_requires_staff(self):
+        other_user = User.objects.get(username='otro')
+        response = self.client.get(self.bundle_url, {'month': self.month, 'user_id': other_user.id})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_bundle_requires_date_filter(self):
+        response = self.client.get(self.bundle_url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('payments.services.render_invoice_pdf', return_value=b'%PDF-renderizado')
+    def test_export_command_writes_zip(self, mock_render):
+        output = f'{self.media_root}/facturas.zip'
+        call_command('export_invoices', user=self.user.username, month=self.month, output=output, stdout=io.StringIO())
+
+        with zipfile.ZipFile(output) as archive:
+            self.assertEqual(len(archive.namelist()), 2)
+            self.assertIsNone(archive.testzip())
+
+
+class InvoiceStorageTests(TempMediaRootMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='storageuser', password='testpassword123')
+        self.order_a = Order.objects.create(user=self.user, status=Order.OrderStatus.PAID)
+        self.order_b = Order.objects.create(user=self.user, status=Order.OrderStatus.PAID)
+
+    @patch('payments.services.render_invoice_pdf', return_value=b'%PDF-identico')
+    def test_identical_pdfs_share_one_blob(self, mock_render):
+        invoice_a = generate_invoice_pdf_for_order(self.order_a)
+        invoice_b = generate_invoice_pdf_for_order(self.order_b)
+        # Regenerar tampoco escribe un fichero nuevo
+        generate_invoice_pdf_for_order(self.order_a)
+
+        self.assertEqual(invoice_a.content_hash, invoice_b.content_hash)
+        self.assertEqual(invoice_a.invoice_pdf.name, invoice_b.invoice_pdf.name)
+        self.assertTrue(invoice_a.invoice_pdf.name.endswith(f'{invoice_a.content_hash}.pdf'))
+
+        blob_dir = f'{self.media_root}/invoices/sha256/{invoice_a.content_hash[:2]}'
+        self.assertEqual(len(list(Path(blob_dir).iterdir())), 1)
+
+    @patch('payments.services.render_invoice_pdf', return_value=b'%PDF-en-uso')
+    def test_gc_removes_only_unreferenced_blobs(self, mock_render):
+        invoice = generate_invoice_pdf_for_order(self.order_a)
+        storage = invoice.invoice_pdf.storage
+        orphan = storage.save('invoices/sha256/00/huerfano.pdf', ContentFile(b'%PDF-huerfano'))
+        legacy = storage.save('invoices/2025/11/factura_antigua.pdf', ContentFile(b'%PDF-antiguo'))
+
+        call_command('gc_invoice_blobs', min_age_minutes=0, batch_size=1, stdout=io.StringIO())
+
+        self.assertTrue(storage.exists(invoice.invoice_pdf.name))
+        self.assertFalse(storage.exists(orphan))
+        self.assertFalse(storage.exists(legacy))
+
+    @patch('payments.services.render_invoice_pdf', return_value=b'%PDF-reutilizado')
+    def test_reused_blob_is_not_collected(self, mock_render):
+        invoice = generate_invoice_pdf_for_order(self.order_a)
+        storage = invoice.invoice_pdf.storage
+        blob = invoice.invoice_pdf.name
+        # El blob se escribió hace días; otra factura con los mismos bytes lo reutiliza
+        old = time.time() - 3 * 86400
+        os.utime(storage.path(blob), (old, old))
+        Invoice.objects.filter(pk=invoice.pk).delete()
+        reused = generate_invoice_pdf_for_order(self.order_b)
+
+        self.assertEqual(reused.invoice_pdf.name, blob)
+        self.assertGreater(storage.get_modified_time(blob), timezone.now() - timedelta(minutes=1))
+
+        # La factura empieza a usar un huérfano entre la consulta del lote y el borrado
+        orphan = storage.save('invoices/sha256/00/huerfano.pdf', ContentFile(b'%PDF-huerfano'))
+        original_size = storage.size
+
+        def size_while_reused(name):
+            Invoice.objects.filter(pk=reused.pk).update(invoice_pdf=orphan)
+            return original_size(name)
+
+        with patch.object(storage, 'size', size_while_reused):
+            call_command('gc_invoice_blobs', min_age_minutes=0, stdout=io.StringIO())
+
+        self.assertTrue(storage.exists(orphan))
+
+    def test_gc_dry_run_keeps_files(self):
+        storage = Invoice._meta.get_field('invoice_pdf').storage
+        orphan = storage.save('invoices/sha256/00/huerfano.pdf', ContentFile(b'%PDF-huerfano'))
+
+        call_command('gc_invoice_blobs', min_age_minutes=0, dry_run=True, stdout=io.StringIO())
+
+        self.assertTrue(storage.exists(orphan))
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_loadtest')
+class CheckoutLoadTestCommandTests(LiveServerTestCase):
+    """
+    El comando loadtest_checkout contra el servidor de pruebas de Django,
+    con su Stripe falso en un puerto libre.
+    """
+
+    def setUp(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.stripe_port = sock.getsockname()[1]
+
+        from payments.psp import build_stripe_http_client
+        from payments.resilience import reset_breakers
+        reset_breakers()
+        previous = (stripe.api_base, stripe.api_key, stripe.default_http_client)
+        self.addCleanup(lambda: setattr(stripe, 'api_base', previous[0]) or setattr(stripe, 'api_key', previous[1])
+                        or setattr(stripe, 'default_http_client', previous[2]))
+        stripe.api_base = f'http://127.0.0.1:{self.stripe_port}'
+        stripe.api_key = 'sk_test_fake'
+        stripe.default_http_client = build_stripe_http_client()
+
+        tax = TaxRate.objects.create(name="IVA Test", rate=Decimal("21.00"))
+        RegionTaxRule.objects.create(region_code="ES", tax_rate=tax)
+
+    def test_drives_full_checkout(self):
+        result_file = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        result_file.close()
+        self.addCleanup(Path(result_file.name).unlink)
+
+        call_command('loadtest_checkout', base_url=self.live_server_url, users=2, checkouts=2,
+                     stripe_port=self.stripe_port, stripe_latency=0, json_output=result_file.name,
+                     stdout=io.StringIO(), stderr=io.StringIO())
+
+        result = json.loads(Path(result_file.name).read_text())
+        self.assertEqual((result['checkouts_completed'], result['error_rate']), (4, 0.0))
+        self.assertEqual(result['steps']['webhook']['requests'], 4)
+        self.assertEqual(Order.objects.filter(user__username__startswith='loadtest-').count(), 4)
+        self.assertEqual(WebhookEvent.objects.count(), 4)
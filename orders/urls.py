@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import OrderListCreateAPIView, OrderRetrieveAPIView
+from .views import OrderListCreateAPIView, OrderRetrieveAPIView, InvoiceBundleAPIView
 
 app_name = "orders"
 
@@ -14,5 +14,10 @@ urlpatterns = [
         OrderRetrieveAPIView.as_view(),
         name="order-retrieve",
     ),
+    path(
+        "invoices/bundle/",
+        InvoiceBundleAPIView.as_view(),
+        name="invoice-bundle",
+    ),
 
 ]
@@ -4,14 +4,16 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
 from django.db import transaction
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 
 from .models import Order, OrderItem
 from cart.models import ShoppingCart  # Necesitamos el carrito para crearlo
 from pricing.services import calculate_cart_totals  # Necesitamos el servicio de impuestos
+from payments.services import invoices_for_export, iter_invoice_zip, month_date_range
 
 from .serializers import (
     CreateOrderRequestSerializer,
+    InvoiceBundleRequestSerializer,
     OrderAcceptedResponseSerializer,
     OrderResponseSerializer
 )
@@ -61,7 +63,7 @@ class OrderListCreateAPIView(APIView):
                     user=request.user,
                     status=Order.OrderStatus.PENDING,  # La orden está PENDIENTE hasta que se pague
                     amount=totals['total'],
-                    currency="EUR",  # TODO: Sacar de 'totals' o 'request'
+                    currency=totals['currency'],
                     subtotal=totals['subtotal'],
                     tax_total=totals['tax_amount'],
                     tax_percent=totals['tax_rate_percent'],
@@ -106,6 +108,11 @@ class OrderRetrieveAPIView(generics.RetrieveAPIView):
     Corresponde a: GET /api/v1/orders/{order_id}
     Obtiene el detalle de una orden específica.
     """
+    # Consultas por petición, sesión y autenticación incluidas (ver RequestTimingMiddleware)
+    query_budget = 4
+    psp_call_budget = 0
+    # GET desde la réplica (ver ReplicaRoutingMiddleware)
+    read_replica = True
     permission_classes = [IsAuthenticated]
     serializer_class = OrderResponseSerializer
     queryset = Order.objects.all()
@@ -116,4 +123,39 @@ class OrderRetrieveAPIView(generics.RetrieveAPIView):
 
     def get_queryset(self):
         """Asegura que un usuario solo pueda ver sus propias órdenes."""
-        return Order.objects.filter(user=self.request.user)
\ No newline at end of file
+        return Order.objects.filter(user=self.request.user)
+
+
+# Corresponde a: GET /api/v1/invoices/bundle/
+class InvoiceBundleAPIView(APIView):
+    """
+    Corresponde a: GET /api/v1/invoices/bundle/?month=2025-11
+    (o ?date_from=2025-11-01&date_to=2025-11-30)
+    Descarga en streaming un ZIP con las facturas PDF del usuario.
+    Un usuario staff puede pedir las de otro usuario con ?user_id=.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        serializer = InvoiceBundleRequestSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        params = serializer.validated_data
+
+        user_id = request.user.id
+        if 'user_id' in params and params['user_id'] != request.user.id:
+            if not request.user.is_staff:
+                return Response({"error": "No puedes descargar facturas de otro usuario."}, status=status.HTTP_403_FORBIDDEN)
+            user_id = params['user_id']
+
+        if 'month' in params:
+            date_from, date_to = month_date_range(params['month'])
+            label = params['month']
+        else:
+            date_from, date_to = params.get('date_from'), params.get('date_to')
+            label = f"{date_from or 'inicio'}_{date_to or 'hoy'}"
+
+        invoices = invoices_for_export(user_id=user_id, date_from=date_from, date_to=date_to)
+        response = StreamingHttpResponse(iter_invoice_zip(invoices), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="facturas_{user_id}_{label}.zip"'
+        return response
\ No newline at end of file
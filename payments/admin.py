@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import PaymentMethod, Customer
+from .models import PaymentMethod, Customer, WebhookEvent, ProcessedWebhookEvent, PaymentAttempt
 
 admin.site.register(PaymentMethod)
-admin.site.register(Customer)
\ No newline at end of file
+admin.site.register(Customer)
+admin.site.register(WebhookEvent)
+admin.site.register(ProcessedWebhookEvent)
+admin.site.register(PaymentAttempt)
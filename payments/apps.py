@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class PaymentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'payments'
+
+    def ready(self):
+        from django.conf import settings
+        from django.db.models.signals import post_delete, post_save
+
+        from proyecto_gps_25_26_ga02_pagos.authentication import forget_token_user
+        from proyecto_gps_25_26_ga02_pagos.metrics import register_collector
+        from .metrics import collect_payment_metrics
+        register_collector(collect_payment_metrics)
+
+        # Borrar o desactivar un usuario corta sus tokens de la API (ver check_token_user)
+        post_save.connect(forget_token_user, sender=settings.AUTH_USER_MODEL, dispatch_uid='api-token-user-save')
+        post_delete.connect(forget_token_user, sender=settings.AUTH_USER_MODEL, dispatch_uid='api-token-user-delete')
@@ -0,0 +1,326 @@
+"""
+Stripe falso para pruebas de carga y desarrollo sin conexión.
+
+Un servidor HTTP local que implementa la parte de la API de Stripe que usa
+la app (Customer, PaymentMethod attach/detach, PaymentIntent create/list)
+con latencia y tasa de errores configurables. Tras cada cobro envía el
+webhook firmado (payment_intent.succeeded / payment_failed) a
+StripeWebhookAPIView, como haría Stripe.
+
+Arranque: python manage.py run_fake_stripe, y en el .env:
+
+    STRIPE_API_BASE=http://127.0.0.1:12111
+    STRIPE_SECRET_KEY=sk_test_fake
+
+Tokens de prueba: cualquier 'pm_card_...' es una Visa 4242 válida, salvo
+'pm_card_chargeDeclined', que se rechaza al cobrar.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+DECLINED_TOKEN = 'pm_card_chargeDeclined'
+
+CARD_BRANDS = {
+    'pm_card_visa': ('visa', '4242'),
+    'pm_card_mastercard': ('mastercard', '4444'),
+    DECLINED_TOKEN: ('visa', '0002'),
+}
+
+
+class FakeStripeError(Exception):
+    def __init__(self, status: int, error_type: str, message: str, code: str = None, param: str = None, **extra):
+        super().__init__(message)
+        self.status = status
+        self.body = {'error': {'type': error_type, 'message': message, 'code': code, 'param': param, **extra}}
+
+
+def _new_id(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+def parse_form(pairs) -> dict:
+    """
+    Deshace la codificación de Stripe: 'metadata[order_id]=x' -> {'metadata': {'order_id': 'x'}}.
+    """
+    data = {}
+    for key, value in pairs:
+        parts = re.findall(r'[^\[\]]+', key)
+        target = data
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return data
+
+
+def sign_webhook_payload(payload: bytes, secret: str, timestamp: int = None) -> str:
+    """
+    Cabecera Stripe-Signature para 'payload', con el mismo esquema que Stripe.
+    """
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signed = f"{timestamp}.".encode() + payload
+    signature = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+class FakeStripe:
+    """
+    Estado y lógica de la API falsa. Es independiente del servidor HTTP para
+    poder usarla también desde los tests.
+
+    - latency: segundos de espera por petición (con +-20% de jitter).
+    - error_rate: fracción de peticiones que fallan con un 500 (api_error).
+    - deliver_webhook(payload, signature): cómo se entregan los eventos; por
+      defecto, POST a webhook_url desde un hilo aparte.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, webhook_url: str = None,
+                 webhook_secret: str = None, deliver_webhook=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.deliver_webhook = deliver_webhook
+        self.customers = {}
+        self.payment_methods = {}
+        self.payment_intents = {}
+        self.declining_payment_methods = set()
+        self.idempotent_responses = {}
+        self.requests_served = 0
+        self._lock = threading.Lock()
+        self._webhooks = queue.Queue()
+        if self.deliver_webhook is None and self.webhook_url:
+            threading.Thread(target=self._webhook_worker, daemon=True).start()
+
+    # ----- Peticiones -----
+
+    ROUTES = [
+        ('POST', r'/v1/customers', 'create_customer'),
+        ('GET', r'/v1/customers/(?P<id>[^/]+)', 'retrieve_customer'),
+        ('POST', r'/v1/customers/(?P<id>[^/]+)', 'modify_customer'),
+        ('GET', r'/v1/payment_methods/(?P<id>[^/]+)', 'retrieve_payment_method'),
+        ('POST', r'/v1/payment_methods/(?P<id>[^/]+)/attach', 'attach_payment_method'),
+        ('POST', r'/v1/payment_methods/(?P<id>[^/]+)/detach', 'detach_payment_method'),
+        ('POST', r'/v1/payment_intents', 'create_payment_intent'),
+        ('GET', r'/v1/payment_intents', 'list_payment_intents'),
+        ('GET', r'/v1/payment_intents/(?P<id>[^/]+)', 'retrieve_payment_intent'),
+    ]
+
+    def handle(self, method: str, path: str, params: dict, idempotency_key: str = None):
+        """
+        Atiende una petición. Devuelve (status, cuerpo JSON como dict).
+        """
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.8, 1.2))
+        with self._lock:
+            self.requests_served += 1
+            if idempotency_key and (method, idempotency_key) in self.idempotent_responses:
+                return self.idempotent_responses[(method, idempotency_key)]
+
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, {'error': {'type': 'api_error', 'message': "Fake Stripe: error simulado"}}
+
+        for route_method, pattern, action in self.ROUTES:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                try:
+                    response = 200, getattr(self, action)(params, **match.groupdict())
+                except FakeStripeError as e:
+                    response = e.status, e.body
+                break
+        else:
+            response = 404, {'error': {'type': 'invalid_request_error', 'message': f"Unrecognized request URL ({method}: {path})"}}
+
+        if idempotency_key and method == 'POST':
+            with self._lock:
+                self.idempotent_responses[(method, idempotency_key)] = response
+        return response
+
+    def _get(self, collection: dict, object_id: str, param: str, name: str):
+        try:
+            return collection[object_id]
+        except KeyError:
+            raise FakeStripeError(404, 'invalid_request_error', f"No such {name}: '{object_id}'",
+                                  code='resource_missing', param=param)
+
+    def create_customer(self, params):
+        customer = {
+            'id': _new_id('cus'), 'object': 'customer', 'created': int(time.time()),
+            'email': params.get('email'), 'name': params.get('name'), 'description': params.get('description'),
+            'invoice_settings': {'default_payment_method': None}, 'metadata': params.get('metadata', {}),
+        }
+        self.customers[customer['id']] = customer
+        return customer
+
+    def retrieve_customer(self, params, id):
+        return self._get(self.customers, id, 'id', 'customer')
+
+    def modify_customer(self, params, id):
+        customer = self._get(self.customers, id, 'id', 'customer')
+        if 'invoice_settings' in params:
+            customer['invoice_settings'].update(params['invoice_settings'])
+        return customer
+
+    def retrieve_payment_method(self, params, id):
+        if id.startswith('pm_card_'):
+            return self._card_from_token(id)
+        return self._get(self.payment_methods, id, 'payment_method', 'payment_method')
+
+    def _card_from_token(self, token: str):
+        brand, last4 = CARD_BRANDS.get(token, CARD_BRANDS['pm_card_visa'])
+        payment_method = {
+            'id': _new_id('pm'), 'object': 'payment_method', 'type': 'card', 'customer': None,
+            'created': int(time.time()),
+            'card': {'brand': brand, 'last4': last4, 'exp_month': 12, 'exp_year': 2034},
+        }
+        if token == DECLINED_TOKEN:
+            self.declining_payment_methods.add(payment_method['id'])
+        return payment_method
+
+    def attach_payment_method(self, params, id):
+        customer = self._get(self.customers, params.get('customer'), 'customer', 'customer')
+        # Al adjuntar un token de prueba se crea un PaymentMethod permanente
+        payment_method = self._card_from_token(id) if id.startswith('pm_card_') else \
+            self._get(self.payment_methods, id, 'payment_method', 'payment_method')
+        payment_method['customer'] = customer['id']
+        self.payment_methods[payment_method['id']] = payment_method
+        return payment_method
+
+    def detach_payment_method(self, params, id):
+        payment_method = self._get(self.payment_methods, id, 'payment_method', 'payment_method')
+        payment_method['customer'] = None
+        return payment_method
+
+    def create_payment_intent(self, params):
+        customer_id = params.get('customer')
+        if customer_id:
+            self._get(self.customers, customer_id, 'customer', 'customer')
+        payment_method = self._get(self.payment_methods, params.get('payment_method'), 'payment_method',
+                                   'payment_method')
+        intent_id = _new_id('pi')
+        intent = {
+            'id': intent_id, 'object': 'payment_intent', 'created': int(time.time()),
+            'amount': int(params['amount']), 'currency': params.get('currency', 'eur'),
+            'customer': customer_id, 'payment_method': payment_method['id'],
+            'description': params.get('description'), 'metadata': params.get('metadata', {}),
+            'client_secret': f"{intent_id}_secret_{uuid.uuid4().hex[:12]}",
+            'status': 'requires_confirmation', 'last_payment_error': None,
+        }
+        self.payment_intents[intent_id] = intent
+        if params.get('confirm') != 'true':
+            return intent
+
+        if payment_method['id'] in self.declining_payment_methods:
+            intent['status'] = 'requires_payment_method'
+            intent['last_payment_error'] = {'type': 'card_error', 'code': 'card_declined',
+                                            'message': "Your card was declined."}
+            self.emit_event('payment_intent.payment_failed', intent)
+            raise FakeStripeError(402, 'card_error', "Your card was declined.", code='card_declined',
+                                  payment_intent=intent)
+
+        intent['status'] = 'succeeded'
+        self.emit_event('payment_intent.succeeded', intent)
+        return intent
+
+    def retrieve_payment_intent(self, params, id):
+        return self._get(self.payment_intents, id, 'id', 'payment_intent')
+
+    def list_payment_intents(self, params):
+        created = params.get('created', {})
+        intents = sorted(self.payment_intents.values(), key=lambda intent: (intent['created'], intent['id']), reverse=True)
+        if 'gte' in created:
+            intents = [intent for intent in intents if intent['created'] >= int(created['gte'])]
+        if 'lt' in created:
+            intents = [intent for intent in intents if intent['created'] < int(created['lt'])]
+        if 'starting_after' in params:
+            ids = [intent['id'] for intent in intents]
+            intents = intents[ids.index(params['starting_after']) + 1:] if params['starting_after'] in ids else []
+        limit = int(params.get('limit', 10))
+        return {'object': 'list', 'url': '/v1/payment_intents', 'data': intents[:limit], 'has_more': len(intents) > limit}
+
+    # ----- Webhooks -----
+
+    def emit_event(self, event_type: str, data_object: dict):
+        event = {
+            'id': _new_id('evt'), 'object': 'event', 'type': event_type, 'created': int(time.time()),
+            'livemode': False, 'data': {'object': dict(data_object)},
+        }
+        payload = json.dumps(event).encode()
+        signature = sign_webhook_payload(payload, self.webhook_secret or '')
+        if self.deliver_webhook is not None:
+            self.deliver_webhook(payload, signature)
+        elif self.webhook_url:
+            self._webhooks.put((payload, signature))
+
+    def _webhook_worker(self):
+        session = requests.Session()
+        while True:
+            payload, signature = self._webhooks.get()
+            try:
+                response = session.post(self.webhook_url, data=payload, timeout=10, headers={
+                    'Content-Type': 'application/json', 'Stripe-Signature': signature,
+                })
+                if response.status_code >= 300:
+                    logger.warning(f"Fake Stripe: el webhook respondió {response.status_code}")
+            except requests.RequestException as e:
+                logger.warning(f"Fake Stripe: no se pudo entregar el webhook: {e}")
+
+
+class FakeStripeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, como la API real
+
+    def _dispatch(self, method: str):
+        url = urlsplit(self.path)
+        if method == 'POST':
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+            params = parse_form(parse_qsl(body, keep_blank_values=True))
+        else:
+            params = parse_form(parse_qsl(url.query, keep_blank_values=True))
+
+        status, data = self.server.fake.handle(method, url.path, params, self.headers.get('Idempotency-Key'))
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Request-Id', _new_id('req'))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def log_message(self, format, *args):
+        logger.debug(f"Fake Stripe: {format % args}")
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, fake: FakeStripe):
+        super().__init__(address, FakeStripeRequestHandler)
+        self.fake = fake
+
+    @property
+    def api_base(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
@@ -0,0 +1,47 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.models import Order
+from payments.services import INVOICE_PDF_PROFILES, render_invoice_pdf
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara los perfiles de PDF de factura: bytes por factura y tiempo de render. "
+        "Usa los últimos pedidos de la BBDD (o pedidos de ejemplo si no hay ninguno)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=20, help="Número de pedidos a renderizar por perfil")
+        parser.add_argument('--profiles', nargs='+', default=list(INVOICE_PDF_PROFILES),
+                            help="Perfiles a comparar (por defecto todos)")
+
+    def handle(self, *args, **options):
+        unknown = set(options['profiles']) - set(INVOICE_PDF_PROFILES)
+        if unknown:
+            raise CommandError(f"Perfiles desconocidos: {', '.join(sorted(unknown))}")
+
+        orders = list(Order.objects.select_related('user').order_by('-created_at')[:options['orders']])
+        if not orders:
+            self.stdout.write("No hay pedidos en la BBDD, se usan pedidos de ejemplo sin guardar.")
+            orders = [Order(amount=Decimal("12.10"), subtotal=Decimal("10.00"), tax_total=Decimal("2.10"))
+                      for _ in range(options['orders'])]
+
+        # Primer render fuera de la medición (carga de fuentes, caché de estilos...)
+        render_invoice_pdf(orders[0], profile=options['profiles'][0])
+
+        self.stdout.write(f"{'perfil':<10} {'facturas':>8} {'bytes/factura':>14} {'ms/factura':>11} {'ms máx':>8}")
+        for profile in options['profiles']:
+            sizes, timings = [], []
+            for order in orders:
+                start = time.perf_counter()
+                pdf = render_invoice_pdf(order, profile=profile)
+                timings.append((time.perf_counter() - start) * 1000)
+                sizes.append(len(pdf))
+
+            self.stdout.write(
+                f"{profile:<10} {len(orders):>8} {sum(sizes) / len(sizes):>14.0f} "
+                f"{sum(timings) / len(timings):>11.1f} {max(timings):>8.1f}"
+            )
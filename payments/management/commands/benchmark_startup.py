@@ -0,0 +1,68 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Librerías pesadas que la app importa solo al usarlas (ver proyecto_gps_25_26_ga02_pagos.lazy)
+HEAVY_MODULES = ['stripe', 'weasyprint']
+
+# Se ejecuta en un proceso nuevo: lo mismo que hace un worker al arrancar
+STARTUP_SCRIPT = """
+import json, resource, sys, time
+from importlib import import_module
+
+eager = sys.argv[1:]
+start = time.perf_counter()
+for name in eager:
+    try:
+        import_module(name)
+    except Exception:
+        pass
+import django
+django.setup()
+from django.conf import settings
+import_module(settings.ROOT_URLCONF)
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'setup_ms': elapsed * 1000,
+    'rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'loaded': [name for name in %r if name in sys.modules],
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el arranque de un worker (django.setup() y carga de las URLs) en procesos nuevos: "
+        "tiempo y memoria máxima (RSS), importando Stripe y WeasyPrint al arrancar (como antes) "
+        "o solo al usarlos (como ahora)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help="Arranques por modo")
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError("--runs debe ser al menos 1")
+
+        self.stdout.write(f"{'modo':<10} {'arranques':>9} {'setup ms':>9} {'RSS MiB':>8}  cargados")
+        for mode, eager in [('eager', HEAVY_MODULES), ('lazy', [])]:
+            results = [self.start_process(eager) for _ in range(options['runs'])]
+            loaded = ', '.join(results[0]['loaded']) or '-'
+            self.stdout.write(
+                f"{mode:<10} {len(results):>9} {statistics.median(r['setup_ms'] for r in results):>9.1f} "
+                f"{statistics.median(r['rss_kib'] for r in results) / 1024:>8.1f}  {loaded}"
+            )
+
+    def start_process(self, eager) -> dict:
+        # Mismos settings que este proceso (manage.py ya ha fijado DJANGO_SETTINGS_MODULE)
+        result = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT % HEAVY_MODULES, *eager],
+            capture_output=True, text=True, env=os.environ.copy(), check=False,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"El proceso de arranque ha fallado:\n{result.stderr}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
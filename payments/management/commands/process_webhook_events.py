@@ -0,0 +1,38 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from payments.services import claim_webhook_events, process_webhook_events
+
+
+class Command(BaseCommand):
+    help = (
+        "Procesa los eventos de Stripe guardados por el webhook (WebhookEvent). "
+        "En serie dentro de cada pedido y en paralelo entre pedidos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Eventos reservados por lote")
+        parser.add_argument('--workers', type=int, default=4, help="Hilos para procesar pedidos distintos en paralelo")
+        parser.add_argument('--loop', action='store_true', help="No terminar al vaciar la bandeja: seguir esperando eventos")
+        parser.add_argument('--sleep', type=float, default=1.0, help="Segundos de espera con la bandeja vacía (con --loop)")
+        parser.add_argument('--reclaim-after', type=int, default=600,
+                            help="Segundos tras los que un evento PROCESSING se da por abandonado")
+
+    def handle(self, *args, **options):
+        reclaim_after = timedelta(seconds=options['reclaim_after'])
+        processed = 0
+
+        while True:
+            events = claim_webhook_events(options['batch_size'], reclaim_after=reclaim_after)
+            if events:
+                process_webhook_events(events, workers=options['workers'])
+                processed += len(events)
+                self.stdout.write(f"Lote de {len(events)} eventos procesado")
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f"Bandeja vacía. Eventos procesados: {processed}"))
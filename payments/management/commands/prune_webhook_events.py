@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.services import prune_webhook_events
+
+
+class Command(BaseCommand):
+    help = (
+        "Purga los IDs de eventos de Stripe ya procesados y los eventos resueltos "
+        "de la bandeja más antiguos que el periodo de retención."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.WEBHOOK_EVENT_RETENTION_DAYS,
+                            help="Días que se conservan (por defecto WEBHOOK_EVENT_RETENTION_DAYS)")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Filas borradas por consulta")
+
+    def handle(self, *args, **options):
+        deleted = prune_webhook_events(timedelta(days=options['days']), batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Borrados {deleted['processed_ids']} IDs procesados y {deleted['inbox_events']} eventos de la bandeja."
+        ))
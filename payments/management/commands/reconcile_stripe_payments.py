@@ -0,0 +1,64 @@
+import csv
+from collections import Counter
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.resilience import PSPUnavailable
+from payments.services import (
+    RECONCILE_CHUNK_SIZE,
+    RECONCILE_REPORT_FIELDS,
+    iter_stripe_payment_intents,
+    reconcile_payment_intents,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Concilia los PaymentIntents de Stripe con nuestros pedidos y escribe un CSV "
+        "con las discrepancias (p. ej. pagos completados con el pedido aún PENDIENTE "
+        "porque se perdió el webhook). Con --repair las corrige con los handlers de "
+        "los webhooks. Ej: python manage.py reconcile_stripe_payments --from 2025-11-01 --repair"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat,
+                            help="Fecha inicial (YYYY-MM-DD, por defecto hace 3 días)")
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat,
+                            help="Fecha final incluida (YYYY-MM-DD, por defecto hoy)")
+        parser.add_argument('--repair', action='store_true', help="Corrige los pedidos que se pueda")
+        parser.add_argument('--chunk-size', type=int, default=RECONCILE_CHUNK_SIZE,
+                            help="PaymentIntents cruzados por consulta a la BBDD")
+        parser.add_argument('--output', help="Fichero CSV del informe (por defecto, la salida estándar)")
+
+    def handle(self, *args, **options):
+        date_to = options['date_to'] or date.today()
+        date_from = options['date_from'] or date_to - timedelta(days=3)
+        if date_from > date_to:
+            raise CommandError("--from no puede ser posterior a --to")
+        created_from = datetime.combine(date_from, time.min, tzinfo=dt_timezone.utc)
+        created_to = datetime.combine(date_to + timedelta(days=1), time.min, tzinfo=dt_timezone.utc)
+
+        stats = Counter()
+        output = open(options['output'], 'w', newline='') if options['output'] else self.stdout
+        try:
+            writer = csv.DictWriter(output, fieldnames=RECONCILE_REPORT_FIELDS)
+            writer.writeheader()
+            payment_intents = iter_stripe_payment_intents(created_from, created_to)
+            for row in reconcile_payment_intents(payment_intents, chunk_size=options['chunk_size'],
+                                                 repair=options['repair'], stats=stats):
+                writer.writerow(row)
+        except PSPUnavailable as e:
+            raise CommandError(f"Stripe no disponible: {e}")
+        finally:
+            if options['output']:
+                output.close()
+
+        # El resumen va a stderr para no mezclarlo con el CSV
+        discrepancies = sum(stats[kind] for kind in stats
+                            if kind not in ('payment_intents', 'matched', 'without_order_id', 'repaired'))
+        self.stderr.write(
+            f"{stats['payment_intents']} PaymentIntents entre {date_from} y {date_to}: "
+            f"{stats['matched']} cuadran, {discrepancies} discrepancias, {stats['repaired']} reparadas, "
+            f"{stats['without_order_id']} sin order_id."
+        )
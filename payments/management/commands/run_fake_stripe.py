@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.fake_stripe import FakeStripe, FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Arranca un Stripe falso local (Customer, PaymentMethod, PaymentIntent) con latencia "
+        "y errores configurables, que envía los webhooks firmados a la app. Para usarlo: "
+        "STRIPE_API_BASE=http://127.0.0.1:12111 y STRIPE_SECRET_KEY=sk_test_fake."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--latency', type=float, default=0.3, help="Segundos de espera por petición")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Fracción de peticiones que fallan con un 500 (0-1)")
+        parser.add_argument('--webhook-url', default='http://127.0.0.1:8000/api/v1/webhooks/stripe/',
+                            help="Dónde se envían los webhooks (vacío para no enviarlos)")
+        parser.add_argument('--webhook-secret', default=settings.STRIPE_WEBHOOK_SECRET,
+                            help="Secreto con el que se firman (por defecto STRIPE_WEBHOOK_SECRET)")
+
+    def handle(self, *args, **options):
+        if not 0 <= options['error_rate'] <= 1:
+            raise CommandError("--error-rate debe estar entre 0 y 1")
+        if options['webhook_url'] and not options['webhook_secret']:
+            raise CommandError("Indica --webhook-secret o configura STRIPE_WEBHOOK_SECRET para firmar los webhooks")
+
+        fake = FakeStripe(
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            webhook_url=options['webhook_url'] or None,
+            webhook_secret=options['webhook_secret'],
+        )
+        server = FakeStripeServer((options['host'], options['port']), fake)
+        self.stdout.write(self.style.SUCCESS(
+            f"Stripe falso escuchando en {server.api_base} (latencia {options['latency']}s, "
+            f"errores {options['error_rate']:.0%}). Ctrl+C para parar."
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Peticiones atendidas: {fake.requests_served}")
@@ -0,0 +1,40 @@
+"""
+Métricas de pagos para /metrics (ver proyecto_gps_25_26_ga02_pagos.metrics).
+"""
+from django.utils import timezone
+
+from proyecto_gps_25_26_ga02_pagos.metrics import Histogram
+
+INVOICE_RENDER_LATENCY = Histogram(
+    'invoice_render_duration_seconds', "Duración del render del PDF de factura por perfil", label='profile',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+
+def collect_payment_metrics():
+    """
+    Bandeja de webhooks pendiente, contadores del procesador de webhooks y
+    estado de los circuit breakers de Stripe.
+    """
+    from .models import WebhookEvent
+    from .resilience import CircuitBreaker, get_breaker_metrics
+    from .services import get_webhook_counters
+
+    pending = WebhookEvent.objects.filter(status=WebhookEvent.Status.PENDING)
+    oldest = pending.order_by('received_at').values_list('received_at', flat=True).first()
+    oldest_age = (timezone.now() - oldest).total_seconds() if oldest else 0.0
+
+    breakers = get_breaker_metrics()
+    states = (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN)
+    return [
+        ('webhook_backlog_events', 'gauge', "Eventos de Stripe pendientes de procesar",
+         {(): pending.count()}),
+        ('webhook_backlog_oldest_age_seconds', 'gauge', "Antigüedad del evento pendiente más antiguo",
+         {(): oldest_age}),
+        ('webhook_events_total', 'counter', "Eventos procesados por el procesador de webhooks, por resultado",
+         {(('result', name),): value for name, value in get_webhook_counters().items()}),
+        ('stripe_circuit_state', 'gauge', "Estado del breaker de cada endpoint (0 cerrado, 1 semiabierto, 2 abierto)",
+         {(('endpoint', name),): states.index(snapshot['state']) for name, snapshot in breakers.items()}),
+        ('stripe_circuit_rejected_total', 'counter', "Llamadas rechazadas con el breaker abierto",
+         {(('endpoint', name),): snapshot['rejected'] for name, snapshot in breakers.items()}),
+    ]
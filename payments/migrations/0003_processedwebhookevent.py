@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-19 16:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_customer_webhookevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True)),
+                ('event_type', models.CharField(max_length=100)),
+                ('processed_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-19 16:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_alter_order_status_disputed'),
+        ('payments', '0003_processedwebhookevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempt_number', models.PositiveIntegerField()),
+                ('idempotency_key', models.CharField(max_length=255, unique=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('currency', models.CharField(max_length=3)),
+                ('intent_id', models.CharField(blank=True, db_index=True, help_text='ID del PaymentIntent (pi_...)', max_length=255)),
+                ('client_secret', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(choices=[('CREATED', 'Creado'), ('REQUIRES_ACTION', 'Requiere acción'), ('PROCESSING', 'Procesando'), ('SUCCEEDED', 'Completado'), ('FAILED', 'Fallido'), ('CANCELED', 'Cancelado')], default='CREATED', max_length=20)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_attempts', to='orders.order')),
+                ('payment_method', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_attempts', to='payments.paymentmethod')),
+            ],
+            options={
+                'ordering': ['order', 'attempt_number'],
+                'unique_together': {('order', 'attempt_number')},
+            },
+        ),
+    ]
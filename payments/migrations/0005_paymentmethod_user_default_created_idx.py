@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-19 16:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_paymentattempt'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymentmethod',
+            index=models.Index(fields=['user', '-is_default', '-created_at'], name='pm_user_default_created_idx'),
+        ),
+    ]
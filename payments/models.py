@@ -36,4 +36,107 @@ class PaymentMethod(models.Model):
         return f"{self.brand} **** {self.last4} (Usuario: {self.user.username})"
 
     class Meta:
-        ordering = ['-is_default', '-created_at']
\ No newline at end of file
+        ordering = ['-is_default', '-created_at']
+        indexes = [
+            # Cubre el listado del usuario en el orden de 'ordering'
+            models.Index(fields=['user', '-is_default', '-created_at'], name='pm_user_default_created_idx'),
+        ]
+
+
+class WebhookEvent(models.Model):
+    """
+    Bandeja de entrada de eventos de Stripe con la firma ya verificada.
+    El webhook solo los guarda y responde 200; el comando
+    'process_webhook_events' los procesa después por lotes.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pendiente'
+        PROCESSING = 'PROCESSING', 'Procesando'
+        DONE = 'DONE', 'Procesado'
+        FAILED = 'FAILED', 'Fallido'
+
+    event_id = models.CharField(max_length=255, db_index=True, help_text="ID del evento en Stripe (evt_...)")
+    event_type = models.CharField(max_length=100)
+    # order_id de la metadata: los eventos de un mismo pedido se procesan en orden
+    order_id = models.CharField(max_length=64, blank=True, db_index=True)
+    payload = models.JSONField(help_text="Evento tal y como lo envió Stripe")
+
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} ({self.status})"
+
+    class Meta:
+        ordering = ['received_at', 'pk']
+        indexes = [
+            models.Index(fields=['status', 'received_at'], name='webhook_status_received_idx'),
+        ]
+
+
+class ProcessedWebhookEvent(models.Model):
+    """
+    IDs de los eventos de Stripe ya procesados. Stripe entrega cada evento
+    "al menos una vez": un reenvío se descarta con una sola consulta al índice
+    único, antes de tocar ningún pedido. Se purga con 'prune_webhook_events'.
+    """
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    processed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id}"
+
+
+class PaymentAttempt(models.Model):
+    """
+    Intento de cobro de un pedido: un PaymentIntent de Stripe creado con una
+    clave de idempotencia fija (pedido + número de intento). Si el cliente
+    reintenta tras un timeout, se reenvía con la misma clave y Stripe devuelve
+    el mismo PaymentIntent en vez de cobrar dos veces. Los webhooks mantienen
+    el estado al día, así que consultarlo no requiere llamar a Stripe.
+    """
+    class Status(models.TextChoices):
+        CREATED = 'CREATED', 'Creado'  # Enviado a Stripe, sin respuesta todavía
+        REQUIRES_ACTION = 'REQUIRES_ACTION', 'Requiere acción'
+        PROCESSING = 'PROCESSING', 'Procesando'
+        SUCCEEDED = 'SUCCEEDED', 'Completado'
+        FAILED = 'FAILED', 'Fallido'
+        CANCELED = 'CANCELED', 'Cancelado'
+
+    # Tras estos estados, un nuevo intento del pedido usa el siguiente número (y otra clave)
+    RETRYABLE_STATUSES = (Status.FAILED, Status.CANCELED)
+
+    order = models.ForeignKey('orders.Order', on_delete=models.CASCADE, related_name='payment_attempts')
+    attempt_number = models.PositiveIntegerField()
+    idempotency_key = models.CharField(max_length=255, unique=True)
+    payment_method = models.ForeignKey(PaymentMethod, on_delete=models.SET_NULL, null=True, blank=True,
+                                       related_name='payment_attempts')
+
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3)
+
+    intent_id = models.CharField(max_length=255, blank=True, db_index=True, help_text="ID del PaymentIntent (pi_...)")
+    client_secret = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.CREATED)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @staticmethod
+    def build_idempotency_key(order_id, attempt_number: int) -> str:
+        return f"order-{order_id}-attempt-{attempt_number}"
+
+    def __str__(self):
+        return f"Pedido {self.order_id} intento {self.attempt_number} ({self.status})"
+
+    class Meta:
+        ordering = ['order', 'attempt_number']
+        unique_together = ('order', 'attempt_number')
@@ -0,0 +1,121 @@
+"""
+Configuración del cliente HTTP con el que hablamos con el PSP (Stripe).
+
+Todas las llamadas de la app pasan por un único cliente por proceso: una
+requests.Session compartida por los hilos del worker (keep-alive, así el
+handshake TCP/TLS con Stripe se paga una vez), con un pool de conexiones
+acotado y timeouts de conexión y de lectura.
+
+Las vistas asíncronas usan los métodos *_async de Stripe, que van por httpx
+(ver stripe_http.PooledHTTPXClient) si está instalado. Bajo ASGI comparten
+un httpx.AsyncClient por worker (ver share_async_stripe_connections).
+
+El SDK de Stripe se importa y se configura la primera vez que se usa: la app
+lo usa siempre a través de `from payments.psp import stripe`.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from proyecto_gps_25_26_ga02_pagos.lazy import LazyModule
+
+# Timeout (connect, read) para las llamadas hechas dentro de psp_timeout()
+_call_timeout = contextvars.ContextVar('stripe_call_timeout', default=None)
+# Reintentos de red de la librería dentro de psp_timeout() (None: stripe.max_network_retries)
+_call_network_retries = contextvars.ContextVar('stripe_call_network_retries', default=None)
+
+
+@contextmanager
+def psp_timeout(connect: float = None, read: float = None, network_retries: int = None):
+    """
+    Cambia los timeouts (y, si se indica, los reintentos de red de la
+    librería) de las llamadas a Stripe hechas dentro del bloque (también las
+    *_async: el valor es por tarea de asyncio):
+
+        with psp_timeout(read=5):
+            stripe.Customer.retrieve(customer_id)
+    """
+    token = _call_timeout.set((
+        connect if connect is not None else settings.STRIPE_CONNECT_TIMEOUT,
+        read if read is not None else settings.STRIPE_READ_TIMEOUT,
+    ))
+    retries_token = _call_network_retries.set(network_retries)
+    try:
+        yield
+    finally:
+        _call_network_retries.reset(retries_token)
+        _call_timeout.reset(token)
+
+
+# Las llamadas *_async comparten un httpx.AsyncClient (ver share_async_stripe_connections)
+_share_async_connections = False
+
+
+def share_async_stripe_connections():
+    """
+    Bajo un servidor ASGI hay un único event loop por worker y las llamadas
+    *_async pueden compartir un httpx.AsyncClient y sus conexiones. Lo llama
+    asgi.py antes de servir peticiones. Sin él (runserver/WSGI, un loop por
+    vista async) cada llamada abre y cierra su propio cliente.
+    """
+    global _share_async_connections
+    _share_async_connections = True
+
+
+def build_async_stripe_http_client():
+    """
+    Crea el cliente de las llamadas *_async, con como mucho
+    STRIPE_ASYNC_MAX_CONNECTIONS conexiones si las comparte. None si httpx no
+    está instalado (las vistas asíncronas fallarán al llamar a Stripe).
+    """
+    try:
+        import httpx
+    except ImportError:
+        return None
+    from .stripe_http import PooledHTTPXClient
+
+    return PooledHTTPXClient(
+        max_connections=settings.STRIPE_ASYNC_MAX_CONNECTIONS,
+        timeout=httpx.Timeout(settings.STRIPE_READ_TIMEOUT, connect=settings.STRIPE_CONNECT_TIMEOUT),
+        share_connections=_share_async_connections,
+    )
+
+
+def build_stripe_http_client():
+    """
+    Crea el cliente HTTP de Stripe (stripe_http.PooledRequestsClient): una
+    Session con keep-alive y como mucho STRIPE_HTTP_POOL_SIZE conexiones
+    abiertas hacia la API. Las llamadas *_async se delegan en el cliente de
+    build_async_stripe_http_client().
+    """
+    from requests.adapters import HTTPAdapter
+
+    from .stripe_http import CallTimeoutSession, PooledRequestsClient
+
+    session = CallTimeoutSession()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.STRIPE_HTTP_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return PooledRequestsClient(
+        session=session,
+        timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT),
+        async_fallback_client=build_async_stripe_http_client(),
+    )
+
+
+def configure_stripe(stripe_module):
+    """
+    Configura la librería de Stripe (clave, reintentos y cliente HTTP). La
+    llama LazyModule al importarla.
+    """
+    stripe_module.api_key = settings.STRIPE_SECRET_KEY
+    if settings.STRIPE_API_BASE:
+        # Por ejemplo, el Stripe falso de 'run_fake_stripe' para pruebas de carga sin conexión
+        stripe_module.api_base = settings.STRIPE_API_BASE
+    stripe_module.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+    stripe_module.default_http_client = build_stripe_http_client()
+
+
+# El SDK de Stripe, configurado, que se importa en el primer uso
+stripe = LazyModule('stripe', on_import=configure_stripe)
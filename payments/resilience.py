@@ -0,0 +1,301 @@
+"""
+Capa de resiliencia alrededor de las llamadas al PSP (Stripe).
+
+Cuando Stripe se degrada no queremos que cada petición espere el timeout
+completo de la librería y acabe agotando los workers. Todas las llamadas de
+la app pasan por psp_call / apsp_call, que aplican:
+
+- Un circuit breaker por endpoint de Stripe (customers, payment_intents...):
+  tras varios fallos seguidos se abre y las llamadas fallan al momento con
+  PSPUnavailable hasta que pasa STRIPE_BREAKER_RESET_TIMEOUT; entonces deja
+  pasar una llamada de prueba.
+- Un plazo total por petición (psp_deadline): el timeout de cada llamada se
+  recorta a lo que queda de plazo.
+- Reintentos con backoff exponencial y jitter, solo para llamadas seguras de
+  repetir (idempotent=True).
+
+Las vistas convierten PSPUnavailable en un 503 con cabecera Retry-After.
+"""
+import asyncio
+import contextvars
+import logging
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from proyecto_gps_25_26_ga02_pagos.instrumentation import record_psp_call
+
+from .psp import psp_timeout, stripe
+
+logger = logging.getLogger(__name__)
+
+
+class PSPUnavailable(Exception):
+    """
+    Stripe no está disponible (breaker abierto, plazo agotado o fallo de red/5xx).
+    """
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_psp_failure(error) -> bool:
+    """
+    True si el error indica que Stripe no está sano (red, timeout, 5xx o
+    límite de peticiones). Los errores de negocio (tarjeta rechazada, petición
+    inválida...) no cuentan para el breaker.
+    """
+    return isinstance(error, (stripe.APIConnectionError, stripe.APIError, stripe.RateLimitError))
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.counters = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> int:
+        if self.opened_at is None:
+            return 1
+        return max(1, math.ceil(self.opened_at + self.reset_timeout - time.monotonic()))
+
+    def before_call(self):
+        """
+        Lanza PSPUnavailable si el breaker no deja pasar la llamada.
+        """
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self._probe_in_flight):
+                self.counters['rejected'] += 1
+                raise PSPUnavailable(f"Circuito '{self.name}' abierto", retry_after=self.retry_after())
+            if self.state == self.HALF_OPEN:
+                # Solo una llamada de prueba a la vez
+                self._probe_in_flight = True
+            self.counters['calls'] += 1
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"PSP: Circuito '{self.name}' cerrado de nuevo.")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.counters['failures'] += 1
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.counters['opened'] += 1
+                    logger.warning(f"PSP: Circuito '{self.name}' abierto tras {self.consecutive_failures} fallos seguidos.")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        """
+        La llamada de prueba no ha llegado a saber si Stripe responde
+        (cancelada, interrumpida): otra puede probar.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self.consecutive_failures, **self.counters}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(
+                endpoint,
+                failure_threshold=settings.STRIPE_BREAKER_FAILURE_THRESHOLD,
+                reset_timeout=settings.STRIPE_BREAKER_RESET_TIMEOUT,
+            )
+        return breaker
+
+
+def get_breaker_metrics() -> dict:
+    """
+    Estado y contadores de cada breaker, por endpoint.
+    """
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+def reset_breakers():
+    with _breakers_lock:
+        _breakers.clear()
+
+
+# ----- Plazo total por petición -----
+
+# Instante (time.monotonic) en el que vence el plazo de la petición en curso
+_deadline = contextvars.ContextVar('psp_deadline', default=None)
+
+
+@contextmanager
+def psp_deadline(seconds: float = None):
+    """
+    Limita el tiempo total que las llamadas a Stripe del bloque pueden
+    consumir (reintentos y esperas incluidos). Un bloque anidado no puede
+    alargar el plazo del exterior.
+    """
+    seconds = settings.STRIPE_REQUEST_DEADLINE if seconds is None else seconds
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget():
+    """
+    Segundos que quedan del plazo en curso (None si no hay plazo).
+    """
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _call_timeouts():
+    """
+    Timeouts (connect, read) de la próxima llamada, recortados al plazo.
+    Lanza PSPUnavailable si el plazo ya se ha agotado.
+    """
+    remaining = remaining_budget()
+    if remaining is None:
+        return settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT
+    if remaining <= 0:
+        raise PSPUnavailable("Plazo de la petición agotado esperando a Stripe")
+    return min(settings.STRIPE_CONNECT_TIMEOUT, remaining), min(settings.STRIPE_READ_TIMEOUT, remaining)
+
+
+def _backoff(attempt: int):
+    """
+    Espera antes del reintento 'attempt' (1, 2...): full jitter sobre un
+    backoff exponencial. None si no cabe en lo que queda de plazo.
+    """
+    delay = random.uniform(0, settings.STRIPE_RETRY_BACKOFF * 2 ** (attempt - 1))
+    remaining = remaining_budget()
+    if remaining is not None and delay >= remaining:
+        return None
+    return delay
+
+
+# ----- Llamadas -----
+
+def _operation_name(endpoint: str, func) -> str:
+    # 'PaymentIntent.create' para los métodos de la librería de Stripe
+    return getattr(func, '__qualname__', None) or endpoint
+
+
+def psp_call(endpoint: str, func, *args, idempotent: bool = False, **kwargs):
+    """
+    Ejecuta una llamada a Stripe con breaker, plazo y (si es idempotente)
+    reintentos:
+
+        psp_call('customers', stripe.Customer.retrieve, customer_id, idempotent=True)
+
+    Las idempotentes las reintenta psp_call dentro del plazo, sin los
+    reintentos de red de la librería. El resto conserva los de la librería,
+    que repiten el POST con la misma clave de idempotencia.
+
+    Los errores de negocio de Stripe se relanzan tal cual; los fallos del PSP
+    acaban en PSPUnavailable.
+    """
+    breaker = get_breaker(endpoint)
+    operation = _operation_name(endpoint, func)
+    attempts = settings.STRIPE_RETRY_ATTEMPTS if idempotent else 1
+    for attempt in range(1, attempts + 1):
+        # Antes de before_call: si el plazo ya se ha agotado no se ocupa la llamada de prueba
+        connect, read = _call_timeouts()
+        breaker.before_call()
+        start = time.perf_counter()
+        try:
+            try:
+                with psp_timeout(connect=connect, read=read, network_retries=0 if idempotent else None):
+                    result = func(*args, **kwargs)
+            finally:
+                record_psp_call(operation, time.perf_counter() - start)
+        except Exception as e:
+            if not is_psp_failure(e):
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            delay = _backoff(attempt) if attempt < attempts else None
+            if delay is None:
+                raise PSPUnavailable(f"Stripe no disponible ({endpoint}): {e}",
+                                     retry_after=breaker.retry_after()) from e
+            logger.info(f"PSP: Reintentando '{endpoint}' en {delay:.2f}s (intento {attempt}): {e}")
+            time.sleep(delay)
+        except BaseException:
+            # CancelledError, KeyboardInterrupt...: sin resultado, pero sin dejar el breaker bloqueado
+            breaker.release_probe()
+            raise
+        else:
+            breaker.record_success()
+            return result
+
+
+async def apsp_call(endpoint: str, func, *args, idempotent: bool = False, **kwargs):
+    """
+    Versión asíncrona de psp_call, para los métodos *_async de Stripe.
+    """
+    breaker = get_breaker(endpoint)
+    operation = _operation_name(endpoint, func)
+    attempts = settings.STRIPE_RETRY_ATTEMPTS if idempotent else 1
+    for attempt in range(1, attempts + 1):
+        # Antes de before_call: si el plazo ya se ha agotado no se ocupa la llamada de prueba
+        connect, read = _call_timeouts()
+        breaker.before_call()
+        start = time.perf_counter()
+        try:
+            try:
+                with psp_timeout(connect=connect, read=read, network_retries=0 if idempotent else None):
+                    result = await func(*args, **kwargs)
+            finally:
+                record_psp_call(operation, time.perf_counter() - start)
+        except Exception as e:
+            if not is_psp_failure(e):
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            delay = _backoff(attempt) if attempt < attempts else None
+            if delay is None:
+                raise PSPUnavailable(f"Stripe no disponible ({endpoint}): {e}",
+                                     retry_after=breaker.retry_after()) from e
+            logger.info(f"PSP: Reintentando '{endpoint}' en {delay:.2f}s (intento {attempt}): {e}")
+            await asyncio.sleep(delay)
+        except BaseException:
+            # CancelledError, KeyboardInterrupt...: sin resultado, pero sin dejar el breaker bloqueado
+            breaker.release_probe()
+            raise
+        else:
+            breaker.record_success()
+            return result
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import PaymentMethod
+from .models import PaymentMethod, PaymentAttempt
 
 # Añadir un nuevo métdo de pago
 class AddPaymentMethodRequestSerializer(serializers.Serializer):
@@ -32,4 +32,22 @@ class PaymentIntentRequestSerializer(serializers.Serializer):
 class PaymentIntentResponseSerializer(serializers.Serializer):
     provider = serializers.CharField()
     client_secret = serializers.CharField()
-    payment_id = serializers.CharField() # El ID del PaymentIntent de Stripe
\ No newline at end of file
+    payment_id = serializers.CharField() # El ID del PaymentIntent de Stripe
+
+
+class PaymentAttemptSerializer(serializers.ModelSerializer):
+    payment_id = serializers.CharField(source='intent_id')
+    order_id = serializers.UUIDField(source='order.order_id')
+
+    class Meta:
+        model = PaymentAttempt
+        fields = [
+            'payment_id',
+            'order_id',
+            'attempt_number',
+            'status',
+            'amount',
+            'currency',
+            'last_error',
+            'updated_at',
+        ]
@@ -1,27 +1,149 @@
-import stripe
 import logging
+import zipfile
+import calendar
+import hashlib
+import os
+import uuid
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.template.loader import render_to_string
 from django.core.files.base import ContentFile
-from weasyprint import HTML
-from django.db import transaction
+from django.db import transaction, connections
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
 
-from orders.models import Order, Invoice
+from orders.models import Order, Invoice, invoice_pdf_upload_to
+from proyecto_gps_25_26_ga02_pagos.routers import pin_user_to_primary
+from .models import Customer, WebhookEvent, ProcessedWebhookEvent, PaymentAttempt, PaymentMethod
+from .metrics import INVOICE_RENDER_LATENCY
+from .psp import stripe
+from .resilience import psp_call
 
 logger = logging.getLogger(__name__)
 
 
+# Tamaño de los bloques que se leen de cada PDF al construir un ZIP
+INVOICE_ZIP_CHUNK_SIZE = 64 * 1024
+
+
+def invoice_filename(order: Order) -> str:
+    return f'factura_{order.order_id}.pdf'
+
+
+# Perfiles de salida del PDF de factura (opciones de WeasyPrint.write_pdf).
+# Se elige uno con settings.INVOICE_PDF_PROFILE.
+INVOICE_PDF_PROFILES = {
+    # Render lo más rápido posible: se conservan las instrucciones de hinting
+    # de las fuentes y no se recomprimen imágenes
+    'fast': {
+        'hinting': True,
+        'optimize_images': False,
+    },
+    # Fuentes reducidas (subset) sin hinting e imágenes optimizadas sin perder calidad
+    'balanced': {
+        'hinting': False,
+        'optimize_images': True,
+    },
+    # Tamaño mínimo: además se baja la resolución y la calidad JPEG de las imágenes
+    'smallest': {
+        'hinting': False,
+        'optimize_images': True,
+        'jpeg_quality': 60,
+        'dpi': 150,
+    },
+}
+DEFAULT_INVOICE_PDF_PROFILE = 'balanced'
+
+
+def get_invoice_pdf_options(profile: str = None) -> dict:
+    """
+    Devuelve las opciones de WeasyPrint del perfil indicado
+    (o del configurado en settings.INVOICE_PDF_PROFILE).
+    """
+    profile = profile or getattr(settings, 'INVOICE_PDF_PROFILE', DEFAULT_INVOICE_PDF_PROFILE)
+    try:
+        options = INVOICE_PDF_PROFILES[profile]
+    except KeyError:
+        raise ImproperlyConfigured(
+            f"INVOICE_PDF_PROFILE '{profile}' no existe. Opciones: {', '.join(INVOICE_PDF_PROFILES)}"
+        )
+    # Las fuentes siempre se incrustan reducidas a los glifos usados
+    return {'full_fonts': False, **options}
+
+
+def render_invoice_pdf(order: Order, profile: str = None) -> bytes:
+    """
+    Renderiza el PDF de la factura de un pedido (sin guardarlo).
+    """
+    # Aquí y no arriba: WeasyPrint carga Cairo, Pango y fontTools, y solo lo
+    # necesitan los procesos que generan facturas
+    from weasyprint import HTML
+
+    profile = profile or getattr(settings, 'INVOICE_PDF_PROFILE', DEFAULT_INVOICE_PDF_PROFILE)
+    start = time.perf_counter()
+    html_string = render_to_string('invoices/invoice.html', {'order': order})
+    pdf_file = HTML(string=html_string).write_pdf(**get_invoice_pdf_options(profile))
+    INVOICE_RENDER_LATENCY.observe(time.perf_counter() - start, profile)
+    return pdf_file
+
+
+def _touch_blob(storage, name: str) -> bool:
+    """
+    Renueva la fecha de un blob que se va a reutilizar, para que
+    gc_invoice_blobs no lo tome por un huérfano antiguo. False si ya no existe.
+    """
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        # Storage remoto: sin fecha que renovar; gc_invoice_blobs vuelve a comprobar antes de borrar
+        return True
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def store_invoice_pdf(invoice: Invoice, filename: str, pdf_file: bytes):
+    """
+    Guarda el PDF bajo el hash de su contenido (ver invoice_pdf_upload_to).
+    Si ya existe un fichero con los mismos bytes, no se vuelve a escribir.
+    """
+    invoice.content_hash = hashlib.sha256(pdf_file).hexdigest()
+    blob_name = invoice_pdf_upload_to(invoice, filename)
+    storage = invoice.invoice_pdf.storage
+
+    if storage.exists(blob_name) and _touch_blob(storage, blob_name):
+        invoice.invoice_pdf.name = blob_name
+        invoice.save(update_fields=['invoice_pdf', 'content_hash'])
+        return
+
+    invoice.invoice_pdf.save(filename, ContentFile(pdf_file), save=False)
+    if invoice.invoice_pdf.name != blob_name:
+        # Otro proceso escribió el mismo blob a la vez y el storage renombró
+        # el nuestro: borramos la copia y apuntamos al blob canónico.
+        storage.delete(invoice.invoice_pdf.name)
+        invoice.invoice_pdf.name = blob_name
+    invoice.save(update_fields=['invoice_pdf', 'content_hash'])
+
+
 def generate_invoice_pdf_for_order(order: Order):
     """
     Genera el PDF y crea el objeto Invoice.
     """
     try:
-        html_string = render_to_string('invoices/invoice.html', {'order': order})
-        pdf_file = HTML(string=html_string).write_pdf()
-        filename = f'factura_{order.order_id}.pdf'
+        pdf_file = render_invoice_pdf(order)
+        filename = invoice_filename(order)
 
         invoice, _ = Invoice.objects.get_or_create(order=order)
-        invoice.invoice_pdf.save(filename, ContentFile(pdf_file), save=True)
+        store_invoice_pdf(invoice, filename, pdf_file)
 
         logger.info(f"Factura PDF generada y guardada para Pedido {order.order_id}")
         return invoice
@@ -30,60 +152,747 @@ def generate_invoice_pdf_for_order(order: Order):
         raise
 
 
-def handle_payment_intent_succeeded(event_data):
+def month_date_range(month: str):
+    """
+    Convierte 'YYYY-MM' en el primer y último día de ese mes.
+    """
+    year, month_number = (int(part) for part in month.split('-'))
+    last_day = calendar.monthrange(year, month_number)[1]
+    return date(year, month_number, 1), date(year, month_number, last_day)
+
+
+def invoices_for_export(user_id=None, date_from: date = None, date_to: date = None):
+    """
+    Facturas a exportar (de un usuario y/o rango de fechas), leídas por bloques
+    para no cargar todas en memoria.
+    """
+    invoices = Invoice.objects.select_related('order').order_by('created_at', 'pk')
+    if user_id is not None:
+        invoices = invoices.filter(order__user_id=user_id)
+    if date_from:
+        invoices = invoices.filter(created_at__date__gte=date_from)
+    if date_to:
+        invoices = invoices.filter(created_at__date__lte=date_to)
+    return invoices.iterator(chunk_size=200)
+
+
+class _ZipStreamBuffer:
+    """
+    Destino de escritura no 'seekable' para zipfile: acumula lo escrito
+    hasta que el generador lo entrega y lo vacía.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self._chunks:
+            data = b''.join(self._chunks)
+            self._chunks.clear()
+            yield data
+
+
+def _iter_invoice_pdf_chunks(invoice: Invoice):
+    """
+    Devuelve el PDF guardado de una factura en bloques.
+    Si el fichero no existe, lo renderiza al vuelo con el generador de facturas.
+    """
+    pdf = invoice.invoice_pdf
+    if pdf and pdf.storage.exists(pdf.name):
+        with pdf.storage.open(pdf.name, 'rb') as fh:
+            while chunk := fh.read(INVOICE_ZIP_CHUNK_SIZE):
+                yield chunk
+        return
+
+    logger.warning(f"Factura {invoice.pk} sin PDF almacenado. Renderizando al vuelo (Pedido {invoice.order.order_id})")
+    yield render_invoice_pdf(invoice.order)
+
+
+def iter_invoice_zip(invoices):
+    """
+    Genera un ZIP con los PDFs de las facturas, bloque a bloque.
+
+    Las entradas se guardan sin comprimir (ZIP_STORED) porque los PDF ya van
+    comprimidos. Solo hay un bloque de un PDF en memoria cada vez (más el índice
+    del ZIP, unos pocos bytes por entrada), así que el consumo no depende del
+    número de facturas.
+    """
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for invoice in invoices:
+            entry = zipfile.ZipInfo(invoice_filename(invoice.order), date_time=invoice.created_at.timetuple()[:6])
+            entry.compress_type = zipfile.ZIP_STORED
+            with archive.open(entry, mode='w', force_zip64=True) as dest:
+                for chunk in _iter_invoice_pdf_chunks(invoice):
+                    dest.write(chunk)
+                    yield from buffer.drain()
+            yield from buffer.drain()
+    # Directorio central del ZIP
+    yield from buffer.drain()
+
+
+def _stripe_customer_cache_key(stripe_customer_id: str) -> str:
+    return f"stripe-customer-verified:{stripe_customer_id}"
+
+
+def is_stripe_customer_verified(stripe_customer_id: str) -> bool:
+    """
+    True si hemos comprobado hace menos de STRIPE_CUSTOMER_VERIFY_TTL segundos
+    que el Customer existe en Stripe.
+    """
+    return cache.get(_stripe_customer_cache_key(stripe_customer_id), False)
+
+
+def mark_stripe_customer_verified(stripe_customer_id: str):
+    cache.set(_stripe_customer_cache_key(stripe_customer_id), True, timeout=settings.STRIPE_CUSTOMER_VERIFY_TTL)
+
+
+def forget_stripe_customer(stripe_customer_id: str):
+    """
+    El Customer ya no existe en Stripe: lo quitamos de la caché y de nuestra BBDD
+    para que el próximo get_or_create_stripe_customer cree uno nuevo.
+    """
+    cache.delete(_stripe_customer_cache_key(stripe_customer_id))
+    deleted, _ = Customer.objects.filter(stripe_customer_id=stripe_customer_id).delete()
+    if deleted:
+        logger.warning(f"Customer local {stripe_customer_id} borrado (ya no existe en Stripe)")
+
+
+# ----- Caché del listado de métodos de pago -----
+
+def _payment_methods_cache_key(user_id) -> str:
+    return f"payment-methods:{user_id}"
+
+
+def get_cached_payment_methods(user_id):
+    """
+    Listado serializado de los métodos de pago del usuario, o None si no
+    está en caché.
+    """
+    return cache.get(_payment_methods_cache_key(user_id))
+
+
+def cache_payment_methods(user_id, data):
+    cache.set(_payment_methods_cache_key(user_id), [dict(item) for item in data],
+              timeout=settings.PAYMENT_METHODS_CACHE_TTL)
+
+
+def invalidate_payment_methods_cache(user_id):
+    """
+    Llamar siempre que cambien los métodos de pago del usuario (alta, baja o
+    cambio de tarjeta por defecto).
+    """
+    cache.delete(_payment_methods_cache_key(user_id))
+
+
+# ----- Intentos de cobro (PaymentAttempt) -----
+
+# Estado de nuestro intento según el 'status' del PaymentIntent en Stripe
+PAYMENT_ATTEMPT_STATUS_BY_INTENT_STATUS = {
+    'requires_payment_method': PaymentAttempt.Status.FAILED,
+    'requires_confirmation': PaymentAttempt.Status.REQUIRES_ACTION,
+    'requires_action': PaymentAttempt.Status.REQUIRES_ACTION,
+    'processing': PaymentAttempt.Status.PROCESSING,
+    'requires_capture': PaymentAttempt.Status.PROCESSING,
+    'succeeded': PaymentAttempt.Status.SUCCEEDED,
+    'canceled': PaymentAttempt.Status.CANCELED,
+}
+
+
+def start_payment_attempt(order: Order, payment_method: PaymentMethod):
+    """
+    Intento con el que enviar (o reenviar) el cobro del pedido.
+
+    Un reintento del cliente reutiliza el último intento, y con él su clave
+    de idempotencia, salvo que ese intento fallase o se cancelase: entonces se
+    numera uno nuevo. Devuelve None si el pedido ya no está PENDIENTE y no
+    tiene ningún intento que devolver.
+    """
+    with transaction.atomic():
+        # Bloqueamos el pedido: dos peticiones simultáneas no deben numerar dos intentos
+        order = Order.objects.select_for_update().get(pk=order.pk)
+        last = order.payment_attempts.order_by('-attempt_number').first()
+        if last is not None and last.status not in PaymentAttempt.RETRYABLE_STATUSES:
+            return last
+        if order.status != Order.OrderStatus.PENDING:
+            return None
+
+        attempt_number = last.attempt_number + 1 if last else 1
+        return PaymentAttempt.objects.create(
+            order=order,
+            attempt_number=attempt_number,
+            idempotency_key=PaymentAttempt.build_idempotency_key(order.order_id, attempt_number),
+            payment_method=payment_method,
+            amount=order.amount,
+            currency=order.currency,
+        )
+
+
+def record_payment_attempt_intent(attempt: PaymentAttempt, intent):
+    """
+    Guarda la respuesta de Stripe (PaymentIntent) en el intento.
+    """
+    attempt.intent_id = intent.id
+    attempt.client_secret = intent.client_secret or ''
+    attempt.status = PAYMENT_ATTEMPT_STATUS_BY_INTENT_STATUS.get(intent.get('status'), attempt.status)
+    attempt.save(update_fields=['intent_id', 'client_secret', 'status', 'updated_at'])
+
+
+def fail_payment_attempt(attempt: PaymentAttempt, error: 'stripe.StripeError'):
+    """
+    Stripe rechazó el cobro: el siguiente intento del pedido usará otra clave.
+    """
+    payment_intent = getattr(getattr(error, 'error', None), 'payment_intent', None)
+    if payment_intent:
+        attempt.intent_id = payment_intent['id']
+    attempt.status = PaymentAttempt.Status.FAILED
+    attempt.last_error = error.user_message or str(error)
+    attempt.save(update_fields=['intent_id', 'status', 'last_error', 'updated_at'])
+
+
+def sync_payment_attempt(order: Order, payment_intent, status: str):
+    """
+    Actualiza desde un webhook el intento al que pertenece el PaymentIntent.
+    Si no llegamos a guardar su ID (timeout al crearlo), lo encontramos por
+    el número de intento de la metadata.
+    """
+    attempts = order.payment_attempts.filter(intent_id=payment_intent['id'])
+    if not attempts.exists():
+        attempt_number = (payment_intent.get('metadata') or {}).get('attempt_number')
+        if not attempt_number:
+            return
+        attempts = order.payment_attempts.filter(attempt_number=attempt_number)
+    attempts.update(intent_id=payment_intent['id'], status=status, updated_at=timezone.now())
+
+
+# ----- Handlers de eventos de Stripe -----
+
+class WebhookHandler:
+    """
+    Handler registrado para un tipo de evento de Stripe.
+
+    - order_scoped: el handler recibe el pedido del evento ya bloqueado
+      (select_for_update) y devuelve True si lo ha modificado. Quien lo llama
+      hace un único save() al final.
+    - batchable: el handler solo cambia el pedido (sin trabajo lento ni efectos
+      externos), así que varios eventos del mismo pedido se pueden aplicar
+      juntos en una sola transacción.
+    """
+    def __init__(self, event_type: str, func, batchable: bool, order_scoped: bool):
+        self.event_type = event_type
+        self.func = func
+        self.batchable = batchable
+        self.order_scoped = order_scoped
+
+
+WEBHOOK_HANDLERS = {}
+
+
+def webhook_handler(event_type: str, batchable: bool = False, order_scoped: bool = True):
     """
-    Lógica para el evento 'payment_intent.succeeded'.
-    Usa METADATA para encontrar la orden.
+    Registra una función como handler de un tipo de evento de Stripe.
     """
-    payment_intent = event_data['object']
-    payment_id = payment_intent['id']
+    def register(func):
+        WEBHOOK_HANDLERS[event_type] = WebhookHandler(event_type, func, batchable, order_scoped)
+        return func
+    return register
 
-    # 1. Obtenemos la metadata que pusimos en la vista (views.py)
-    metadata = payment_intent.get('metadata', {})
-    order_id = metadata.get('order_id')
 
+@webhook_handler('customer.deleted', batchable=True, order_scoped=False)
+def handle_customer_deleted(customer):
+    forget_stripe_customer(customer['id'])
+    logger.info(f"Webhook: Customer {customer['id']} eliminado en Stripe.")
+
+
+@webhook_handler('payment_intent.succeeded')
+def handle_payment_intent_succeeded(order: Order, payment_intent) -> bool:
+    # No es 'batchable': genera la factura PDF (lento) con el pedido bloqueado
+    sync_payment_attempt(order, payment_intent, PaymentAttempt.Status.SUCCEEDED)
+    if order.status != Order.OrderStatus.PENDING:
+        logger.info(f"Webhook: Pedido {order.order_id} ya no está PENDIENTE ({order.status}). PaymentIntent {payment_intent['id']} ignorado.")
+        return False
+
+    order.status = Order.OrderStatus.PAID
+    generate_invoice_pdf_for_order(order)
+    logger.info(f"Webhook: Pedido {order.order_id} (desde metadata) marcado como PAGADO.")
+    return True
+
+
+@webhook_handler('payment_intent.payment_failed', batchable=True)
+def handle_payment_intent_failed(order: Order, payment_intent) -> bool:
+    sync_payment_attempt(order, payment_intent, PaymentAttempt.Status.FAILED)
+    if order.status != Order.OrderStatus.PENDING:
+        logger.warning(f"Webhook: Pedido PENDIENTE {order.order_id} no encontrado para pago fallido.")
+        return False
+
+    order.status = Order.OrderStatus.FAILED
+    logger.warning(f"Webhook: Pedido {order.order_id} marcado como FAILED.")
+    return True
+
+
+@webhook_handler('payment_intent.canceled', batchable=True)
+def handle_payment_intent_canceled(order: Order, payment_intent) -> bool:
+    sync_payment_attempt(order, payment_intent, PaymentAttempt.Status.CANCELED)
+    if order.status != Order.OrderStatus.PENDING:
+        return False
+
+    order.status = Order.OrderStatus.FAILED
+    logger.warning(f"Webhook: PaymentIntent {payment_intent['id']} cancelado. Pedido {order.order_id} marcado como FAILED.")
+    return True
+
+
+@webhook_handler('charge.refunded', batchable=True)
+def handle_charge_refunded(order: Order, charge) -> bool:
+    if not charge.get('refunded'):
+        # Reembolso parcial: el pedido sigue pagado
+        logger.info(f"Webhook: Reembolso parcial ({charge.get('amount_refunded')}) del Pedido {order.order_id}.")
+        return False
+    if order.status not in (Order.OrderStatus.PAID, Order.OrderStatus.DISPUTED):
+        return False
+
+    order.status = Order.OrderStatus.REFUNDED
+    logger.info(f"Webhook: Pedido {order.order_id} marcado como REEMBOLSADO.")
+    return True
+
+
+@webhook_handler('charge.dispute.created', batchable=True)
+def handle_charge_dispute_created(order: Order, dispute) -> bool:
+    if order.status != Order.OrderStatus.PAID:
+        return False
+
+    order.status = Order.OrderStatus.DISPUTED
+    logger.warning(f"Webhook: Disputa {dispute['id']} ({dispute.get('reason')}) abierta sobre el Pedido {order.order_id}.")
+    return True
+
+
+def resolve_event_order_id(event_object):
+    """
+    order_id de nuestro pedido para un objeto de Stripe. Los PaymentIntent lo
+    llevan en la metadata; las disputas (y cargos sin metadata) apuntan a su
+    PaymentIntent: lo buscamos en nuestros intentos de cobro y, si no está,
+    leemos su metadata en Stripe.
+    """
+    order_id = (event_object.get('metadata') or {}).get('order_id')
+    if order_id:
+        return order_id
+
+    payment_intent_id = event_object.get('payment_intent')
+    if payment_intent_id:
+        order_uuid = (PaymentAttempt.objects.filter(intent_id=payment_intent_id)
+                      .values_list('order__order_id', flat=True).first())
+        if order_uuid:
+            return str(order_uuid)
+        payment_intent = psp_call('payment_intents', stripe.PaymentIntent.retrieve, payment_intent_id,
+                                  idempotent=True)
+        return (payment_intent.get('metadata') or {}).get('order_id')
+    return None
+
+
+def apply_order_events(order_id, handled_events):
+    """
+    Aplica varios eventos (lista de (WebhookHandler, objeto de Stripe)) sobre un
+    mismo pedido: un bloqueo y un save en una sola transacción. Devuelve True
+    si el pedido ha cambiado.
+    """
+    with transaction.atomic():
+        try:
+            order = Order.objects.select_for_update().get(order_id=order_id)
+        except (Order.DoesNotExist, ValidationError):
+            logger.error(f"Webhook: No se encontró Pedido con order_id {order_id}")
+            return False
+
+        changed = False
+        for handler, event_object in handled_events:
+            changed = handler.func(order, event_object) or changed
+        if changed:
+            order.save()
+            # El usuario consultará el pedido en cuanto vuelva de pagar
+            pin_user_to_primary(order.user_id)
+        return changed
+
+
+def dispatch_stripe_event(event_type: str, event_data, order_id: str = None):
+    """
+    Ejecuta la lógica de negocio de un evento de Stripe con su handler registrado.
+    Devuelve True si ha cambiado algún pedido.
+
+    order_id: el pedido ya resuelto ('' si el evento no tiene); si no se pasa,
+    se resuelve aquí (ver resolve_event_order_id).
+    """
+    handler = WEBHOOK_HANDLERS.get(event_type)
+    if handler is None:
+        logger.info(f"Webhook: Evento no manejado: {event_type}")
+        return False
+
+    logger.info(f"Webhook: Recibido '{event_type}'")
+    event_object = event_data['object']
+    if not handler.order_scoped:
+        handler.func(event_object)
+        return False
+
+    if order_id is None:
+        order_id = resolve_event_order_id(event_object)
     if not order_id:
-        logger.error(
-            f"Webhook: 'payment_intent.succeeded' (ID: {payment_id}) no tiene 'order_id' en sus metadata. No se puede procesar.")
-        return  # Salimos porque no podemos hacer nada
+        logger.error(f"Webhook: '{event_type}' (ID: {event_object['id']}) no tiene 'order_id' en sus metadata. No se puede procesar.")
+        return False
+    return apply_order_events(order_id, [(handler, event_object)])
 
-    try:
-        with transaction.atomic():
-            # 2. Buscamos la Orden por su ID exacto
-            order = Order.objects.select_for_update().get(
-                order_id=order_id,
-                status=Order.OrderStatus.PENDING  # Solo procesamos las pendientes
+
+# ----- Bandeja de entrada de webhooks (WebhookEvent) -----
+
+# Reintentos de un evento antes de dejarlo en FAILED
+WEBHOOK_MAX_ATTEMPTS = 5
+
+# Contadores del proceso: recibidos, reenvíos descartados, procesados, fallidos...
+_webhook_counters = Counter()
+_webhook_counters_lock = threading.Lock()
+
+
+def count_webhook(name: str, amount: int = 1):
+    with _webhook_counters_lock:
+        _webhook_counters[name] += amount
+
+
+def get_webhook_counters() -> dict:
+    with _webhook_counters_lock:
+        return dict(_webhook_counters)
+
+
+def is_duplicate_webhook_event(event_id: str) -> bool:
+    """
+    True si el evento ya se procesó (un reenvío de Stripe).
+    """
+    return ProcessedWebhookEvent.objects.filter(event_id=event_id).exists()
+
+
+def enqueue_webhook_event(event: dict) -> WebhookEvent:
+    """
+    Guarda un evento ya verificado para procesarlo después.
+    """
+    event_object = event['data']['object']
+    metadata = event_object.get('metadata') or {}
+    return WebhookEvent.objects.create(
+        event_id=event['id'],
+        event_type=event['type'],
+        order_id=metadata.get('order_id', ''),
+        payload=event,
+    )
+
+
+def claim_webhook_events(batch_size: int, reclaim_after: timedelta = timedelta(minutes=10)):
+    """
+    Reserva (PENDING -> PROCESSING) los eventos más antiguos de la bandeja.
+
+    La reserva es un UPDATE condicional, así que dos dispatchers nunca se
+    llevan el mismo evento. No se reservan eventos de pedidos que otro
+    dispatcher tiene a medias, para mantener el orden dentro de cada pedido:
+    la comprobación va dentro del propio UPDATE, no en una consulta previa.
+    """
+    now = timezone.now()
+    # Eventos de un dispatcher que murió a mitad de lote
+    WebhookEvent.objects.filter(
+        status=WebhookEvent.Status.PROCESSING, claimed_at__lt=now - reclaim_after
+    ).update(status=WebhookEvent.Status.PENDING, claimed_by='')
+
+    token = uuid.uuid4().hex
+    # Otro dispatcher tiene eventos del pedido. Los nuestros no cuentan: algunas
+    # BBDD ven en el UPDATE las filas que el mismo UPDATE ya ha cambiado
+    order_busy = Exists(
+        WebhookEvent.objects.filter(status=WebhookEvent.Status.PROCESSING, order_id=OuterRef('order_id'))
+        .exclude(order_id='').exclude(claimed_by=token)
+    )
+    with transaction.atomic():
+        # FOR UPDATE (donde la BBDD lo soporta): otro dispatcher que quiera los
+        # mismos eventos espera a que confirmemos y su UPDATE ya ve nuestra reserva
+        candidate_ids = list(
+            WebhookEvent.objects.select_for_update()
+            .filter(~order_busy, status=WebhookEvent.Status.PENDING)
+            .order_by('received_at', 'pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not candidate_ids:
+            return []
+        WebhookEvent.objects.filter(~order_busy, pk__in=candidate_ids, status=WebhookEvent.Status.PENDING).update(
+            status=WebhookEvent.Status.PROCESSING, claimed_by=token, claimed_at=now
+        )
+    return list(WebhookEvent.objects.filter(claimed_by=token, status=WebhookEvent.Status.PROCESSING))
+
+
+def _split_into_runs(events):
+    """
+    Junta los eventos 'batchable' consecutivos de un mismo pedido para
+    aplicarlos en una sola transacción. El resto va de uno en uno.
+    """
+    runs, previous_batchable = [], False
+    for event in events:
+        handler = WEBHOOK_HANDLERS.get(event.event_type)
+        batchable = bool(event.order_id) and handler is not None and handler.batchable and handler.order_scoped
+        if batchable and previous_batchable:
+            runs[-1].append(event)
+        else:
+            runs.append([event])
+        previous_batchable = batchable
+    return runs
+
+
+def _resolve_webhook_event_order_id(event: WebhookEvent) -> str:
+    """
+    order_id de un evento de la bandeja ('' si no tiene pedido). Los que no lo
+    traen en la metadata (disputas) pueden necesitar consultar a Stripe, así
+    que se resuelve antes de abrir la transacción y se guarda en el evento.
+    """
+    if event.order_id:
+        return event.order_id
+    handler = WEBHOOK_HANDLERS.get(event.event_type)
+    if handler is None or not handler.order_scoped:
+        return ''
+    order_id = resolve_event_order_id(event.payload['data']['object']) or ''
+    if order_id:
+        event.order_id = order_id
+        event.save(update_fields=['order_id'])
+    return order_id
+
+
+def _process_webhook_run(events):
+    """
+    Procesa un evento, o varios 'batchable' del mismo pedido, en una transacción.
+    Devuelve los que no eran duplicados.
+    """
+    # Fuera de la transacción: no tener la fila de ProcessedWebhookEvent
+    # bloqueada mientras esperamos a Stripe
+    order_id = _resolve_webhook_event_order_id(events[0])
+    with transaction.atomic():
+        # Registrar el ID y procesar van en la misma transacción: si el
+        # handler falla, el evento no queda marcado como procesado.
+        fresh = []
+        for event in events:
+            _, created = ProcessedWebhookEvent.objects.get_or_create(
+                event_id=event.event_id, defaults={'event_type': event.event_type}
             )
+            if created:
+                fresh.append(event)
 
-            # 3. Marcar la orden como Pagada
-            order.status = Order.OrderStatus.PAID
-            order.save()
+        if len(events) == 1:
+            if fresh:
+                dispatch_stripe_event(events[0].event_type, events[0].payload['data'], order_id=order_id)
+        elif fresh:
+            apply_order_events(order_id, [
+                (WEBHOOK_HANDLERS[event.event_type], event.payload['data']['object']) for event in fresh
+            ])
+    return fresh
 
-            # 4. Generar la factura PDF
-            generate_invoice_pdf_for_order(order)
 
-            logger.info(f"Webhook: Pedido {order.order_id} (desde metadata) marcado como PAGADO.")
+def _process_webhook_event_group(events):
+    """
+    Procesa en orden los eventos de un mismo pedido. Si uno falla, los
+    siguientes vuelven a la bandeja sin procesar para no romper el orden.
+    """
+    runs = _split_into_runs(events)
+    while runs:
+        run = runs.pop(0)
+        try:
+            fresh = _process_webhook_run(run)
+        except Exception as e:
+            if len(run) > 1:
+                # No sabemos qué evento del lote falló: se reintentan uno a uno
+                logger.warning(f"Webhook: Lote de {len(run)} eventos del Pedido {run[0].order_id} falló ({e}). Reintentando por separado.")
+                runs[:0] = [[event] for event in run]
+                continue
 
-    except Order.DoesNotExist:
-        logger.error(f"Webhook: No se encontró Pedido PENDIENTE con order_id {order_id} (PaymentIntent: {payment_id})")
-    except Exception as e:
-        logger.error(f"Webhook: Error al procesar Pedido {order_id}: {e}")
-        raise
+            event = run[0]
+            logger.error(f"Webhook: Error procesando evento {event.event_id}: {e}")
+            count_webhook('failed')
+            event.attempts += 1
+            event.last_error = str(e)
+            event.status = (WebhookEvent.Status.FAILED if event.attempts >= WEBHOOK_MAX_ATTEMPTS
+                            else WebhookEvent.Status.PENDING)
+            event.claimed_by = ''
+            event.save(update_fields=['attempts', 'last_error', 'status', 'claimed_by'])
+            WebhookEvent.objects.filter(pk__in=[pending.pk for later in runs for pending in later]).update(
+                status=WebhookEvent.Status.PENDING, claimed_by=''
+            )
+            return
 
+        count_webhook('processed', len(fresh))
+        if len(fresh) < len(run):
+            # Otra copia del mismo evento llegó a la bandeja antes de procesarse la primera
+            logger.info(f"Webhook: {len(run) - len(fresh)} evento(s) duplicado(s) descartado(s).")
+            count_webhook('duplicate_skipped', len(run) - len(fresh))
+        if len(run) > 1:
+            count_webhook('coalesced', len(run))
+        WebhookEvent.objects.filter(pk__in=[event.pk for event in run]).update(
+            status=WebhookEvent.Status.DONE, attempts=F('attempts') + 1, processed_at=timezone.now()
+        )
 
-def handle_payment_intent_failed(event_data):
-    payment_intent = event_data['object']
-    metadata = payment_intent.get('metadata', {})
-    order_id = metadata.get('order_id')
 
-    if not order_id:
-        logger.warning(f"Webhook: Pago fallido {payment_intent['id']} sin order_id.")
+def _process_webhook_event_group_in_thread(events):
+    try:
+        _process_webhook_event_group(events)
+    finally:
+        # Cada hilo del pool abre su propia conexión a la BBDD
+        connections.close_all()
+
+
+def process_webhook_events(events, workers: int = 1):
+    """
+    Procesa un lote reservado: en serie dentro de cada pedido y en paralelo
+    (hasta 'workers' hilos) entre pedidos distintos.
+    """
+    groups = defaultdict(list)
+    for event in events:
+        groups[event.order_id or f"event:{event.pk}"].append(event)
+
+    if workers <= 1:
+        for group in groups.values():
+            _process_webhook_event_group(group)
         return
 
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(_process_webhook_event_group_in_thread, groups.values()))
+
+
+def prune_webhook_events(older_than: timedelta, batch_size: int = 1000) -> dict:
+    """
+    Borra por lotes los IDs procesados y los eventos ya resueltos (DONE/FAILED)
+    de la bandeja más antiguos que 'older_than'.
+    """
+    cutoff = timezone.now() - older_than
+    querysets = {
+        'processed_ids': ProcessedWebhookEvent.objects.filter(processed_at__lt=cutoff),
+        'inbox_events': WebhookEvent.objects.filter(
+            received_at__lt=cutoff, status__in=[WebhookEvent.Status.DONE, WebhookEvent.Status.FAILED]
+        ),
+    }
+    deleted = {}
+    for name, queryset in querysets.items():
+        deleted[name] = 0
+        while batch := list(queryset.values_list('pk', flat=True)[:batch_size]):
+            deleted[name] += queryset.model.objects.filter(pk__in=batch).delete()[0]
+    return deleted
+
+
+# ----- Conciliación Stripe <-> pedidos -----
+
+# PaymentIntents cruzados con los pedidos por cada consulta (in_bulk)
+RECONCILE_CHUNK_SIZE = 1000
+
+RECONCILE_REPORT_FIELDS = ['kind', 'payment_intent', 'order_id', 'stripe_status', 'order_status', 'amount', 'repaired']
+
+# Evento cuyo handler repara cada discrepancia (el del webhook que se perdió).
+# El resto (succeeded_but_failed, amount_mismatch, order_not_found) se revisa a mano
+RECONCILE_REPAIR_EVENTS = {
+    'succeeded_not_paid': 'payment_intent.succeeded',
+    'failed_still_pending': 'payment_intent.payment_failed',
+    'canceled_still_pending': 'payment_intent.canceled',
+}
+
+
+def iter_stripe_payment_intents(created_from: datetime, created_to: datetime):
+    """
+    PaymentIntents creados en [created_from, created_to). Las páginas se piden
+    según se consumen (nunca hay más de una en memoria) y cada una pasa por
+    psp_call: auto_paging_iter() pediría las siguientes sin breaker, plazo ni
+    reintentos.
+    """
+    created = {'gte': int(created_from.timestamp()), 'lt': int(created_to.timestamp())}
+    cursor = {}
+    while True:
+        page = psp_call('payment_intents', stripe.PaymentIntent.list,
+                        created=created, limit=100, idempotent=True, **cursor)
+        yield from page.data
+        if not page.has_more or not page.data:
+            return
+        cursor = {'starting_after': page.data[-1]['id']}
+
+
+def _iter_chunks(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _metadata_order_uuid(payment_intent):
     try:
-        order = Order.objects.get(order_id=order_id, status=Order.OrderStatus.PENDING)
-        order.status = Order.OrderStatus.FAILED
-        order.save()
-        logger.warning(f"Webhook: Pedido {order_id} marcado como FAILED.")
-    except Order.DoesNotExist:
-        logger.warning(f"Webhook: Pedido PENDIENTE {order_id} no encontrado para pago fallido.")
\ No newline at end of file
+        return uuid.UUID((payment_intent.get('metadata') or {}).get('order_id') or '')
+    except ValueError:
+        return None
+
+
+def _reconcile_issue(payment_intent, order):
+    """
+    Tipo de discrepancia entre un PaymentIntent y su pedido, o None si cuadran.
+    """
+    if order is None:
+        return 'order_not_found'
+
+    stripe_status = payment_intent.get('status')
+    if stripe_status == 'succeeded':
+        if order.status == Order.OrderStatus.PENDING:
+            return 'succeeded_not_paid'
+        if order.status == Order.OrderStatus.FAILED:
+            # Cobrado con el pedido ya fallido (p. ej. un reintento tras el fallo):
+            # el handler solo paga pedidos PENDIENTES, hay que revisarlo a mano
+            return 'succeeded_but_failed'
+        if payment_intent.get('amount') != order.amount_minor:
+            return 'amount_mismatch'
+    elif order.status == Order.OrderStatus.PENDING:
+        if stripe_status == 'canceled':
+            return 'canceled_still_pending'
+        if stripe_status == 'requires_payment_method' and payment_intent.get('last_payment_error'):
+            return 'failed_still_pending'
+    return None
+
+
+def reconcile_payment_intents(payment_intents, chunk_size: int = RECONCILE_CHUNK_SIZE, repair: bool = False,
+                              stats: Counter = None):
+    """
+    Cruza los PaymentIntents con nuestros pedidos por metadata.order_id y
+    genera una fila (ver RECONCILE_REPORT_FIELDS) por cada discrepancia. Los
+    pedidos se cargan por lotes: una consulta in_bulk cada 'chunk_size'
+    PaymentIntents. Con repair=True se aplican los handlers de los webhooks.
+    """
+    stats = Counter() if stats is None else stats
+    for chunk in _iter_chunks(payment_intents, chunk_size):
+        keyed = [(payment_intent, _metadata_order_uuid(payment_intent)) for payment_intent in chunk]
+        orders = Order.objects.only('order_id', 'status', 'amount_minor').in_bulk(
+            {order_uuid for _, order_uuid in keyed if order_uuid}, field_name='order_id'
+        )
+
+        for payment_intent, order_uuid in keyed:
+            stats['payment_intents'] += 1
+            if order_uuid is None:
+                # No es un cobro de esta app
+                stats['without_order_id'] += 1
+                continue
+
+            order = orders.get(order_uuid)
+            kind = _reconcile_issue(payment_intent, order)
+            if kind is None:
+                stats['matched'] += 1
+                continue
+
+            stats[kind] += 1
+            repaired = False
+            if repair and kind in RECONCILE_REPAIR_EVENTS:
+                repaired = dispatch_stripe_event(RECONCILE_REPAIR_EVENTS[kind], {'object': payment_intent})
+                stats['repaired'] += repaired
+            yield {
+                'kind': kind,
+                'payment_intent': payment_intent['id'],
+                'order_id': str(order_uuid),
+                'stripe_status': payment_intent.get('status'),
+                'order_status': order.status if order else '',
+                'amount': payment_intent.get('amount'),
+                'repaired': repaired,
+            }
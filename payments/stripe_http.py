@@ -0,0 +1,132 @@
+"""
+Clientes HTTP de Stripe con timeout y reintentos por llamada (ver
+payments.psp). Están aparte porque heredan de las clases del SDK: importar
+este módulo importa stripe, y solo se importa al crear el cliente.
+
+Solo se usan los puntos de extensión públicos del SDK: la Session que recibe
+RequestsClient, los métodos request_with_retries* y la interfaz de
+HTTPClient para un cliente propio.
+"""
+import asyncio
+import ssl
+import textwrap
+
+import requests
+import stripe
+
+from .psp import _call_network_retries, _call_timeout
+
+
+def _network_retries(max_network_retries):
+    # psp_timeout(network_retries=...) manda sobre stripe.max_network_retries
+    call_retries = _call_network_retries.get()
+    return max_network_retries if call_retries is None else call_retries
+
+
+class CallTimeoutSession(requests.Session):
+    """
+    Session de requests que aplica el timeout de psp_timeout() a las
+    llamadas hechas dentro del bloque.
+    """
+
+    def request(self, method, url, **kwargs):
+        call_timeout = _call_timeout.get()
+        if call_timeout is not None:
+            kwargs['timeout'] = call_timeout
+        return super().request(method, url, **kwargs)
+
+
+class PooledRequestsClient(stripe.RequestsClient):
+    """
+    RequestsClient de Stripe con los reintentos de red de psp_timeout(). El
+    timeout por llamada lo pone su CallTimeoutSession.
+    """
+    name = "requests-pooled"
+
+    def request_with_retries(self, method, url, headers, post_data=None, max_network_retries=None, **kwargs):
+        return super().request_with_retries(method, url, headers, post_data,
+                                            _network_retries(max_network_retries), **kwargs)
+
+    async def request_with_retries_async(self, method, url, headers, post_data=None, max_network_retries=None,
+                                         **kwargs):
+        # Las *_async también pasan por aquí: async_fallback_client solo hace cada intento
+        return await super().request_with_retries_async(method, url, headers, post_data,
+                                                        _network_retries(max_network_retries), **kwargs)
+
+
+class PooledHTTPXClient(stripe.HTTPClient):
+    """
+    Cliente de Stripe para las llamadas *_async (el async_fallback_client de
+    PooledRequestsClient) con httpx y el timeout de psp_timeout().
+
+    Un httpx.AsyncClient solo puede usarse desde el event loop en el que abrió
+    sus conexiones. Con share_connections (ASGI: un único loop por worker)
+    todas las llamadas comparten un cliente de como mucho max_connections
+    conexiones. Si no (runserver/WSGI: cada vista async corre en un loop
+    nuevo), cada llamada abre su propio cliente y lo cierra al terminar.
+    """
+    name = "httpx-pooled"
+
+    def __init__(self, max_connections: int, timeout, share_connections: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        import httpx
+
+        self.httpx = httpx
+        self.default_timeout = timeout
+        self.share_connections = share_connections
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._verify = (ssl.create_default_context(cafile=stripe.ca_bundle_path)
+                        if self._verify_ssl_certs else False)
+        self._shared_client = None
+        self._shared_loop = None
+
+    def _new_client(self):
+        return self.httpx.AsyncClient(verify=self._verify, limits=self._limits)
+
+    def _loop_client(self):
+        """
+        El cliente compartido, o None si esta llamada debe abrir el suyo.
+        """
+        if not self.share_connections:
+            return None
+        loop = asyncio.get_running_loop()
+        if self._shared_client is None:
+            self._shared_client, self._shared_loop = self._new_client(), loop
+        # Otro loop no puede usar las conexiones del compartido
+        return self._shared_client if self._shared_loop is loop else None
+
+    def _request_timeout(self):
+        call_timeout = _call_timeout.get()
+        if call_timeout is None:
+            return self.default_timeout
+        connect, read = call_timeout
+        return self.httpx.Timeout(read, connect=connect)
+
+    async def request_async(self, method, url, headers, post_data=None):
+        kwargs = {'headers': headers, 'data': post_data or {}, 'timeout': self._request_timeout()}
+        try:
+            client = self._loop_client()
+            if client is not None:
+                response = await client.request(method, url, **kwargs)
+            else:
+                async with self._new_client() as client:
+                    response = await client.request(method, url, **kwargs)
+        except Exception as e:
+            # Como HTTPXClient: cualquier error de red es un APIConnectionError reintentable
+            msg = textwrap.fill("Unexpected error communicating with Stripe. If this problem persists, "
+                                "let us know at support@stripe.com.")
+            raise stripe.APIConnectionError(f"{msg}\n\n(Network error: A {type(e).__name__} was raised)",
+                                            should_retry=True) from e
+        return response.content, response.status_code, response.headers
+
+    def sleep_async(self, secs):
+        return asyncio.sleep(secs)
+
+    async def close_async(self):
+        if self._shared_client is not None:
+            client, self._shared_client, self._shared_loop = self._shared_client, None, None
+            await client.aclose()
+
+    def close(self):
+        # Sin métodos síncronos: solo se usa como async_fallback_client
+        pass
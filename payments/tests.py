@@ -2,9 +2,48 @@ from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
-from unittest.mock import patch
+from django.test import SimpleTestCase, override_settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from unittest.mock import patch, AsyncMock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import csv
+import io
+import itertools
+import json
+import threading
+import uuid
+import time
+from payments.psp import stripe
 
-from payments.models import PaymentMethod, Customer
+from payments.models import PaymentMethod, Customer, WebhookEvent, ProcessedWebhookEvent, PaymentAttempt
+from payments.services import (
+    get_invoice_pdf_options,
+    is_stripe_customer_verified,
+    claim_webhook_events,
+    process_webhook_events,
+    get_webhook_counters,
+    prune_webhook_events,
+    dispatch_stripe_event,
+    WEBHOOK_HANDLERS,
+)
+from datetime import timedelta
+from types import SimpleNamespace
+from decimal import Decimal
+from django.utils import timezone
+from orders.models import Order
+from cart.models import ShoppingCart, CartItem
+from payments.views import get_or_create_stripe_customer, save_attached_payment_method
+from payments.psp import build_stripe_http_client, psp_timeout
+from payments.fake_stripe import FakeStripe, FakeStripeServer
+from payments.services import mark_stripe_customer_verified
+from payments.resilience import PSPUnavailable, apsp_call, psp_call, psp_deadline, get_breaker, get_breaker_metrics, reset_breakers
+from django.test import AsyncClient, TestCase
+from proyecto_gps_25_26_ga02_pagos.metrics import Histogram
 
 User = get_user_model()
 
@@ -29,6 +68,7 @@ class MockStripePaymentMethod:
 class PaymentMethodAPITests(APITestCase):
 
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(username='testuser',email= 'test@user.com', password='testpassword123')
         self.client.force_authenticate(user=self.user)
 
@@ -51,6 +91,20 @@ class PaymentMethodAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 0)
 
+    @patch('payments.views.stripe.Customer.create')
+    def test_token_of_deleted_user_is_rejected(self, mock_customer_create):
+        from proyecto_gps_25_26_ga02_pagos.authentication import issue_api_token
+
+        token = issue_api_token(self.user)
+        self.user.delete()
+        self.client.force_authenticate(user=None)
+
+        response = self.client.post(self.list_create_url, {'token': 'tok_visa'}, format='json',
+                                    HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        mock_customer_create.assert_not_called()
+
     # Usamos @patch para interceptar la llamada a Stripe
     @patch('payments.views.stripe.Customer.modify')
     @patch('payments.views.stripe.PaymentMethod.attach')
@@ -149,4 +203,1115 @@ class PaymentMethodAPITests(APITestCase):
 
         # 4. Debería dar 404 (No Encontrado) porque el queryset no lo encuentra
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(PaymentMethod.objects.count(), 1)  # Sigue existiendo
\ No newline at end of file
+        self.assertEqual(PaymentMethod.objects.count(), 1)  # Sigue existiendo
+
+
+class InvoicePdfProfileTests(SimpleTestCase):
+
+    @override_settings(INVOICE_PDF_PROFILE='smallest')
+    def test_profile_from_settings(self):
+        options = get_invoice_pdf_options()
+        self.assertTrue(options['optimize_images'])
+        self.assertEqual(options['jpeg_quality'], 60)
+        self.assertFalse(options['full_fonts'])  # Siempre con subset de fuentes
+
+    def test_explicit_profile_overrides_settings(self):
+        self.assertTrue(get_invoice_pdf_options('fast')['hinting'])
+
+    @override_settings(INVOICE_PDF_PROFILE='enorme')
+    def test_unknown_profile_is_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_invoice_pdf_options()
+
+
+class StripeCustomerCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cacheuser', email='cache@user.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.customer = Customer.objects.create(user=self.user, stripe_customer_id='cus_cached')
+
+    @patch('payments.views.stripe.Customer.retrieve')
+    def test_verification_is_cached(self, mock_retrieve):
+        mock_retrieve.return_value = type('MockStripeCustomer', (object,), {'id': 'cus_cached'})()
+
+        self.assertEqual(get_or_create_stripe_customer(self.user), 'cus_cached')
+        self.assertEqual(get_or_create_stripe_customer(self.user), 'cus_cached')
+
+        # Solo la primera llamada va a Stripe
+        mock_retrieve.assert_called_once_with('cus_cached')
+
+    @override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+    @patch('payments.views.stripe.Webhook.construct_event')
+    def test_customer_deleted_webhook_invalidates_cache(self, mock_construct_event):
+        cache.set('stripe-customer-verified:cus_cached', True)
+        event = {
+            'id': 'evt_customer_deleted',
+            'type': 'customer.deleted',
+            'data': {'object': {'id': 'cus_cached', 'deleted': True}},
+        }
+        mock_construct_event.return_value = event
+
+        response = self.client.post(reverse('webhook-stripe'), data=json.dumps(event), content_type='application/json',
+                                    HTTP_STRIPE_SIGNATURE='t=1,v1=firma')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        process_webhook_events(claim_webhook_events(batch_size=10))
+
+        self.assertFalse(is_stripe_customer_verified('cus_cached'))
+        self.assertFalse(Customer.objects.filter(stripe_customer_id='cus_cached').exists())
+
+    @patch('payments.views.stripe.Customer.modify')
+    @patch('payments.views.stripe.Customer.create')
+    @patch('payments.views.stripe.PaymentMethod.attach')
+    def test_attach_recreates_customer_missing_in_stripe(self, mock_attach, mock_customer_create, mock_modify):
+        # La caché dice que existe, pero Stripe lo borró
+        cache.set('stripe-customer-verified:cus_cached', True)
+        mock_customer_create.return_value = type('MockStripeCustomer', (object,), {'id': 'cus_nuevo'})()
+        attached_pm = MockStripePaymentMethod(id="pm_real_1", brand="visa", last4="4242", exp_month=1, exp_year=2031)
+        mock_attach.side_effect = [
+            stripe.InvalidRequestError("No such customer: 'cus_cached'", 'customer', code='resource_missing'),
+            attached_pm,
+        ]
+
+        response = self.client.post(reverse('payment-method-list-create'), {"token": "pm_card_visa"}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Customer.objects.get(user=self.user).stripe_customer_id, 'cus_nuevo')
+        mock_attach.assert_called_with("pm_card_visa", customer="cus_nuevo")
+
+
+class CountingStripeHandler(BaseHTTPRequestHandler):
+    """
+    API de Stripe mínima: responde a GET /v1/customers/<id> y
+    POST /v1/payment_intents, y cuenta cuántas conexiones TCP se abren
+    contra el servidor.
+    """
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        self.send_json({'id': self.path.rsplit('/', 1)[-1], 'object': 'customer'})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.idempotency_keys.append(self.headers.get('Idempotency-Key'))
+        time.sleep(self.server.latency)
+        intent_id = f'pi_{uuid.uuid4().hex}'
+        self.send_json({'id': intent_id, 'object': 'payment_intent', 'status': 'succeeded',
+                        'client_secret': f'{intent_id}_secret'})
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # el cliente ya ha cerrado por timeout
+
+    def log_message(self, format, *args):
+        pass
+
+
+@override_settings(STRIPE_HTTP_POOL_SIZE=2, STRIPE_CONNECT_TIMEOUT=1, STRIPE_READ_TIMEOUT=5)
+class PooledStripeClientTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), CountingStripeHandler)
+        self.server.connections = 0
+        self.server.latency = 0
+        self.server.idempotency_keys = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        # Apuntamos la librería al servidor local y restauramos al terminar
+        previous = (stripe.api_base, stripe.api_key, stripe.default_http_client)
+        self.addCleanup(self._restore_stripe, *previous)
+        stripe.api_base = f'http://127.0.0.1:{self.server.server_port}'
+        stripe.api_key = 'sk_test_pool'
+        stripe.default_http_client = build_stripe_http_client()
+
+    @staticmethod
+    def _restore_stripe(api_base, api_key, http_client):
+        stripe.api_base, stripe.api_key, stripe.default_http_client = api_base, api_key, http_client
+
+    def test_connection_is_reused_across_calls_and_threads(self):
+        for i in range(5):
+            self.assertEqual(stripe.Customer.retrieve(f'cus_{i}').id, f'cus_{i}')
+
+        # Otro hilo del mismo worker reutiliza la conexión abierta
+        worker = threading.Thread(target=lambda: [stripe.Customer.retrieve('cus_hilo') for _ in range(5)])
+        worker.start()
+        worker.join()
+
+        self.assertEqual(self.server.connections, 1)
+
+    def test_per_call_read_timeout(self):
+        self.server.latency = 1
+
+        start = time.monotonic()
+        with self.assertRaises(stripe.APIConnectionError):
+            with psp_timeout(read=0.1, network_retries=0):
+                stripe.Customer.retrieve('cus_lento')
+        self.assertLess(time.monotonic() - start, 1)
+
+    def retrieve_async(self, calls):
+        async def retrieve():
+            for i in range(calls):
+                self.assertEqual((await stripe.Customer.retrieve_async(f'cus_{i}')).id, f'cus_{i}')
+            await stripe.default_http_client.close_async()
+        asyncio.run(retrieve())
+
+    def test_async_connections_shared_under_asgi(self):
+        with patch('payments.psp._share_async_connections', True):
+            stripe.default_http_client = build_stripe_http_client()
+
+        self.retrieve_async(5)
+
+        self.assertEqual(self.server.connections, 1)
+
+    def test_async_clients_closed_without_asgi(self):
+        # Con WSGI cada vista async tiene su loop: un cliente por llamada, cerrado al terminar
+        self.retrieve_async(2)
+        self.retrieve_async(1)
+
+        self.assertEqual(self.server.connections, 3)
+
+    def test_async_per_call_read_timeout(self):
+        self.server.latency = 1
+
+        async def retrieve():
+            with psp_timeout(read=0.1, network_retries=0):
+                await stripe.Customer.retrieve_async('cus_lento')
+
+        start = time.monotonic()
+        with self.assertRaises(stripe.APIConnectionError):
+            asyncio.run(retrieve())
+        self.assertLess(time.monotonic() - start, 1)
+
+    @override_settings(STRIPE_READ_TIMEOUT=0.1, STRIPE_RETRY_ATTEMPTS=1)
+    @patch('stripe._http_client.HTTPClient._sleep_time_seconds', return_value=0)
+    def test_network_retries_only_for_calls_psp_call_does_not_retry(self, mock_sleep):
+        reset_breakers()
+        self.addCleanup(reset_breakers)
+        self.server.latency = 1
+
+        # Idempotente: la reintenta psp_call, sin los reintentos de la librería
+        with self.assertRaises(PSPUnavailable):
+            psp_call('customers', stripe.Customer.retrieve, 'cus_lento', idempotent=True)
+        self.assertEqual(self.server.connections, 1)
+
+        # POST no idempotente: la librería lo repite con la misma clave de idempotencia
+        with self.assertRaises(PSPUnavailable):
+            psp_call('payment_intents', stripe.PaymentIntent.create, amount=1000, currency='eur')
+        self.assertEqual(len(self.server.idempotency_keys), 3)
+        self.assertEqual(len(set(self.server.idempotency_keys)), 1)
+
+
+def make_payment_intent_event(event_id, event_type, order_id):
+    return {
+        'id': event_id,
+        'type': event_type,
+        'data': {'object': {'id': f'pi_{event_id}', 'metadata': {'order_id': str(order_id)}}},
+    }
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class WebhookInboxTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='inboxuser', password='testpassword123')
+        self.order = Order.objects.create(user=self.user)
+        self.other_order = Order.objects.create(user=self.user)
+        self.webhook_url = reverse('webhook-stripe')
+
+    @patch('payments.services.dispatch_stripe_event')
+    @patch('payments.views.stripe.Webhook.construct_event')
+    def test_webhook_only_stores_event(self, mock_construct_event, mock_dispatch):
+        event = make_payment_intent_event('evt_1', 'payment_intent.succeeded', self.order.order_id)
+        mock_construct_event.return_value = event
+
+        response = self.client.post(self.webhook_url, data=json.dumps(event), content_type='application/json',
+                                    HTTP_STRIPE_SIGNATURE='t=1,v1=firma')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mock_dispatch.assert_not_called()
+        stored = WebhookEvent.objects.get()
+        self.assertEqual(stored.event_id, 'evt_1')
+        self.assertEqual(stored.order_id, str(self.order.order_id))
+        self.assertEqual(stored.status, WebhookEvent.Status.PENDING)
+
+    @patch('payments.services.dispatch_stripe_event')
+    def test_dispatcher_keeps_order_within_each_order(self, mock_dispatch):
+        for event_id, order in [('evt_a1', self.order), ('evt_b1', self.other_order), ('evt_a2', self.order)]:
+            event = make_payment_intent_event(event_id, 'payment_intent.succeeded', order.order_id)
+            WebhookEvent.objects.create(event_id=event_id, event_type=event['type'],
+                                        order_id=str(order.order_id), payload=event)
+
+        process_webhook_events(claim_webhook_events(batch_size=10))
+
+        handled = [call.args[1]['object']['id'] for call in mock_dispatch.call_args_list]
+        self.assertLess(handled.index('pi_evt_a1'), handled.index('pi_evt_a2'))
+        self.assertEqual(WebhookEvent.objects.filter(status=WebhookEvent.Status.DONE).count(), 3)
+        self.assertEqual(claim_webhook_events(batch_size=10), [])
+
+    def test_claim_skips_orders_held_by_another_dispatcher(self):
+        for event_id, order, event_status in [('evt_a1', self.order, WebhookEvent.Status.PROCESSING),
+                                              ('evt_a2', self.order, WebhookEvent.Status.PENDING),
+                                              ('evt_b1', self.other_order, WebhookEvent.Status.PENDING)]:
+            event = make_payment_intent_event(event_id, 'payment_intent.succeeded', order.order_id)
+            WebhookEvent.objects.create(event_id=event_id, event_type=event['type'], order_id=str(order.order_id),
+                                        payload=event, status=event_status, claimed_by='otro-dispatcher',
+                                        claimed_at=timezone.now())
+
+        claimed = claim_webhook_events(batch_size=10)
+
+        self.assertEqual([event.event_id for event in claimed], ['evt_b1'])
+        self.assertEqual(WebhookEvent.objects.get(event_id='evt_a2').status, WebhookEvent.Status.PENDING)
+
+    @patch('payments.services.dispatch_stripe_event', side_effect=[RuntimeError("BBDD caída"), None])
+    def test_failed_event_blocks_later_events_of_same_order(self, mock_dispatch):
+        for event_id in ['evt_1', 'evt_2']:
+            event = make_payment_intent_event(event_id, 'payment_intent.succeeded', self.order.order_id)
+            WebhookEvent.objects.create(event_id=event_id, event_type=event['type'],
+                                        order_id=str(self.order.order_id), payload=event)
+
+        process_webhook_events(claim_webhook_events(batch_size=10))
+
+        first, second = WebhookEvent.objects.order_by('pk')
+        self.assertEqual(first.status, WebhookEvent.Status.PENDING)
+        self.assertEqual(first.attempts, 1)
+        self.assertEqual(first.last_error, "BBDD caída")
+        self.assertEqual(second.status, WebhookEvent.Status.PENDING)
+        self.assertEqual(second.attempts, 0)
+        mock_dispatch.assert_called_once()
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class WebhookDeduplicationTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='dedupuser', password='testpassword123')
+        self.order = Order.objects.create(user=self.user)
+        self.event = make_payment_intent_event('evt_dup', 'payment_intent.succeeded', self.order.order_id)
+
+    def enqueue_copy(self):
+        return WebhookEvent.objects.create(event_id=self.event['id'], event_type=self.event['type'],
+                                           order_id=str(self.order.order_id), payload=self.event)
+
+    @patch('payments.views.stripe.Webhook.construct_event')
+    def test_replay_of_processed_event_is_rejected(self, mock_construct_event):
+        ProcessedWebhookEvent.objects.create(event_id='evt_dup', event_type='payment_intent.succeeded')
+        mock_construct_event.return_value = self.event
+        rejected_before = get_webhook_counters().get('duplicate_rejected', 0)
+
+        response = self.client.post(reverse('webhook-stripe'), data=json.dumps(self.event),
+                                    content_type='application/json', HTTP_STRIPE_SIGNATURE='t=1,v1=firma')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(WebhookEvent.objects.exists())
+        self.assertEqual(get_webhook_counters()['duplicate_rejected'], rejected_before + 1)
+
+    @patch('payments.services.dispatch_stripe_event')
+    def test_copies_in_inbox_are_processed_once(self, mock_dispatch):
+        self.enqueue_copy()
+        self.enqueue_copy()
+
+        process_webhook_events(claim_webhook_events(batch_size=10))
+
+        mock_dispatch.assert_called_once()
+        self.assertEqual(ProcessedWebhookEvent.objects.filter(event_id='evt_dup').count(), 1)
+        self.assertEqual(WebhookEvent.objects.filter(status=WebhookEvent.Status.DONE).count(), 2)
+
+    @patch('payments.services.dispatch_stripe_event', side_effect=RuntimeError("fallo"))
+    def test_failed_event_is_not_marked_processed(self, mock_dispatch):
+        self.enqueue_copy()
+
+        process_webhook_events(claim_webhook_events(batch_size=10))
+
+        self.assertFalse(ProcessedWebhookEvent.objects.exists())
+
+    def test_prune_removes_old_ids_only(self):
+        old = ProcessedWebhookEvent.objects.create(event_id='evt_viejo', event_type='x')
+        ProcessedWebhookEvent.objects.filter(pk=old.pk).update(processed_at=timezone.now() - timedelta(days=40))
+        ProcessedWebhookEvent.objects.create(event_id='evt_nuevo', event_type='x')
+
+        deleted = prune_webhook_events(timedelta(days=30), batch_size=1)
+
+        self.assertEqual(deleted['processed_ids'], 1)
+        self.assertEqual(list(ProcessedWebhookEvent.objects.values_list('event_id', flat=True)), ['evt_nuevo'])
+
+
+class WebhookHandlerRegistryTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='handleruser', password='testpassword123')
+        self.order = Order.objects.create(user=self.user, status=Order.OrderStatus.PAID)
+
+    def enqueue(self, event_id, event_type, event_object):
+        event = {'id': event_id, 'type': event_type, 'data': {'object': event_object}}
+        return WebhookEvent.objects.create(event_id=event_id, event_type=event_type,
+                                           order_id=str(self.order.order_id), payload=event)
+
+    def charge(self, charge_id, **fields):
+        return {'id': charge_id, 'metadata': {'order_id': str(self.order.order_id)}, **fields}
+
+    def test_full_refund_marks_order_refunded(self):
+        dispatch_stripe_event('charge.refunded', {'object': self.charge('ch_1', refunded=True)})
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.OrderStatus.REFUNDED)
+
+    def test_partial_refund_keeps_order_paid(self):
+        dispatch_stripe_event('charge.refunded', {'object': self.charge('ch_1', refunded=False, amount_refunded=100)})
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.OrderStatus.PAID)
+
+    @patch('payments.services.stripe.PaymentIntent.retrieve')
+    def test_dispute_resolves_order_through_payment_intent(self, mock_retrieve):
+        mock_retrieve.return_value = {'id': 'pi_1', 'metadata': {'order_id': str(self.order.order_id)}}
+
+        dispatch_stripe_event('charge.dispute.created', {'object': {'id': 'dp_1', 'payment_intent': 'pi_1'}})
+
+        mock_retrieve.assert_called_once_with('pi_1')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.OrderStatus.DISPUTED)
+
+    @patch('payments.services.stripe.PaymentIntent.retrieve')
+    def test_queued_dispute_resolves_order_outside_transaction(self, mock_retrieve):
+        outer_blocks = len(connection.atomic_blocks)
+
+        def retrieve(payment_intent_id, **kwargs):
+            # Sin transacción abierta (más allá de la del propio test)
+            self.assertEqual(len(connection.atomic_blocks), outer_blocks)
+            return {'id': payment_intent_id, 'metadata': {'order_id': str(self.order.order_id)}}
+
+        mock_retrieve.side_effect = retrieve
+        event = self.enqueue('evt_1', 'charge.dispute.created', {'id': 'dp_1', 'payment_intent': 'pi_1'})
+        WebhookEvent.objects.filter(pk=event.pk).update(order_id='')
+
+        process_webhook_events(claim_webhook_events(batch_size=10))
+
+        mock_retrieve.assert_called_once()
+        event.refresh_from_db()
+        self.assertEqual(event.status, WebhookEvent.Status.DONE)
+        self.assertEqual(event.order_id, str(self.order.order_id))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.OrderStatus.DISPUTED)
+
+    def test_canceled_intent_marks_pending_order_failed(self):
+        Order.objects.filter(pk=self.order.pk).update(status=Order.OrderStatus.PENDING)
+
+        dispatch_stripe_event('payment_intent.canceled', {'object': self.charge('pi_1')})
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.OrderStatus.FAILED)
+
+    def test_batchable_events_of_an_order_are_saved_once(self):
+        self.enqueue('evt_1', 'charge.dispute.created', self.charge('dp_1'))
+        self.enqueue('evt_2', 'charge.refunded', self.charge('ch_1', refunded=True))
+
+        with patch.object(Order, 'save', autospec=True, side_effect=Order.save) as mock_save:
+            process_webhook_events(claim_webhook_events(batch_size=10))
+
+        mock_save.assert_called_once()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.OrderStatus.REFUNDED)
+        self.assertEqual(WebhookEvent.objects.filter(status=WebhookEvent.Status.DONE).count(), 2)
+        self.assertEqual(ProcessedWebhookEvent.objects.count(), 2)
+
+    def test_failed_batch_falls_back_to_single_events(self):
+        self.enqueue('evt_1', 'charge.dispute.created', self.charge('dp_1'))
+        self.enqueue('evt_2', 'charge.refunded', self.charge('ch_1', refunded=True))
+        refund_handler = WEBHOOK_HANDLERS['charge.refunded']
+
+        with patch.object(refund_handler, 'func', side_effect=RuntimeError("fallo")):
+            process_webhook_events(claim_webhook_events(batch_size=10))
+
+        dispute, refund = WebhookEvent.objects.order_by('pk')
+        self.assertEqual(dispute.status, WebhookEvent.Status.DONE)
+        self.assertEqual(refund.status, WebhookEvent.Status.PENDING)
+        self.assertEqual(refund.last_error, "fallo")
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.OrderStatus.DISPUTED)
+
+
+class AsyncPaymentViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='asyncuser', password='testpassword123')
+        self.order = Order.objects.create(user=self.user, amount=Decimal('12.50'))
+        self.pm = PaymentMethod.objects.create(user=self.user, payment_method_id='pm_async_4242', psp_ref='pm_stripe',
+                                               brand='visa', last4='4242', exp_mm=12, exp_yy=2030)
+        Customer.objects.create(user=self.user, stripe_customer_id='cus_async')
+        cache.clear()
+        mark_stripe_customer_verified('cus_async')
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.get(reverse('payment-method-list-create-async'))
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_list_payment_methods(self):
+        await self.async_client.aforce_login(self.user)
+
+        response = await self.async_client.get(reverse('payment-method-list-create-async'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([pm['payment_method_id'] for pm in response.json()], ['pm_async_4242'])
+
+    async def test_list_payment_methods_with_api_token(self):
+        from proyecto_gps_25_26_ga02_pagos.authentication import issue_api_token
+
+        token = issue_api_token(self.user)
+        response = await self.async_client.get(reverse('payment-method-list-create-async'),
+                                               headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([pm['payment_method_id'] for pm in response.json()], ['pm_async_4242'])
+
+        response = await self.async_client.get(reverse('payment-method-list-create-async'),
+                                               headers={'Authorization': 'Bearer no-valido'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @patch('payments.views.stripe.Customer.create_async', new_callable=AsyncMock)
+    async def test_token_of_deleted_user_is_rejected(self, mock_customer_create):
+        from proyecto_gps_25_26_ga02_pagos.authentication import issue_api_token
+
+        token = issue_api_token(self.user)
+        await self.user.adelete()
+
+        response = await self.async_client.post(reverse('payment-method-list-create-async'),
+                                                data={'token': 'tok_visa'}, content_type='application/json',
+                                                headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        mock_customer_create.assert_not_called()
+
+    @patch('payments.views.stripe.PaymentIntent.create_async', new_callable=AsyncMock)
+    async def test_create_payment_intent(self, mock_create):
+        mock_create.return_value = stripe.PaymentIntent.construct_from(
+            {'id': 'pi_async', 'client_secret': 'pi_async_secret'}, 'sk_test')
+        await self.async_client.aforce_login(self.user)
+
+        response = await self.async_client.post(
+            reverse('payment-intent-create-async'),
+            data={'order_id': str(self.order.order_id), 'payment_method_id': 'pm_async_4242'},
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['payment_id'], 'pi_async')
+        self.assertEqual(mock_create.call_args.kwargs['amount'], 1250)
+        self.assertEqual(mock_create.call_args.kwargs['customer'], 'cus_async')
+
+    @patch('payments.views.stripe.PaymentIntent.create_async', new_callable=AsyncMock)
+    async def test_csrf_only_enforced_for_session(self, mock_create):
+        from proyecto_gps_25_26_ga02_pagos.authentication import issue_api_token
+
+        mock_create.return_value = stripe.PaymentIntent.construct_from(
+            {'id': 'pi_async', 'client_secret': 'pi_async_secret'}, 'sk_test')
+        client = AsyncClient(enforce_csrf_checks=True)
+        data = {'order_id': str(self.order.order_id), 'payment_method_id': 'pm_async_4242'}
+
+        response = await client.post(reverse('payment-intent-create-async'), data=data,
+                                     content_type='application/json',
+                                     headers={'Authorization': f'Bearer {issue_api_token(self.user)}'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        await client.aforce_login(self.user)
+        response = await client.post(reverse('payment-intent-create-async'), data=data,
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertIn('CSRF', response.json()['detail'])
+
+
+class StubStripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class AsyncPaymentLoadTests(TestCase):
+    """
+    Prueba de carga: muchos pagos simultáneos contra un Stripe local lento
+    no se encolan detrás de un único hilo.
+    """
+    concurrent_payments = 50
+    latency = 0.3
+
+    def setUp(self):
+        self.server = StubStripeServer(('127.0.0.1', 0), CountingStripeHandler)
+        self.server.connections = 0
+        self.server.latency = self.latency
+        self.server.idempotency_keys = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        previous = (stripe.api_base, stripe.api_key, stripe.default_http_client)
+        self.addCleanup(PooledStripeClientTests._restore_stripe, *previous)
+        stripe.api_base = f'http://127.0.0.1:{self.server.server_port}'
+        stripe.api_key = 'sk_test_load'
+        stripe.default_http_client = build_stripe_http_client()
+
+        self.user = User.objects.create_user(username='loaduser', password='testpassword123')
+        self.orders = [Order.objects.create(user=self.user, amount=Decimal('10.00'))
+                       for _ in range(self.concurrent_payments)]
+        PaymentMethod.objects.create(user=self.user, payment_method_id='pm_load_4242', psp_ref='pm_stripe',
+                                     brand='visa', last4='4242', exp_mm=12, exp_yy=2030)
+        Customer.objects.create(user=self.user, stripe_customer_id='cus_load')
+        cache.clear()
+        mark_stripe_customer_verified('cus_load')
+
+    async def pay(self, order):
+        return await self.async_client.post(
+            reverse('payment-intent-create-async'),
+            data={'order_id': str(order.order_id), 'payment_method_id': 'pm_load_4242'},
+            content_type='application/json',
+        )
+
+    async def test_concurrent_payment_intents(self):
+        await self.async_client.aforce_login(self.user)
+
+        start = time.monotonic()
+        responses = await asyncio.gather(*(self.pay(order) for order in self.orders))
+        elapsed = time.monotonic() - start
+
+        self.assertEqual({response.status_code for response in responses}, {status.HTTP_200_OK})
+        self.assertEqual(len({response.json()['payment_id'] for response in responses}), self.concurrent_payments)
+        # En serie serían concurrent_payments * latency (15 s)
+        self.assertLess(elapsed, self.concurrent_payments * self.latency / 5)
+
+
+@override_settings(STRIPE_BREAKER_FAILURE_THRESHOLD=2, STRIPE_BREAKER_RESET_TIMEOUT=30, STRIPE_RETRY_ATTEMPTS=3)
+class PSPResilienceTests(APITestCase):
+
+    def setUp(self):
+        reset_breakers()
+        self.addCleanup(reset_breakers)
+
+    def test_breaker_opens_and_fails_fast(self):
+        with patch('payments.views.stripe.Customer.create', side_effect=stripe.APIConnectionError("caído")) as mock_create:
+            for _ in range(2):
+                with self.assertRaises(PSPUnavailable):
+                    psp_call('customers', mock_create)
+
+        with patch('payments.views.stripe.Customer.retrieve') as mock_retrieve:
+            with self.assertRaises(PSPUnavailable) as ctx:
+                psp_call('customers', mock_retrieve, 'cus_1', idempotent=True)
+        mock_retrieve.assert_not_called()
+        self.assertGreater(ctx.exception.retry_after, 1)
+        metrics = get_breaker_metrics()['customers']
+        self.assertEqual(metrics['state'], 'open')
+        self.assertEqual(metrics['rejected'], 1)
+        # Cada endpoint tiene su propio circuito
+        self.assertEqual(psp_call('payment_intents', lambda: 'ok'), 'ok')
+
+    def test_half_open_probe_closes_breaker(self):
+        breaker = get_breaker('customers')
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.opened_at -= 31
+
+        self.assertEqual(psp_call('customers', lambda: 'ok'), 'ok')
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_half_open_probe_released_when_deadline_exhausted(self):
+        breaker = get_breaker('customers')
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.opened_at -= 31
+
+        with psp_deadline(0.0):
+            with self.assertRaisesMessage(PSPUnavailable, "Plazo"):
+                psp_call('customers', lambda: 'ok')
+        # El plazo agotado no ocupa la llamada de prueba
+        self.assertEqual(psp_call('customers', lambda: 'ok'), 'ok')
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_half_open_probe_released_when_cancelled(self):
+        breaker = get_breaker('customers')
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.opened_at -= 31
+
+        async def cancelled():
+            raise asyncio.CancelledError()
+
+        async def ok():
+            return 'ok'
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(apsp_call('customers', cancelled))
+        self.assertEqual(asyncio.run(apsp_call('customers', ok)), 'ok')
+        self.assertEqual(breaker.state, 'closed')
+
+    @override_settings(STRIPE_BREAKER_FAILURE_THRESHOLD=5)
+    @patch('payments.resilience.time.sleep')
+    def test_idempotent_calls_are_retried_with_jitter(self, mock_sleep):
+        with patch('payments.views.stripe.Customer.retrieve',
+                   side_effect=[stripe.APIConnectionError("timeout"), stripe.APIError("500"), 'cus_1']) as mock_retrieve:
+            self.assertEqual(psp_call('customers', mock_retrieve, 'cus_1', idempotent=True), 'cus_1')
+
+        self.assertEqual(mock_retrieve.call_count, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertLessEqual(mock_sleep.call_args_list[1].args[0], 0.4)
+        self.assertEqual(get_breaker('customers').state, 'closed')
+
+    def test_unsafe_calls_and_business_errors_are_not_retried(self):
+        with patch('payments.views.stripe.PaymentIntent.create',
+                   side_effect=stripe.APIConnectionError("timeout")) as mock_create:
+            with self.assertRaises(PSPUnavailable):
+                psp_call('payment_intents', mock_create, amount=100)
+        self.assertEqual(mock_create.call_count, 1)
+
+        declined = stripe.CardError("Tarjeta rechazada", param=None, code='card_declined')
+        with patch('payments.views.stripe.Customer.retrieve', side_effect=declined) as mock_retrieve:
+            with self.assertRaises(stripe.CardError):
+                psp_call('customers', mock_retrieve, 'cus_1', idempotent=True)
+        self.assertEqual(mock_retrieve.call_count, 1)
+        self.assertEqual(get_breaker('customers').consecutive_failures, 0)
+
+    def test_spent_deadline_skips_the_call(self):
+        with patch('payments.views.stripe.Customer.retrieve') as mock_retrieve:
+            with psp_deadline(0), self.assertRaises(PSPUnavailable):
+                psp_call('customers', mock_retrieve, 'cus_1', idempotent=True)
+        mock_retrieve.assert_not_called()
+
+    @override_settings(STRIPE_BREAKER_FAILURE_THRESHOLD=5)
+    @patch('payments.resilience.time.sleep')
+    @patch('payments.views.stripe.PaymentIntent.create', side_effect=stripe.APIConnectionError("timeout"))
+    def test_payment_intent_returns_503_with_retry_after(self, mock_create, mock_sleep):
+        user = User.objects.create_user(username='psp503', password='testpassword123')
+        order = Order.objects.create(user=user, amount=Decimal('5.00'))
+        PaymentMethod.objects.create(user=user, payment_method_id='pm_503', psp_ref='pm_stripe',
+                                     brand='visa', last4='4242', exp_mm=12, exp_yy=2030)
+        Customer.objects.create(user=user, stripe_customer_id='cus_503')
+        cache.clear()
+        mark_stripe_customer_verified('cus_503')
+        self.client.force_authenticate(user=user)
+
+        response = self.client.post(reverse('payment-intent-create'),
+                                    {'order_id': str(order.order_id), 'payment_method_id': 'pm_503'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        # Lleva clave de idempotencia: se reintenta, siempre con la misma
+        self.assertEqual(mock_create.call_count, 3)
+        self.assertEqual({call.kwargs['idempotency_key'] for call in mock_create.call_args_list},
+                         {f'order-{order.order_id}-attempt-1'})
+
+
+class PaymentAttemptTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='attemptuser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.order = Order.objects.create(user=self.user, amount=Decimal('20.00'))
+        PaymentMethod.objects.create(user=self.user, payment_method_id='pm_attempt', psp_ref='pm_stripe',
+                                     brand='visa', last4='4242', exp_mm=12, exp_yy=2030)
+        Customer.objects.create(user=self.user, stripe_customer_id='cus_attempt')
+        cache.clear()
+        mark_stripe_customer_verified('cus_attempt')
+        self.intent = stripe.PaymentIntent.construct_from(
+            {'id': 'pi_attempt', 'client_secret': 'pi_attempt_secret', 'status': 'processing'}, 'sk_test')
+
+    def pay(self):
+        return self.client.post(reverse('payment-intent-create'),
+                                {'order_id': str(self.order.order_id), 'payment_method_id': 'pm_attempt'},
+                                format='json')
+
+    @patch('payments.views.stripe.PaymentIntent.create')
+    def test_retry_is_answered_from_database(self, mock_create):
+        mock_create.return_value = self.intent
+
+        first = self.pay()
+        second = self.pay()
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.data, first.data)
+        mock_create.assert_called_once()
+        self.assertEqual(mock_create.call_args.kwargs['idempotency_key'], f'order-{self.order.order_id}-attempt-1')
+        attempt = PaymentAttempt.objects.get()
+        self.assertEqual((attempt.intent_id, attempt.status), ('pi_attempt', PaymentAttempt.Status.PROCESSING))
+
+    @patch('payments.views.stripe.PaymentIntent.create')
+    def test_declined_attempt_gets_a_new_key(self, mock_create):
+        mock_create.side_effect = [stripe.CardError("Tarjeta rechazada", param=None, code='card_declined'), self.intent]
+
+        self.assertEqual(self.pay().status_code, 402)
+        self.assertEqual(self.pay().status_code, status.HTTP_200_OK)
+
+        keys = [call.kwargs['idempotency_key'] for call in mock_create.call_args_list]
+        self.assertEqual(keys, [f'order-{self.order.order_id}-attempt-1', f'order-{self.order.order_id}-attempt-2'])
+        self.assertEqual(list(PaymentAttempt.objects.values_list('status', flat=True)),
+                         [PaymentAttempt.Status.FAILED, PaymentAttempt.Status.PROCESSING])
+
+    @patch('payments.views.stripe.PaymentIntent.create')
+    def test_status_is_updated_from_webhook(self, mock_create):
+        mock_create.return_value = self.intent
+        self.pay()
+
+        with patch('payments.services.generate_invoice_pdf_for_order'):
+            dispatch_stripe_event('payment_intent.succeeded', {'object': {
+                'id': 'pi_attempt', 'metadata': {'order_id': str(self.order.order_id), 'attempt_number': '1'}}})
+
+        response = self.client.get(reverse('payment-intent-status', args=['pi_attempt']))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], PaymentAttempt.Status.SUCCEEDED)
+        self.assertEqual(response.data['order_id'], str(self.order.order_id))
+
+    def test_webhook_finds_attempt_without_intent_id(self):
+        # Timeout al crear el PaymentIntent: no llegamos a guardar su ID
+        PaymentAttempt.objects.create(order=self.order, attempt_number=1, amount=self.order.amount, currency='EUR',
+                                      idempotency_key=f'order-{self.order.order_id}-attempt-1')
+
+        dispatch_stripe_event('payment_intent.payment_failed', {'object': {
+            'id': 'pi_perdido', 'metadata': {'order_id': str(self.order.order_id), 'attempt_number': '1'}}})
+
+        attempt = PaymentAttempt.objects.get()
+        self.assertEqual((attempt.intent_id, attempt.status), ('pi_perdido', PaymentAttempt.Status.FAILED))
+
+    @patch('payments.services.stripe.PaymentIntent.retrieve')
+    def test_dispute_order_is_resolved_from_attempts(self, mock_retrieve):
+        Order.objects.filter(pk=self.order.pk).update(status=Order.OrderStatus.PAID)
+        PaymentAttempt.objects.create(order=self.order, attempt_number=1, amount=self.order.amount, currency='EUR',
+                                      idempotency_key='k1', intent_id='pi_attempt')
+
+        dispatch_stripe_event('charge.dispute.created', {'object': {'id': 'dp_1', 'payment_intent': 'pi_attempt'}})
+
+        mock_retrieve.assert_not_called()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.OrderStatus.DISPUTED)
+
+
+class PaymentMethodListCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cacheuser', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('payment-method-list-create')
+        self.pm = PaymentMethod.objects.create(user=self.user, payment_method_id='pm_cache_1', psp_ref='pm_stripe_1',
+                                               brand='visa', last4='1111', exp_mm=12, exp_yy=2030, is_default=True)
+
+    def test_listing_is_served_from_cache(self):
+        first = self.client.get(self.url)
+
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.data[0]['payment_method_id'], 'pm_cache_1')
+
+    def test_new_default_card_invalidates_listing(self):
+        self.client.get(self.url)
+
+        save_attached_payment_method(self.user, MockStripePaymentMethod('pm_stripe_2', 'mastercard', '2222', 1, 2031),
+                                     make_default=True)
+
+        response = self.client.get(self.url)
+        self.assertEqual([(pm['last4'], pm['is_default']) for pm in response.data], [('2222', True), ('1111', False)])
+
+    @patch('payments.views.stripe.PaymentMethod.detach')
+    def test_delete_invalidates_listing(self, mock_detach):
+        self.client.get(self.url)
+
+        response = self.client.delete(reverse('payment-method-destroy', args=['pm_cache_1']))
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(self.url).data, [])
+
+
+class FakePaymentIntentList:
+    """
+    Sustituto local de stripe.PaymentIntent.list: devuelve las páginas según
+    se piden (limit y starting_after), generando solo los PaymentIntents de
+    cada una.
+    """
+    def __init__(self, make_intents, fail_pages=()):
+        self.intents = make_intents()
+        self.last_id = None
+        self.pages = 0
+        self.fail_pages = set(fail_pages)
+
+    def __call__(self, limit, starting_after=None, **params):
+        if self.pages in self.fail_pages:
+            self.fail_pages.discard(self.pages)
+            raise stripe.APIConnectionError("Conexión cortada")
+        assert starting_after == self.last_id, "starting_after no es el último de la página anterior"
+        data = list(itertools.islice(self.intents, limit + 1))
+        has_more = len(data) > limit
+        if has_more:
+            # El que sobra vuelve al principio para la página siguiente
+            self.intents = itertools.chain([data.pop()], self.intents)
+        self.last_id = data[-1]['id'] if data else None
+        self.pages += 1
+        return SimpleNamespace(data=data, has_more=has_more)
+
+
+class StripeReconciliationTests(APITestCase):
+    total_intents = 100_000
+    total_orders = 1_000
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reconcileuser', password='testpassword123')
+        Order.objects.bulk_create(
+            Order(user=self.user, amount=Decimal('10.00'), status=Order.OrderStatus.PAID) for _ in range(self.total_orders)
+        )
+        self.order_ids = [str(order_id) for order_id in Order.objects.values_list('order_id', flat=True)]
+        self.lost_webhook_order = Order.objects.create(user=self.user, amount=Decimal('10.00'))
+        self.canceled_order = Order.objects.create(user=self.user, amount=Decimal('10.00'))
+        self.failed_order = Order.objects.create(user=self.user, amount=Decimal('10.00'),
+                                                 status=Order.OrderStatus.FAILED)
+
+    def make_intents(self):
+        for i in range(self.total_intents):
+            yield {'id': f'pi_{i}', 'status': 'succeeded', 'amount': 1000,
+                   'metadata': {'order_id': self.order_ids[i % self.total_orders]}}
+        yield {'id': 'pi_perdido', 'status': 'succeeded', 'amount': 1000,
+               'metadata': {'order_id': str(self.lost_webhook_order.order_id)}}
+        yield {'id': 'pi_cancelado', 'status': 'canceled', 'amount': 1000,
+               'metadata': {'order_id': str(self.canceled_order.order_id)}}
+        yield {'id': 'pi_tras_fallo', 'status': 'succeeded', 'amount': 1000,
+               'metadata': {'order_id': str(self.failed_order.order_id)}}
+        yield {'id': 'pi_huerfano', 'status': 'succeeded', 'amount': 1000,
+               'metadata': {'order_id': '00000000-0000-0000-0000-000000000000'}}
+        yield {'id': 'pi_otro_sistema', 'status': 'succeeded', 'amount': 500, 'metadata': {}}
+
+    def run_command(self, *args, fail_pages=()):
+        out, err = io.StringIO(), io.StringIO()
+        self.stripe_list = FakePaymentIntentList(self.make_intents, fail_pages)
+        with patch('payments.services.stripe.PaymentIntent.list', side_effect=self.stripe_list):
+            call_command('reconcile_stripe_payments', '--from', '2025-11-01', '--to', '2025-11-30', *args,
+                         stdout=out, stderr=err)
+        return list(csv.DictReader(io.StringIO(out.getvalue()))), err.getvalue()
+
+    def test_report_streams_through_chunked_lookups(self):
+        with CaptureQueriesContext(connection) as queries:
+            rows, summary = self.run_command('--chunk-size', '500')
+
+        self.assertEqual({row['payment_intent']: row['kind'] for row in rows}, {
+            'pi_perdido': 'succeeded_not_paid',
+            'pi_cancelado': 'canceled_still_pending',
+            'pi_tras_fallo': 'succeeded_but_failed',
+            'pi_huerfano': 'order_not_found',
+        })
+        # Una consulta in_bulk por cada 500 PaymentIntents
+        self.assertLessEqual(len(queries), self.total_intents // 500 + 1)
+        self.assertIn(f"{self.total_intents + 5} PaymentIntents", summary)
+        # Páginas de 100, cada una con su llamada (y su psp_call)
+        self.assertEqual(self.stripe_list.pages, (self.total_intents + 5 + 99) // 100)
+        self.lost_webhook_order.refresh_from_db()
+        self.assertEqual(self.lost_webhook_order.status, Order.OrderStatus.PENDING)
+
+    @override_settings(STRIPE_RETRY_BACKOFF=0)
+    def test_later_pages_are_retried(self):
+        reset_breakers()
+        self.addCleanup(reset_breakers)
+        self.total_intents = 250
+
+        # Falla la segunda página: psp_call la reintenta en vez de cortar el informe
+        rows, summary = self.run_command(fail_pages=[1])
+
+        self.assertEqual(len(rows), 4)
+        self.assertIn("255 PaymentIntents", summary)
+        self.assertEqual(self.stripe_list.pages, 3)
+
+    @patch('payments.services.generate_invoice_pdf_for_order')
+    def test_repair_applies_webhook_handlers(self, mock_invoice):
+        self.total_intents = 10
+
+        rows, summary = self.run_command('--repair')
+
+        self.assertEqual({row['payment_intent']: row['repaired'] for row in rows},
+                         {'pi_perdido': 'True', 'pi_cancelado': 'True', 'pi_tras_fallo': 'False',
+                          'pi_huerfano': 'False'})
+        self.lost_webhook_order.refresh_from_db()
+        self.canceled_order.refresh_from_db()
+        self.assertEqual(self.lost_webhook_order.status, Order.OrderStatus.PAID)
+        self.assertEqual(self.canceled_order.status, Order.OrderStatus.FAILED)
+        mock_invoice.assert_called_once()
+        self.assertIn("2 reparadas", summary)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_fake')
+class FakeStripeEndToEndTests(APITestCase):
+    """
+    Checkout completo por HTTP contra el Stripe falso, sin parchear la librería.
+    """
+
+    def setUp(self):
+        cache.clear()
+        reset_breakers()
+        self.webhooks = []
+        self.fake = FakeStripe(webhook_secret='whsec_fake',
+                               deliver_webhook=lambda payload, signature: self.webhooks.append((payload, signature)))
+        self.server = FakeStripeServer(('127.0.0.1', 0), self.fake)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        previous = (stripe.api_base, stripe.api_key, stripe.default_http_client)
+        self.addCleanup(PooledStripeClientTests._restore_stripe, *previous)
+        stripe.api_base = self.server.api_base
+        stripe.api_key = 'sk_test_fake'
+        stripe.default_http_client = build_stripe_http_client()
+
+        self.user = User.objects.create_user(username='fakestripe', email='fake@stripe.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.order = Order.objects.create(user=self.user, amount=Decimal('19.99'))
+
+    def checkout(self, token):
+        added = self.client.post(reverse('payment-method-list-create'), {'token': token, 'make_default': True},
+                                 format='json')
+        self.assertEqual(added.status_code, status.HTTP_201_CREATED)
+        return self.client.post(reverse('payment-intent-create'),
+                                {'order_id': str(self.order.order_id),
+                                 'payment_method_id': added.data['payment_method_id']}, format='json')
+
+    def deliver_webhooks(self):
+        for payload, signature in self.webhooks:
+            response = self.client.post(reverse('webhook-stripe'), data=payload, content_type='application/json',
+                                        HTTP_STRIPE_SIGNATURE=signature)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.webhooks.clear()
+        process_webhook_events(claim_webhook_events(batch_size=10))
+
+    @patch('payments.services.generate_invoice_pdf_for_order')
+    def test_full_checkout_over_http(self, mock_invoice):
+        response = self.checkout('pm_card_visa')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        intent = self.fake.payment_intents[response.data['payment_id']]
+        self.assertEqual((intent['amount'], intent['status']), (1999, 'succeeded'))
+
+        self.deliver_webhooks()
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.OrderStatus.PAID)
+        self.assertEqual(PaymentAttempt.objects.get().status, PaymentAttempt.Status.SUCCEEDED)
+        mock_invoice.assert_called_once()
+
+    def test_declined_card_fails_order(self):
+        response = self.checkout('pm_card_chargeDeclined')
+
+        self.assertEqual(response.status_code, 402)
+        self.deliver_webhooks()
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.OrderStatus.FAILED)
+        self.assertEqual(PaymentAttempt.objects.get().status, PaymentAttempt.Status.FAILED)
+
+    def test_invalid_signature_is_rejected(self):
+        self.checkout('pm_card_visa')
+        payload, _ = self.webhooks[0]
+
+        response = self.client.post(reverse('webhook-stripe'), data=payload, content_type='application/json',
+                                    HTTP_STRIPE_SIGNATURE='t=1,v1=firma_falsa')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MetricsEndpointTests(APITestCase):
+
+    def setUp(self):
+        reset_breakers()
+        self.addCleanup(reset_breakers)
+        self.user = User.objects.create_user(username='metricsuser', password='testpassword123')
+
+    def test_metrics_endpoint(self):
+        self.client.force_authenticate(user=self.user)
+        cart = ShoppingCart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product_id=1, quantity=1, price_at_addition=Decimal('5.00'))
+        self.client.get(reverse('cart-retrieve'))
+        self.client.get(reverse('cart-retrieve'))  # La tasa de impuesto ya sale de la caché
+        def retrieve(customer_id):
+            return {'id': customer_id}
+        retrieve.__qualname__ = 'Customer.retrieve'
+        psp_call('customers', retrieve, 'cus_1')
+        WebhookEvent.objects.create(event_id='evt_pendiente', event_type='payment_intent.succeeded', payload={})
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertRegex(body, r'http_request_duration_seconds_count\{view="cart-retrieve"\} [1-9]')
+        self.assertIn('http_request_duration_seconds_bucket{view="cart-retrieve",le="+Inf"}', body)
+        self.assertIn('stripe_call_duration_seconds_count{operation="Customer.retrieve"}', body)
+        self.assertIn('webhook_backlog_events 1', body)
+        self.assertIn('stripe_circuit_state{endpoint="customers"} 0', body)
+        self.assertRegex(body, r'tax_rate_cache_lookups_total\{result="hit"\} [1-9]')
+        self.assertIn('tax_rate_cache_hit_ratio ', body)
+
+    def test_metrics_only_from_allowed_networks(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='203.0.113.7')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_histogram_sums_all_threads(self):
+        histogram = Histogram('test_threads_seconds', "Histograma de prueba", label='worker', buckets=(0.1, 1.0),
+                              register=False)
+
+        def observe():
+            for i in range(1000):
+                histogram.observe(0.05 if i % 2 else 0.5, 'w')
+
+        threads = [threading.Thread(target=observe) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        counts, total_sum, count = histogram.values()['w']
+        self.assertEqual((counts, count), ([4000, 4000, 0], 8000))
+        self.assertAlmostEqual(total_sum, 8 * (500 * 0.05 + 500 * 0.5))
+        self.assertIn('test_threads_seconds_bucket{worker="w",le="1.0"} 8000', histogram.render())
+
+
+    def test_finished_threads_release_their_shards(self):
+        import gc
+        from proyecto_gps_25_26_ga02_pagos.metrics import Counter
+
+        counter = Counter('test_batches_total', "Contador de prueba", label='kind', register=False)
+        # Como process_webhook_events: un pool de hilos nuevo por lote
+        for _ in range(5):
+            threads = [threading.Thread(target=counter.inc, args=('lote',)) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        counter.inc('lote')
+        gc.collect()
+
+        self.assertEqual(counter.values(), {'lote': 21})
+        self.assertEqual(len(counter._shards), 1)
+
+class LazyImportTests(SimpleTestCase):
+
+    def test_lazy_module_imports_and_configures_once(self):
+        from proyecto_gps_25_26_ga02_pagos.lazy import LazyModule
+
+        configured = []
+        module = LazyModule('colorsys', on_import=configured.append)
+        self.assertFalse(module.is_loaded)
+        threads = [threading.Thread(target=lambda: module.rgb_to_hsv(1, 0, 0)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(module.is_loaded)
+        self.assertEqual([m.__name__ for m in configured], ['colorsys'])
+
+    def test_worker_startup_does_not_import_stripe(self):
+        out = io.StringIO()
+        call_command('benchmark_startup', runs=1, stdout=out)
+        lazy_row = next(line for line in out.getvalue().splitlines() if line.startswith('lazy'))
+        self.assertNotIn('stripe', lazy_row)
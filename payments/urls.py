@@ -3,7 +3,11 @@ from .views import (
     PaymentMethodListCreateAPIView,
     PaymentMethodDestroyAPIView,
     PaymentIntentCreateAPIView,
-    StripeWebhookAPIView
+    StripeWebhookAPIView,
+    AsyncPaymentMethodListCreateView,
+    AsyncPaymentIntentCreateView,
+    PSPStatusAPIView,
+    PaymentIntentStatusAPIView,
 )
 
 urlpatterns = [
@@ -12,6 +16,12 @@ urlpatterns = [
          PaymentMethodListCreateAPIView.as_view(),
          name='payment-method-list-create'),
 
+    # GET, POST /api/v1/payment-methods/async/ (versión ASGI)
+    # Antes que la ruta de borrado, que capturaría 'async' como <pm_id>
+    path('payment-methods/async/',
+         AsyncPaymentMethodListCreateView.as_view(),
+         name='payment-method-list-create-async'),
+
     # DELETE /api/v1/payment-methods/<pm_id>/
     path('payment-methods/<str:payment_method_id>/',
          PaymentMethodDestroyAPIView.as_view(),
@@ -22,6 +32,22 @@ urlpatterns = [
          PaymentIntentCreateAPIView.as_view(),
          name='payment-intent-create'),
 
+    # POST /api/v1/payments/intent/async/ (versión ASGI)
+    path('payments/intent/async/',
+         AsyncPaymentIntentCreateView.as_view(),
+         name='payment-intent-create-async'),
+
+    # GET /api/v1/payments/intent/<payment_id>/
+    # Estado del cobro desde nuestra BBDD
+    path('payments/intent/<str:payment_id>/',
+         PaymentIntentStatusAPIView.as_view(),
+         name='payment-intent-status'),
+
+    # GET /api/v1/payments/psp-status/ (staff): circuit breakers de Stripe
+    path('payments/psp-status/',
+         PSPStatusAPIView.as_view(),
+         name='psp-status'),
+
     # POST /api/v1/webhooks/stripe/
     # Webhook para recibir eventos de Stripe
     path('webhooks/stripe/',
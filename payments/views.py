@@ -2,26 +2,51 @@ from rest_framework import status, generics
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.permissions import AllowAny
-import stripe
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
+from rest_framework.authentication import SessionAuthentication
+import json
 import logging
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
+from django.views import View
+from django.http import JsonResponse
+from asgiref.sync import sync_to_async
 from django.utils.decorators import method_decorator
 from django.db import transaction
-from .models import PaymentMethod, Customer
+from .models import PaymentMethod, Customer, PaymentAttempt
 from .serializers import (
     AddPaymentMethodRequestSerializer,
     PaymentMethodSerializer,
     PaymentIntentRequestSerializer,
     PaymentIntentResponseSerializer,
+    PaymentAttemptSerializer,
 )
 from orders.models import Order
+from pricing.money import to_minor
+from proyecto_gps_25_26_ga02_pagos.authentication import (
+    arefresh_token_user,
+    auser_from_authorization_header,
+    refresh_token_user,
+)
+from .psp import stripe
+from .resilience import PSPUnavailable, psp_call, apsp_call, psp_deadline, get_breaker_metrics
 # ¡¡IMPORTANTE!! Asegúrate de que tu 'services.py' SÍ tiene estas funciones
-from .services import handle_payment_intent_failed, handle_payment_intent_succeeded
+from .services import (
+    count_webhook,
+    enqueue_webhook_event,
+    is_duplicate_webhook_event,
+    is_stripe_customer_verified,
+    mark_stripe_customer_verified,
+    forget_stripe_customer,
+    start_payment_attempt,
+    record_payment_attempt_intent,
+    fail_payment_attempt,
+    get_cached_payment_methods,
+    cache_payment_methods,
+    invalidate_payment_methods_cache,
+)
 
-# Configurar Stripe
-stripe.api_key = settings.STRIPE_SECRET_KEY
 logger = logging.getLogger(__name__)
 
 
@@ -34,21 +59,35 @@ def get_or_create_stripe_customer(user):
         # 1. Busca en nuestra BBDD
         customer = Customer.objects.get(user=user)
 
-        # 2. Verificamos si el cliente AÚN EXISTE en Stripe
-        try:
-            stripe.Customer.retrieve(customer.stripe_customer_id)
+        # 2. Si lo verificamos hace poco, no volvemos a preguntar a Stripe.
+        # La caché se invalida con el webhook 'customer.deleted' y, si aun así
+        # una llamada real falla con 'No such customer', ver forget_stripe_customer.
+        if is_stripe_customer_verified(customer.stripe_customer_id):
             return customer.stripe_customer_id
 
+        # 3. Verificamos si el cliente AÚN EXISTE en Stripe
+        try:
+            stripe_customer = psp_call('customers', stripe.Customer.retrieve, customer.stripe_customer_id,
+                                       idempotent=True)
+            if not getattr(stripe_customer, 'deleted', False):
+                mark_stripe_customer_verified(customer.stripe_customer_id)
+                return customer.stripe_customer_id
+
         except stripe.InvalidRequestError:
-            # 3. ¡El cliente NO existe en Stripe! (Error 'No such customer')
-            logger.warning(f"Borrando Customer local 'stale' {customer.stripe_customer_id} para user {user.id}")
-            customer.delete()
-            raise Customer.DoesNotExist  # Forzamos que vaya al bloque 'except'
+            # 4. ¡El cliente NO existe en Stripe! (Error 'No such customer')
+            pass
+
+        forget_stripe_customer(customer.stripe_customer_id)
+        raise Customer.DoesNotExist  # Forzamos que vaya al bloque 'except'
 
     except Customer.DoesNotExist:
-        # 4. Si no existe (o lo acabamos de borrar), lo crea en Stripe
+        # 5. Si no existe (o lo acabamos de borrar), lo crea en Stripe
+        if user.get_deferred_fields():
+            # Usuario de un token de la API: solo trae el id (ver token_user)
+            refresh_token_user(user, ['email', 'username'])
         try:
-            stripe_customer = stripe.Customer.create(
+            stripe_customer = psp_call(
+                'customers', stripe.Customer.create,
                 email=user.email if user.email else None,  # Asegurarse de que el email no es None
                 name=user.username,
                 description=f"Cliente Django (ID: {user.id})"
@@ -57,6 +96,7 @@ def get_or_create_stripe_customer(user):
                 user=user,
                 stripe_customer_id=stripe_customer.id
             )
+            mark_stripe_customer_verified(customer.stripe_customer_id)
             return customer.stripe_customer_id
 
         except stripe.StripeError as e:
@@ -64,6 +104,42 @@ def get_or_create_stripe_customer(user):
             raise
 
 
+def is_missing_customer_error(error):
+    """
+    True si Stripe rechazó la llamada porque el Customer ya no existe
+    (p. ej. lo dimos por bueno desde la caché pero lo borraron en Stripe).
+    """
+    return getattr(error, 'code', None) == 'resource_missing' and getattr(error, 'param', None) == 'customer'
+
+
+def psp_unavailable_headers(error: PSPUnavailable):
+    return {'Retry-After': str(error.retry_after)}
+
+
+PSP_UNAVAILABLE_MESSAGE = "El proveedor de pago no está disponible. Inténtalo de nuevo más tarde."
+
+
+def save_attached_payment_method(user, attached_pm, make_default):
+    """
+    Guarda en nuestra BBDD el PaymentMethod ya adjuntado en Stripe.
+    """
+    with transaction.atomic():
+        new_pm = PaymentMethod.objects.create(
+            user=user,
+            payment_method_id=f"pm_{user.id}_{attached_pm.card.last4}",
+            psp_ref=attached_pm.id,  # <-- Usamos el ID permanente
+            brand=attached_pm.card.brand,
+            last4=attached_pm.card.last4,
+            exp_mm=attached_pm.card.exp_month,
+            exp_yy=attached_pm.card.exp_year,
+            is_default=make_default,
+        )
+        if make_default:
+            PaymentMethod.objects.filter(user=user).exclude(pk=new_pm.pk).update(is_default=False)
+    invalidate_payment_methods_cache(user.id)
+    return new_pm
+
+
 class PaymentMethodListCreateAPIView(generics.ListCreateAPIView):
     """
     Corresponde a:
@@ -71,6 +147,8 @@ class PaymentMethodListCreateAPIView(generics.ListCreateAPIView):
     - POST /api/v1/payment-methods/ (Añadir)
     """
     permission_classes = [IsAuthenticated]
+    # El listado (GET) desde la réplica; el POST siempre va a la principal
+    read_replica = True
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -80,6 +158,14 @@ class PaymentMethodListCreateAPIView(generics.ListCreateAPIView):
     def get_queryset(self):
         return PaymentMethod.objects.filter(user=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        # La página de pago lo pide en cada render: servimos el listado serializado desde la caché
+        data = get_cached_payment_methods(request.user.id)
+        if data is None:
+            data = self.get_serializer(self.get_queryset(), many=True).data
+            cache_payment_methods(request.user.id, data)
+        return Response(data)
+
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if not serializer.is_valid():
@@ -90,37 +176,42 @@ class PaymentMethodListCreateAPIView(generics.ListCreateAPIView):
         user = request.user
 
         try:
-            customer_id = get_or_create_stripe_customer(user)
-
-            # 1. Adjuntamos el token al cliente. ESTO "gasta" el token.
-            attached_pm = stripe.PaymentMethod.attach(token, customer=customer_id)
-
-            # 2. Si es default, usamos el ID del OBJETO ADJUNTO (attached_pm.id)
-            if make_default:
-                stripe.Customer.modify(
-                    customer_id,
-                    invoice_settings={'default_payment_method': attached_pm.id},
-                )
-
-            with transaction.atomic():
-                new_pm = PaymentMethod.objects.create(
-                    user=user,
-                    payment_method_id=f"pm_{user.id}_{attached_pm.card.last4}",
-                    psp_ref=attached_pm.id,  # <-- Usamos el ID permanente
-                    brand=attached_pm.card.brand,
-                    last4=attached_pm.card.last4,
-                    exp_mm=attached_pm.card.exp_month,
-                    exp_yy=attached_pm.card.exp_year,
-                    is_default=make_default,
-                )
+            with psp_deadline():
+                customer_id = get_or_create_stripe_customer(user)
+
+                # 1. Adjuntamos el token al cliente. ESTO "gasta" el token.
+                try:
+                    attached_pm = psp_call('payment_methods', stripe.PaymentMethod.attach, token, customer=customer_id)
+                except stripe.InvalidRequestError as e:
+                    if not is_missing_customer_error(e):
+                        raise
+                    # El Customer ya no existe en Stripe: lo creamos de nuevo y reintentamos
+                    forget_stripe_customer(customer_id)
+                    customer_id = get_or_create_stripe_customer(user)
+                    attached_pm = psp_call('payment_methods', stripe.PaymentMethod.attach, token, customer=customer_id)
+
+                # 2. Si es default, usamos el ID del OBJETO ADJUNTO (attached_pm.id)
                 if make_default:
-                    PaymentMethod.objects.filter(user=user).exclude(pk=new_pm.pk).update(is_default=False)
+                    psp_call(
+                        'customers', stripe.Customer.modify,
+                        customer_id,
+                        invoice_settings={'default_payment_method': attached_pm.id},
+                        idempotent=True,
+                    )
+
+            new_pm = save_attached_payment_method(user, attached_pm, make_default)
 
             response_serializer = PaymentMethodSerializer(new_pm)
             return Response(response_serializer.data, status=status.HTTP_201_CREATED)
 
+        except PSPUnavailable as e:
+            logger.warning(f"PSP no disponible añadiendo método de pago para user {user.id}: {e}")
+            return Response({"error": PSP_UNAVAILABLE_MESSAGE}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers=psp_unavailable_headers(e))
         except stripe.StripeError as e:
             return Response({"error": e.user_message or str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except AuthenticationFailed:
+            raise
         except Exception as e:
             return Response({"error": "Error interno del servidor"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -134,10 +225,11 @@ class PaymentMethodDestroyAPIView(generics.DestroyAPIView):
 
     def perform_destroy(self, instance):
         try:
-            stripe.PaymentMethod.detach(instance.psp_ref)
+            psp_call('payment_methods', stripe.PaymentMethod.detach, instance.psp_ref)
         except Exception as e:
             logger.warning(f"No se pudo des-adjuntar PM de Stripe: {e}")
         instance.delete()
+        invalidate_payment_methods_cache(instance.user_id)
 
 
 class PaymentIntentCreateAPIView(APIView):
@@ -152,29 +244,45 @@ class PaymentIntentCreateAPIView(APIView):
         order_id = serializer.validated_data['order_id']
         pm_internal_id = serializer.validated_data['payment_method_id']
         user = request.user
+        customer_id = None
+        attempt = None
 
         try:
-            order = Order.objects.get(order_id=order_id, user=user, status=Order.OrderStatus.PENDING)
+            order = Order.objects.get(order_id=order_id, user=user)
             pm = PaymentMethod.objects.get(payment_method_id=pm_internal_id, user=user)
-            customer_id = get_or_create_stripe_customer(user)
-            amount_in_cents = int(order.amount * 100)
-
-            # Creamos el PaymentIntent USANDO el customer_id y el pm.psp_ref
-            intent = stripe.PaymentIntent.create(
-                amount=amount_in_cents,
-                currency=order.currency.lower(),
-                customer=customer_id,
-                payment_method=pm.psp_ref,  # El ID 'pm_...' permanente
-                confirm=True,  # Intentar el pago ahora
-                off_session=True,  # Indicar que el cliente no está presente
-                description=f"Pago por Orden {order.order_id}",
-                metadata={"order_id": str(order.order_id), "user_id": str(user.id)},
-            )
+
+            # Un reintento del mismo cobro reutiliza el intento (y su clave de idempotencia)
+            attempt = start_payment_attempt(order, pm)
+            if attempt is None:
+                raise Order.DoesNotExist
+
+            # Si ya tenemos la respuesta de Stripe, contestamos desde nuestra BBDD
+            if not attempt.intent_id:
+                with psp_deadline():
+                    customer_id = get_or_create_stripe_customer(user)
+
+                    # Creamos el PaymentIntent USANDO el customer_id y el pm.psp_ref.
+                    # Con la clave de idempotencia, reintentar no puede cobrar dos veces.
+                    intent = psp_call(
+                        'payment_intents', stripe.PaymentIntent.create,
+                        amount=to_minor(attempt.amount, attempt.currency),
+                        currency=attempt.currency.lower(),
+                        customer=customer_id,
+                        payment_method=pm.psp_ref,  # El ID 'pm_...' permanente
+                        confirm=True,  # Intentar el pago ahora
+                        off_session=True,  # Indicar que el cliente no está presente
+                        description=f"Pago por Orden {order.order_id}",
+                        metadata={"order_id": str(order.order_id), "user_id": str(user.id),
+                                  "attempt_number": str(attempt.attempt_number)},
+                        idempotency_key=attempt.idempotency_key,
+                        idempotent=True,
+                    )
+                record_payment_attempt_intent(attempt, intent)
 
             response_data = {
                 "provider": "stripe",
-                "client_secret": intent.client_secret,
-                "payment_id": intent.id,
+                "client_secret": attempt.client_secret,
+                "payment_id": attempt.intent_id,
             }
             resp_ser = PaymentIntentResponseSerializer(data=response_data)
             resp_ser.is_valid(raise_exception=True)
@@ -184,15 +292,53 @@ class PaymentIntentCreateAPIView(APIView):
             return Response({"error": "Orden no encontrada o ya procesada."}, status=404)
         except PaymentMethod.DoesNotExist:
             return Response({"error": "Método de pago no encontrado."}, status=404)
+        except PSPUnavailable as e:
+            logger.warning(f"PSP no disponible creando PaymentIntent del Pedido {order_id}: {e}")
+            return Response({"error": PSP_UNAVAILABLE_MESSAGE}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers=psp_unavailable_headers(e))
 
         except stripe.CardError as e:
+            if attempt:
+                fail_payment_attempt(attempt, e)
             return Response({"error": e.user_message}, status=402)
+        except stripe.IdempotencyError as e:
+            # Reintento con otros datos (p. ej. otra tarjeta) mientras el cobro anterior sigue en curso
+            return Response({"error": "Ya hay un cobro en curso para este pedido."}, status=status.HTTP_409_CONFLICT)
         except stripe.InvalidRequestError as e:
+            if attempt:
+                fail_payment_attempt(attempt, e)
+            if customer_id and is_missing_customer_error(e):
+                # Sus tarjetas se fueron con el Customer: el próximo intento creará uno nuevo
+                forget_stripe_customer(customer_id)
             return Response({"error": e.user_message}, status=402)
         except stripe.StripeError as e:
             return Response({"error": "Error del proveedor de pago"}, status=500)
 
 
+class PaymentIntentStatusAPIView(generics.RetrieveAPIView):
+    """
+    GET /api/v1/payments/intent/<payment_id>/: estado del cobro, desde nuestra
+    BBDD (los webhooks lo mantienen al día).
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = PaymentAttemptSerializer
+    lookup_field = 'intent_id'
+    lookup_url_kwarg = 'payment_id'
+
+    def get_queryset(self):
+        return PaymentAttempt.objects.filter(order__user=self.request.user).select_related('order')
+
+
+class PSPStatusAPIView(APIView):
+    """
+    GET /api/v1/payments/psp-status/: estado de los circuit breakers de Stripe (staff).
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response({"breakers": get_breaker_metrics()})
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class StripeWebhookAPIView(APIView):
     permission_classes = [AllowAny]
@@ -217,16 +363,242 @@ class StripeWebhookAPIView(APIView):
             logger.warning(f"Webhook (SignatureError): {e}")
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        event_type = event['type']
-        event_data = event['data']
+        count_webhook('received')
+        if is_duplicate_webhook_event(event['id']):
+            # Reenvío de un evento ya procesado: respondemos 200 sin hacer nada más
+            logger.info(f"Webhook: Evento {event['id']} ya procesado, se ignora el reenvío.")
+            count_webhook('duplicate_rejected')
+            return Response(status=status.HTTP_200_OK)
+
+        # Guardamos el evento verificado y respondemos ya: la lógica de negocio
+        # (pedido, factura PDF...) la ejecuta después 'process_webhook_events'.
+        webhook_event = enqueue_webhook_event(json.loads(payload))
+        logger.info(f"Webhook: Evento {webhook_event.event_type} ({webhook_event.event_id}) encolado")
+
+        return Response(status=status.HTTP_200_OK)
+
+
+# ----- Vistas asíncronas (ASGI) -----
+# Mismo contrato que PaymentMethodListCreateAPIView y PaymentIntentCreateAPIView,
+# pero sin bloquear un hilo mientras esperamos a Stripe: servidas con un
+# servidor ASGI (uvicorn), un worker mantiene cientos de pagos en curso.
+# DRF no soporta vistas async, así que son vistas de Django (sesión o token de la API).
+
+async def aget_or_create_stripe_customer(user):
+    """
+    Versión asíncrona de get_or_create_stripe_customer.
+    """
+    customer = await Customer.objects.filter(user=user).afirst()
+    if customer is not None:
+        if await sync_to_async(is_stripe_customer_verified)(customer.stripe_customer_id):
+            return customer.stripe_customer_id
+        try:
+            stripe_customer = await apsp_call('customers', stripe.Customer.retrieve_async,
+                                              customer.stripe_customer_id, idempotent=True)
+            if not getattr(stripe_customer, 'deleted', False):
+                await sync_to_async(mark_stripe_customer_verified)(customer.stripe_customer_id)
+                return customer.stripe_customer_id
+        except stripe.InvalidRequestError:
+            pass
+        await sync_to_async(forget_stripe_customer)(customer.stripe_customer_id)
+
+    if user.get_deferred_fields():
+        # Usuario de un token de la API: solo trae el id (ver token_user)
+        await arefresh_token_user(user, ['email', 'username'])
+    try:
+        stripe_customer = await apsp_call(
+            'customers', stripe.Customer.create_async,
+            email=user.email if user.email else None,
+            name=user.username,
+            description=f"Cliente Django (ID: {user.id})"
+        )
+    except stripe.StripeError as e:
+        logger.error(f"Error creando Customer en Stripe para user {user.id}: {e}")
+        raise
+    customer = await Customer.objects.acreate(user=user, stripe_customer_id=stripe_customer.id)
+    await sync_to_async(mark_stripe_customer_verified)(customer.stripe_customer_id)
+    return customer.stripe_customer_id
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPaymentView(View):
+    """
+    Base de las vistas asíncronas: usuario autenticado y cuerpo JSON.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        # Token de la API (usuario activo según la caché, ver check_token_user) o, si no hay, la sesión
+        try:
+            user = await auser_from_authorization_header(request.headers.get('Authorization', '').encode('latin-1'))
+        except AuthenticationFailed as e:
+            return self.authentication_failed(e)
+        if user is None:
+            user = await request.auser()
+            # Como SessionAuthentication de DRF: CSRF solo con sesión, el token no lo manda el navegador solo
+            if user.is_authenticated:
+                try:
+                    SessionAuthentication().enforce_csrf(request)
+                except PermissionDenied as e:
+                    return JsonResponse({"detail": str(e.detail)}, status=status.HTTP_403_FORBIDDEN)
+        if not user.is_authenticated:
+            return JsonResponse({"detail": "Authentication credentials were not provided."},
+                                status=status.HTTP_403_FORBIDDEN)
+        # request.user es perezoso y consultaría la BBDD de forma síncrona
+        request.user = user
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except AuthenticationFailed as e:
+            # Token de un usuario borrado (ver arefresh_token_user)
+            return self.authentication_failed(e)
+
+    @staticmethod
+    def authentication_failed(exc):
+        return JsonResponse({"detail": str(exc.detail)}, status=status.HTTP_401_UNAUTHORIZED,
+                            headers={'WWW-Authenticate': 'Bearer'})
+
+    @staticmethod
+    def json_body(request):
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+
+
+class AsyncPaymentMethodListCreateView(AsyncPaymentView):
+    """
+    Corresponde a:
+    - GET /api/v1/payment-methods/async/ (Listar)
+    - POST /api/v1/payment-methods/async/ (Añadir)
+    """
+    read_replica = True
+
+    async def get(self, request, *args, **kwargs):
+        data = await sync_to_async(get_cached_payment_methods)(request.user.id)
+        if data is None:
+            payment_methods = [pm async for pm in PaymentMethod.objects.filter(user=request.user)]
+            data = PaymentMethodSerializer(payment_methods, many=True).data
+            await sync_to_async(cache_payment_methods)(request.user.id, data)
+        return JsonResponse(data, safe=False)
+
+    async def post(self, request, *args, **kwargs):
+        serializer = AddPaymentMethodRequestSerializer(data=self.json_body(request))
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        token = serializer.validated_data['token']
+        make_default = serializer.validated_data['make_default']
+        user = request.user
+
+        try:
+            with psp_deadline():
+                customer_id = await aget_or_create_stripe_customer(user)
+
+                try:
+                    attached_pm = await apsp_call('payment_methods', stripe.PaymentMethod.attach_async,
+                                                  token, customer=customer_id)
+                except stripe.InvalidRequestError as e:
+                    if not is_missing_customer_error(e):
+                        raise
+                    await sync_to_async(forget_stripe_customer)(customer_id)
+                    customer_id = await aget_or_create_stripe_customer(user)
+                    attached_pm = await apsp_call('payment_methods', stripe.PaymentMethod.attach_async,
+                                                  token, customer=customer_id)
+
+                if make_default:
+                    await apsp_call(
+                        'customers', stripe.Customer.modify_async,
+                        customer_id,
+                        invoice_settings={'default_payment_method': attached_pm.id},
+                        idempotent=True,
+                    )
+
+            new_pm = await sync_to_async(save_attached_payment_method)(user, attached_pm, make_default)
+            return JsonResponse(PaymentMethodSerializer(new_pm).data, status=status.HTTP_201_CREATED)
+
+        except PSPUnavailable as e:
+            logger.warning(f"PSP no disponible añadiendo método de pago (async) para user {user.id}: {e}")
+            return JsonResponse({"error": PSP_UNAVAILABLE_MESSAGE}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                headers=psp_unavailable_headers(e))
+        except stripe.StripeError as e:
+            return JsonResponse({"error": e.user_message or str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except AuthenticationFailed:
+            raise
+        except Exception as e:
+            logger.error(f"Error añadiendo método de pago (async) para user {user.id}: {e}")
+            return JsonResponse({"error": "Error interno del servidor"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class AsyncPaymentIntentCreateView(AsyncPaymentView):
+    """
+    Corresponde a POST /api/v1/payments/intent/async/
+    """
 
-        if event_type == 'payment_intent.succeeded':
-            logger.info("Webhook: Recibido 'payment_intent.succeeded'")
-            handle_payment_intent_succeeded(event_data)
-        elif event_type == 'payment_intent.payment_failed':
-            logger.warning("Webhook: Recibido 'payment_intent.payment_failed'")
-            handle_payment_intent_failed(event_data)
-        else:
-            logger.info(f"Webhook: Evento no manejado: {event_type}")
+    async def post(self, request, *args, **kwargs):
+        serializer = PaymentIntentRequestSerializer(data=self.json_body(request))
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        return Response(status=status.HTTP_200_OK)
\ No newline at end of file
+        order_id = serializer.validated_data['order_id']
+        pm_internal_id = serializer.validated_data['payment_method_id']
+        user = request.user
+        customer_id = None
+        attempt = None
+
+        try:
+            order = await Order.objects.aget(order_id=order_id, user=user)
+            pm = await PaymentMethod.objects.aget(payment_method_id=pm_internal_id, user=user)
+            attempt = await sync_to_async(start_payment_attempt)(order, pm)
+            if attempt is None:
+                raise Order.DoesNotExist
+
+            if not attempt.intent_id:
+                with psp_deadline():
+                    customer_id = await aget_or_create_stripe_customer(user)
+
+                    intent = await apsp_call(
+                        'payment_intents', stripe.PaymentIntent.create_async,
+                        amount=to_minor(attempt.amount, attempt.currency),
+                        currency=attempt.currency.lower(),
+                        customer=customer_id,
+                        payment_method=pm.psp_ref,
+                        confirm=True,
+                        off_session=True,
+                        description=f"Pago por Orden {order.order_id}",
+                        metadata={"order_id": str(order.order_id), "user_id": str(user.id),
+                                  "attempt_number": str(attempt.attempt_number)},
+                        idempotency_key=attempt.idempotency_key,
+                        idempotent=True,
+                    )
+                await sync_to_async(record_payment_attempt_intent)(attempt, intent)
+
+            resp_ser = PaymentIntentResponseSerializer(data={
+                "provider": "stripe",
+                "client_secret": attempt.client_secret,
+                "payment_id": attempt.intent_id,
+            })
+            resp_ser.is_valid(raise_exception=True)
+            return JsonResponse(resp_ser.data, status=200)
+
+        except Order.DoesNotExist:
+            return JsonResponse({"error": "Orden no encontrada o ya procesada."}, status=404)
+        except PaymentMethod.DoesNotExist:
+            return JsonResponse({"error": "Método de pago no encontrado."}, status=404)
+        except PSPUnavailable as e:
+            logger.warning(f"PSP no disponible creando PaymentIntent (async) del Pedido {order_id}: {e}")
+            return JsonResponse({"error": PSP_UNAVAILABLE_MESSAGE}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                headers=psp_unavailable_headers(e))
+
+        except stripe.CardError as e:
+            if attempt:
+                await sync_to_async(fail_payment_attempt)(attempt, e)
+            return JsonResponse({"error": e.user_message}, status=402)
+        except stripe.IdempotencyError as e:
+            return JsonResponse({"error": "Ya hay un cobro en curso para este pedido."}, status=status.HTTP_409_CONFLICT)
+        except stripe.InvalidRequestError as e:
+            if attempt:
+                await sync_to_async(fail_payment_attempt)(attempt, e)
+            if customer_id and is_missing_customer_error(e):
+                await sync_to_async(forget_stripe_customer)(customer_id)
+            return JsonResponse({"error": e.user_message}, status=402)
+        except stripe.StripeError as e:
+            return JsonResponse({"error": "Error del proveedor de pago"}, status=500)
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class PricingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pricing'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+
+        from proyecto_gps_25_26_ga02_pagos.metrics import register_collector
+        from .models import RegionTaxRule, TaxRate
+        from .services import collect_pricing_metrics, invalidate_tax_rate_cache
+
+        # Cualquier cambio en las tasas invalida la caché de get_tax_rate_for_region
+        for model in (TaxRate, RegionTaxRule):
+            post_save.connect(invalidate_tax_rate_cache, sender=model, dispatch_uid=f'tax-rate-cache-{model.__name__}-save')
+            post_delete.connect(invalidate_tax_rate_cache, sender=model, dispatch_uid=f'tax-rate-cache-{model.__name__}-delete')
+        register_collector(collect_pricing_metrics)
@@ -0,0 +1,211 @@
+"""
+Importes en unidades menores (céntimos) como enteros.
+
+Los DecimalField siguen siendo los campos "de cara" a la API, pero cada
+importe tiene una columna BigInteger *_minor con su valor en la unidad menor
+de la divisa. Sumas y conversiones para Stripe se hacen así con enteros
+exactos, y sin suponer que todas las divisas tienen dos decimales.
+"""
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from django.db import models, transaction
+
+DEFAULT_CURRENCY = 'EUR'
+
+# Decimales de cada divisa (ISO 4217). Las que no aparecen usan 2.
+# Son también las divisas "zero-decimal" y de tres decimales de Stripe.
+DEFAULT_CURRENCY_EXPONENT = 2
+CURRENCY_EXPONENTS = {
+    'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'JPY': 0, 'KMF': 0, 'KRW': 0, 'MGA': 0,
+    'PYG': 0, 'RWF': 0, 'UGX': 0, 'VND': 0, 'VUV': 0, 'XAF': 0, 'XOF': 0, 'XPF': 0,
+    'BHD': 3, 'JOD': 3, 'KWD': 3, 'OMR': 3, 'TND': 3,
+}
+
+
+def currency_exponent(currency: str) -> int:
+    return CURRENCY_EXPONENTS.get((currency or DEFAULT_CURRENCY).upper(), DEFAULT_CURRENCY_EXPONENT)
+
+
+def to_minor(amount, currency: str = DEFAULT_CURRENCY) -> int:
+    """
+    Decimal (o str/int/float) -> entero en unidades menores, redondeando
+    a la par (el mismo redondeo que quantize usa por defecto).
+    """
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return int(amount.scaleb(currency_exponent(currency)).quantize(Decimal(1), rounding=ROUND_HALF_EVEN))
+
+
+def from_minor(amount_minor: int, currency: str = DEFAULT_CURRENCY) -> Decimal:
+    """
+    Entero en unidades menores -> Decimal con los decimales de la divisa.
+    """
+    exponent = currency_exponent(currency)
+    return Decimal(amount_minor).scaleb(-exponent).quantize(Decimal(1).scaleb(-exponent))
+
+
+class Money:
+    """
+    Importe inmutable en unidades menores de una divisa:
+
+        Money.from_decimal(Decimal('12.50'), 'EUR').amount_minor  # 1250
+    """
+    __slots__ = ('amount_minor', 'currency')
+
+    def __init__(self, amount_minor: int, currency: str = DEFAULT_CURRENCY):
+        object.__setattr__(self, 'amount_minor', int(amount_minor))
+        object.__setattr__(self, 'currency', currency.upper())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Money es inmutable")
+
+    @classmethod
+    def from_decimal(cls, amount, currency: str = DEFAULT_CURRENCY) -> 'Money':
+        return cls(to_minor(amount, currency), currency)
+
+    @classmethod
+    def zero(cls, currency: str = DEFAULT_CURRENCY) -> 'Money':
+        return cls(0, currency)
+
+    @property
+    def amount(self) -> Decimal:
+        return from_minor(self.amount_minor, self.currency)
+
+    def _check_currency(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        if other.currency != self.currency:
+            raise ValueError(f"No se pueden combinar importes en {self.currency} y {other.currency}")
+        return other
+
+    def __add__(self, other):
+        if self._check_currency(other) is NotImplemented:
+            return NotImplemented
+        return Money(self.amount_minor + other.amount_minor, self.currency)
+
+    def __sub__(self, other):
+        if self._check_currency(other) is NotImplemented:
+            return NotImplemented
+        return Money(self.amount_minor - other.amount_minor, self.currency)
+
+    def __mul__(self, quantity):
+        if not isinstance(quantity, int):
+            return NotImplemented
+        return Money(self.amount_minor * quantity, self.currency)
+
+    __rmul__ = __mul__
+
+    def percentage(self, percent) -> 'Money':
+        """
+        El 'percent' % de este importe (p. ej. un impuesto), redondeado a la
+        unidad menor a la par.
+        """
+        amount = Decimal(self.amount_minor) * Decimal(str(percent)) / Decimal(100)
+        return Money(int(amount.quantize(Decimal(1), rounding=ROUND_HALF_EVEN)), self.currency)
+
+    def __eq__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return (self.amount_minor, self.currency) == (other.amount_minor, other.currency)
+
+    def __hash__(self):
+        return hash((self.amount_minor, self.currency))
+
+    def __repr__(self):
+        return f"Money({self.amount_minor}, {self.currency!r})"
+
+    def __str__(self):
+        return f"{self.amount} {self.currency}"
+
+
+# ----- Columnas *_minor en los modelos -----
+
+class MinorUnitsQuerySet(models.QuerySet):
+    """
+    bulk_create/bulk_update no llaman a save(): rellenamos aquí las columnas
+    *_minor para que nunca se queden desfasadas de los DecimalField.
+    """
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.sync_minor_units()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        fields = list(fields)
+        minor_fields = [self.model.MINOR_UNIT_FIELDS[field] for field in fields if field in self.model.MINOR_UNIT_FIELDS]
+        for obj in objs:
+            obj.sync_minor_units()
+        return super().bulk_update(objs, fields + [f for f in minor_fields if f not in fields], *args, **kwargs)
+
+    def sum_minor(self, field: str) -> int:
+        """
+        Suma exacta (entera) de una columna *_minor.
+        """
+        return self.aggregate(total=models.Sum(field))['total'] or 0
+
+
+class MinorUnitsModel(models.Model):
+    """
+    Base para modelos con importes: MINOR_UNIT_FIELDS mapea cada DecimalField
+    a su columna BigInteger *_minor, que se recalcula al guardar.
+    """
+    MINOR_UNIT_FIELDS = {}
+
+    objects = MinorUnitsQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def minor_units_currency(self) -> str:
+        return getattr(self, 'currency', None) or DEFAULT_CURRENCY
+
+    def sync_minor_units(self):
+        currency = self.minor_units_currency()
+        for field, minor_field in self.MINOR_UNIT_FIELDS.items():
+            setattr(self, minor_field, to_minor(getattr(self, field), currency))
+
+    def money(self, field: str) -> Money:
+        """
+        El importe de 'field' (p. ej. 'amount') como Money.
+        """
+        return Money(getattr(self, self.MINOR_UNIT_FIELDS[field]), self.minor_units_currency())
+
+    def save(self, *args, **kwargs):
+        self.sync_minor_units()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            kwargs['update_fields'] = update_fields | {
+                minor_field for field, minor_field in self.MINOR_UNIT_FIELDS.items() if field in update_fields
+            }
+        super().save(*args, **kwargs)
+
+
+BACKFILL_CHUNK_SIZE = 2000
+
+
+def backfill_minor_units(model, fields: dict, currency=None, chunk_size: int = BACKFILL_CHUNK_SIZE,
+                         select_related=()):
+    """
+    Rellena las columnas *_minor de filas ya existentes, para migraciones
+    (trabaja con el modelo histórico). Recorre la tabla por rangos de pk y
+    guarda cada lote en su propia transacción, sin bloquearla entera.
+    'currency' recibe la fila y devuelve su divisa.
+    """
+    queryset = model.objects.order_by('pk')
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return
+        for obj in chunk:
+            obj_currency = currency(obj) if currency else DEFAULT_CURRENCY
+            for field, minor_field in fields.items():
+                setattr(obj, minor_field, to_minor(getattr(obj, field), obj_currency))
+        with transaction.atomic():
+            model.objects.bulk_update(chunk, list(fields.values()))
+        last_pk = chunk[-1].pk
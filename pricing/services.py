@@ -1,12 +1,18 @@
 from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from proyecto_gps_25_26_ga02_pagos.metrics import Counter
 from .models import RegionTaxRule, TaxRate
+from .money import DEFAULT_CURRENCY, Money
 
 # Define un impuesto por defecto si no se encuentra la región
 # Sería bueno crear esta entrada en tu BBDD de admin
 DEFAULT_TAX_RATE = TaxRate(name="IVA General", rate=Decimal("21.00"))
 DEFAILT_REGION_CODE = "ES"
 
-def get_tax_rate_for_region(region_code: str) -> TaxRate:
+def _lookup_tax_rate(region_code: str) -> TaxRate:
     """
     Busca en la BBDD la regla de un impuesto para una región
     Si no la encuentra, usa la regla por defecto
@@ -23,12 +29,59 @@ def get_tax_rate_for_region(region_code: str) -> TaxRate:
         except RegionTaxRule.DoesNotExist:
             return DEFAULT_TAX_RATE
 
+# ----- Caché de tasas por región -----
+
+TAX_RATE_CACHE_LOOKUPS = Counter(
+    'tax_rate_cache_lookups_total', "Búsquedas de la tasa de impuesto de una región, por resultado de la caché",
+    label='result',
+)
+# Se incrementa al cambiar cualquier TaxRate o RegionTaxRule: invalida todas las regiones a la vez
+TAX_RATE_CACHE_VERSION_KEY = 'tax-rate:version'
+
+
+def _bump_tax_rate_cache_version():
+    try:
+        cache.incr(TAX_RATE_CACHE_VERSION_KEY)
+    except ValueError:
+        cache.set(TAX_RATE_CACHE_VERSION_KEY, 2, timeout=None)
+
+
+def invalidate_tax_rate_cache(**kwargs):
+    # Al confirmar la transacción: si no, otra petición podría volver a
+    # guardar la tasa antigua (aún sin confirmar) con la versión nueva
+    transaction.on_commit(_bump_tax_rate_cache_version)
+
+
+def get_tax_rate_for_region(region_code: str) -> TaxRate:
+    """
+    Tasa de impuesto de una región, guardada en caché TAX_RATE_CACHE_TTL
+    segundos (se consulta en cada vista del carrito y en cada pedido).
+    """
+    version = cache.get(TAX_RATE_CACHE_VERSION_KEY, 1)
+    key = f"tax-rate:{version}:{region_code}"
+    tax_rate = cache.get(key)
+    if tax_rate is not None:
+        TAX_RATE_CACHE_LOOKUPS.inc('hit')
+        return tax_rate
+    TAX_RATE_CACHE_LOOKUPS.inc('miss')
+    tax_rate = _lookup_tax_rate(region_code)
+    cache.set(key, tax_rate, timeout=settings.TAX_RATE_CACHE_TTL)
+    return tax_rate
+
+
+def collect_pricing_metrics():
+    lookups = TAX_RATE_CACHE_LOOKUPS.values()
+    total = lookups.get('hit', 0) + lookups.get('miss', 0)
+    return [
+        ('tax_rate_cache_hit_ratio', 'gauge', "Fracción de búsquedas de tasas servidas desde la caché",
+         {(): lookups.get('hit', 0) / total if total else 0.0}),
+    ]
+
 def calculate_cart_totals(cart, region_code: str = None):
     """
     Servicio principal que calcula los totales de un carrito
     """
-    # 1. Calcular subtotal
-    subtotal = Decimal("0.00")
+    # 1. Calcular subtotal (en céntimos, con enteros exactos)
     items = cart.items.all()
     if not items:
         # Carrito vacío
@@ -37,11 +90,16 @@ def calculate_cart_totals(cart, region_code: str = None):
             "tax_rate_name": "N/A",
             "tax_rate_percent": Decimal("0.00"),
             "tax_amount": Decimal("0.00"),
-            "total": Decimal("0.00")
+            "total": Decimal("0.00"),
+            "currency": DEFAULT_CURRENCY,
+            "subtotal_minor": 0,
+            "tax_amount_minor": 0,
+            "total_minor": 0,
         }
 
+    subtotal = Money.zero(DEFAULT_CURRENCY)
     for item in items:
-        subtotal += item.price_at_addition * item.quantity
+        subtotal += item.money('price_at_addition') * item.quantity
 
     # 2. Obtener region del usuario
     if region_code is None:
@@ -55,15 +113,19 @@ def calculate_cart_totals(cart, region_code: str = None):
     # 3. Otener tasa de impuesto
     tax_rate = get_tax_rate_for_region(region_code)
 
-    # 4. Calcular impuesto y total
-    tax_amount = (subtotal * tax_rate.rate) / Decimal("100.00")
+    # 4. Calcular impuesto (redondeado al céntimo) y total
+    tax_amount = subtotal.percentage(tax_rate.rate)
     total = subtotal + tax_amount
 
     # 5. Devolver resultados
     return {
-        "subtotal": subtotal.quantize(Decimal("0.01")),
+        "subtotal": subtotal.amount,
         "tax_rate_name": tax_rate.name,
         "tax_rate_percent": tax_rate.rate.quantize(Decimal("0.01")),
-        "tax_amount": tax_amount.quantize(Decimal("0.01")),
-        "total": total.quantize(Decimal("0.01"))
-    }
\ No newline at end of file
+        "tax_amount": tax_amount.amount,
+        "total": total.amount,
+        "currency": total.currency,
+        "subtotal_minor": subtotal.amount_minor,
+        "tax_amount_minor": tax_amount.amount_minor,
+        "total_minor": total.amount_minor,
+    }
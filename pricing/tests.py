@@ -1,3 +1,93 @@
 from django.test import TestCase
 
 # Create your tests here.
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from cart.models import ShoppingCart, CartItem
+from orders.models import Order, OrderItem
+from pricing.models import TaxRate, RegionTaxRule
+from pricing.money import Money, backfill_minor_units, from_minor, to_minor
+from pricing.services import calculate_cart_totals, get_tax_rate_for_region
+
+User = get_user_model()
+
+
+class MoneyTests(TestCase):
+
+    def test_conversion_uses_currency_exponent(self):
+        self.assertEqual(to_minor(Decimal('12.50'), 'EUR'), 1250)
+        self.assertEqual(to_minor(Decimal('1250'), 'JPY'), 1250)
+        self.assertEqual(to_minor(Decimal('1.250'), 'KWD'), 1250)
+        self.assertEqual(from_minor(1250, 'KWD'), Decimal('1.250'))
+        self.assertEqual(from_minor(1250, 'EUR'), Decimal('12.50'))
+
+    def test_rounding_is_half_even(self):
+        self.assertEqual(to_minor(Decimal('0.125')), 12)
+        self.assertEqual(to_minor(Decimal('0.135')), 14)
+        self.assertEqual(Money(25).percentage(Decimal('10.00')), Money(2))
+
+    def test_arithmetic_checks_currency(self):
+        self.assertEqual(Money(150) * 3 + Money(50), Money(500, 'eur'))
+        with self.assertRaises(ValueError):
+            Money(100, 'EUR') + Money(100, 'USD')
+
+
+class MinorUnitColumnsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='moneyuser', password='testpassword123')
+
+    def test_save_and_bulk_create_fill_minor_columns(self):
+        order = Order.objects.create(user=self.user, amount=Decimal('19.99'), subtotal=Decimal('16.52'))
+        self.assertEqual((order.amount_minor, order.subtotal_minor), (1999, 1652))
+
+        order.amount = Decimal('20.00')
+        order.save(update_fields=['amount'])
+        order.refresh_from_db()
+        self.assertEqual(order.amount_minor, 2000)
+
+        OrderItem.objects.bulk_create([OrderItem(order=order, product_id=1, quantity=2, unit_price=Decimal('9.99'))])
+        self.assertEqual(OrderItem.objects.get().unit_price_minor, 999)
+        self.assertEqual(Order.objects.sum_minor('amount_minor'), 2000)
+
+    def test_backfill_fills_existing_rows_in_chunks(self):
+        Order.objects.bulk_create(Order(user=self.user, amount=Decimal('1.01') * i) for i in range(1, 8))
+        Order.objects.update(amount_minor=0)
+
+        backfill_minor_units(Order, {'amount': 'amount_minor'}, currency=lambda o: o.currency, chunk_size=2)
+        self.assertEqual(sorted(Order.objects.values_list('amount_minor', flat=True)),
+                         [101 * i for i in range(1, 8)])
+
+    def test_cart_totals_are_integer_exact(self):
+        cache.clear()
+        RegionTaxRule.objects.create(region_code='ES', tax_rate=TaxRate.objects.create(name='IVA', rate=Decimal('21.00')))
+        cart = ShoppingCart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product_id=1, quantity=3, price_at_addition=Decimal('0.10'))
+        CartItem.objects.create(cart=cart, product_id=2, quantity=1, price_at_addition=Decimal('0.05'))
+
+        totals = calculate_cart_totals(cart, 'ES')
+        # 0.35 * 21% = 0.0735 -> 0.07
+        self.assertEqual((totals['subtotal_minor'], totals['tax_amount_minor'], totals['total_minor']), (35, 7, 42))
+        self.assertEqual(totals['total'], Decimal('0.42'))
+
+
+class TaxRateCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.tax_rate = TaxRate.objects.create(name='IVA', rate=Decimal('21.00'))
+        RegionTaxRule.objects.create(region_code='ES', tax_rate=self.tax_rate)
+
+    def test_cache_is_invalidated_on_commit(self):
+        self.assertEqual(get_tax_rate_for_region('ES').rate, Decimal('21.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tax_rate.rate = Decimal('10.00')
+            self.tax_rate.save()
+            # Sin confirmar, la caché sigue con la tasa anterior
+            self.assertEqual(get_tax_rate_for_region('ES').rate, Decimal('21.00'))
+
+        self.assertEqual(get_tax_rate_for_region('ES').rate, Decimal('10.00'))
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'proyecto_gps_25_26_ga02_pagos.settings')
 
 application = get_asgi_application()
+
+# Un único event loop por worker: las llamadas async a Stripe comparten conexiones
+from payments.psp import share_async_stripe_connections  # noqa: E402
+
+share_async_stripe_connections()
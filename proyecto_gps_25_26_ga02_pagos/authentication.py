@@ -0,0 +1,163 @@
+"""
+Autenticación de la API con tokens firmados (Authorization: Bearer <token>).
+
+Los tokens se piden en POST /api/v1/auth/token/ (ver views.APITokenObtainView).
+El token lleva el id del usuario y va firmado con SECRET_KEY (TimestampSigner),
+así que validarlo no necesita la tabla de sesiones. Que el usuario siga
+existiendo y activo se comprueba en cada petición contra la caché
+(API_TOKEN_USER_CACHE_TTL segundos; la consulta a la BBDD solo al caducar).
+request.user es un User con solo el id cargado; el resto de campos (email,
+is_staff...) se leen de la BBDD la primera vez que se usan.
+
+Los tokens no se pueden revocar uno a uno: caducan a los API_TOKEN_MAX_AGE
+segundos. Borrar o desactivar un usuario sí corta sus tokens; cambiarle la
+contraseña, no.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+
+# Este módulo no importa vistas de DRF: APIView importa DEFAULT_AUTHENTICATION_CLASSES
+# al definirse y la importación sería circular
+API_TOKEN_SALT = 'proyecto_gps_25_26_ga02_pagos.api-token'
+API_TOKEN_TYPE = 'api'
+
+
+def _signer() -> signing.TimestampSigner:
+    return signing.TimestampSigner(salt=API_TOKEN_SALT)
+
+
+def issue_api_token(user) -> str:
+    # El usuario acaba de autenticarse: las primeras peticiones no consultan la BBDD
+    cache.set(_token_user_cache_key(user.pk), user.is_active, settings.API_TOKEN_USER_CACHE_TTL)
+    return _signer().sign_object({'uid': user.pk, 'typ': API_TOKEN_TYPE})
+
+
+def verify_api_token(token: str) -> dict:
+    """
+    Devuelve los claims de un token válido; si no, lanza AuthenticationFailed.
+    """
+    try:
+        claims = _signer().unsign_object(token, max_age=settings.API_TOKEN_MAX_AGE)
+    except signing.SignatureExpired:
+        raise AuthenticationFailed("El token ha caducado.")
+    except signing.BadSignature:
+        raise AuthenticationFailed("Token no válido.")
+    if not isinstance(claims, dict) or claims.get('typ') != API_TOKEN_TYPE or not isinstance(claims.get('uid'), int):
+        raise AuthenticationFailed("Token no válido.")
+    return claims
+
+
+def _token_user_cache_key(user_id) -> str:
+    return f"api-token-user-active:{user_id}"
+
+
+def _inactive_token_user() -> AuthenticationFailed:
+    return AuthenticationFailed("El usuario del token no existe o está desactivado.")
+
+
+def check_token_user(user_id: int):
+    """
+    AuthenticationFailed si el usuario del token se ha borrado o desactivado.
+    El resultado se guarda en la caché: una consulta por usuario cada
+    API_TOKEN_USER_CACHE_TTL segundos, no una por petición.
+    """
+    key = _token_user_cache_key(user_id)
+    active = cache.get(key)
+    if active is None:
+        active = get_user_model()._default_manager.filter(pk=user_id, is_active=True).exists()
+        cache.set(key, active, settings.API_TOKEN_USER_CACHE_TTL)
+    if not active:
+        raise _inactive_token_user()
+
+
+async def acheck_token_user(user_id: int):
+    key = _token_user_cache_key(user_id)
+    active = await cache.aget(key)
+    if active is None:
+        active = await get_user_model()._default_manager.filter(pk=user_id, is_active=True).aexists()
+        await cache.aset(key, active, settings.API_TOKEN_USER_CACHE_TTL)
+    if not active:
+        raise _inactive_token_user()
+
+
+def forget_token_user(sender, instance, **kwargs):
+    """
+    Receptor de post_save/post_delete del usuario: la próxima petición con
+    sus tokens vuelve a consultar la BBDD. Al confirmar la transacción, para
+    que ninguna petición guarde antes el valor viejo.
+    """
+    key = _token_user_cache_key(instance.pk)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def token_user(user_id: int):
+    """
+    User sin consultar la BBDD: solo el id cargado, el resto de campos
+    diferidos. Sirve para filtrar y asignar FKs (user=request.user) sin
+    consultas. Al guardarlo solo se escribiría el id.
+    """
+    user_model = get_user_model()
+    return user_model.from_db(DEFAULT_DB_ALIAS, [user_model._meta.pk.attname], [user_id])
+
+
+def refresh_token_user(user, fields):
+    """
+    Carga campos diferidos de un usuario de token_user. Si el usuario se ha
+    borrado después de emitir el token, AuthenticationFailed (no un 500).
+    """
+    try:
+        user.refresh_from_db(fields=fields)
+    except user.DoesNotExist:
+        raise AuthenticationFailed("El usuario del token ya no existe.")
+
+
+async def arefresh_token_user(user, fields):
+    try:
+        await user.arefresh_from_db(fields=fields)
+    except user.DoesNotExist:
+        raise AuthenticationFailed("El usuario del token ya no existe.")
+
+
+def _token_user_id(header: bytes):
+    parts = header.split()
+    if not parts or parts[0].lower() != b'bearer':
+        return None
+    if len(parts) != 2:
+        raise AuthenticationFailed("Cabecera Authorization no válida: 'Bearer <token>'.")
+    return verify_api_token(parts[1].decode('latin-1'))['uid']
+
+
+def user_from_authorization_header(header: bytes):
+    """
+    El usuario (existente y activo) de una cabecera 'Bearer <token>', o None
+    si no es Bearer.
+    """
+    user_id = _token_user_id(header)
+    if user_id is None:
+        return None
+    check_token_user(user_id)
+    return token_user(user_id)
+
+
+async def auser_from_authorization_header(header: bytes):
+    user_id = _token_user_id(header)
+    if user_id is None:
+        return None
+    await acheck_token_user(user_id)
+    return token_user(user_id)
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        user = user_from_authorization_header(get_authorization_header(request))
+        return (user, None) if user is not None else None
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,89 @@
+"""
+Renderer y parser JSON de la API con orjson (en requirements.txt).
+
+Mismo formato que los de DRF, salvo los Decimal: DRF los convierte a float
+(242.0) y aquí van como string exacto ("242.00"), igual que los DecimalField
+de los serializers. Las fechas pasan por el encoder de DRF para que salgan
+igual que antes. Sin orjson instalado, DecimalJSONRenderer da el mismo
+formato con el json de la stdlib. Se activan en REST_FRAMEWORK (ver
+API_FAST_JSON en settings).
+"""
+import decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_drf_encoder = JSONEncoder()
+
+if orjson is not None:
+    # Fechas con el formato de DRF (milisegundos, 'Z' en UTC); claves no string como json
+    DUMPS_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def _require_orjson():
+    if orjson is None:
+        raise ImproperlyConfigured("ORJSONRenderer/ORJSONParser necesitan orjson (pip install orjson)")
+
+
+def _default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    # UUID, lazy strings, QuerySets, bytes... como el JSONRenderer de DRF
+    return _drf_encoder.default(obj)
+
+
+class DecimalJSONEncoder(JSONEncoder):
+
+    def default(self, obj):
+        if isinstance(obj, decimal.Decimal):
+            return str(obj)
+        return super().default(obj)
+
+
+class DecimalJSONRenderer(JSONRenderer):
+    """
+    El JSONRenderer de DRF con los Decimal como string: el formato de
+    ORJSONRenderer cuando orjson no está instalado.
+    """
+    encoder_class = DecimalJSONEncoder
+
+
+class ORJSONRenderer(JSONRenderer):
+
+    def __init__(self):
+        _require_orjson()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        options = DUMPS_OPTIONS
+        # orjson solo sabe indentar a 2 espacios (?indent=N o la API navegable)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=options)
+
+
+class ORJSONParser(JSONParser):
+
+    def __init__(self):
+        _require_orjson()
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        body = stream.read()
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if encoding.lower().replace('-', '') != 'utf8':
+            body = body.decode(encoding)
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
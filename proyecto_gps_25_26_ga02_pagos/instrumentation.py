@@ -0,0 +1,90 @@
+"""
+Contadores por petición: consultas a la BBDD y llamadas a Stripe.
+
+RequestTimingMiddleware abre un RequestStats al empezar cada petición y lo
+deja en un ContextVar; el wrapper de consultas (execute_wrapper de Django) y
+payments.resilience.psp_call anotan ahí lo que cuesta cada llamada. Al ser un
+ContextVar, también llega a los hilos de sync_to_async de las vistas async.
+"""
+import contextvars
+import time
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .metrics import PSP_CALL_LATENCY
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'psp_calls', 'psp_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.psp_calls = 0
+        self.psp_time = 0.0
+
+
+_request_stats = contextvars.ContextVar('request_stats', default=None)
+
+
+def start_request_stats():
+    """
+    Empieza a contar para la petición en curso. Devuelve (stats, token);
+    el token se pasa a stop_request_stats al terminar.
+    """
+    stats = RequestStats()
+    return stats, _request_stats.set(stats)
+
+
+def stop_request_stats(token):
+    _request_stats.reset(token)
+
+
+def current_request_stats():
+    return _request_stats.get()
+
+
+def record_psp_call(operation: str, duration: float):
+    """
+    Anota una llamada a Stripe de 'duration' segundos en la petición en curso
+    y en el histograma de /metrics.
+    """
+    PSP_CALL_LATENCY.observe(duration, operation)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.psp_calls += 1
+        stats.psp_time += duration
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    execute_wrapper que cuenta y cronometra cada consulta de la petición.
+    """
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - start
+
+
+def install_query_recorder(connection, **kwargs):
+    """
+    Engancha record_query a una conexión (una vez). Las conexiones son por
+    hilo: se llama al crear cada una y, por si ya existían, al empezar
+    cada petición.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install_query_recorders():
+    for connection in connections.all(initialized_only=True):
+        install_query_recorder(connection)
+
+
+connection_created.connect(install_query_recorder, dispatch_uid='instrumentation.install_query_recorder')
@@ -0,0 +1,62 @@
+"""
+Importación diferida de librerías pesadas.
+
+Cada worker, comando y proceso de tests carga las apps al arrancar; las
+librerías que solo se usan en algunas peticiones (el SDK de Stripe,
+WeasyPrint con Cairo/Pango) no deberían pagarse ahí. Ver el comando
+benchmark_startup.
+"""
+import threading
+from importlib import import_module
+
+
+class LazyModule:
+    """
+    Sustituto de un módulo que lo importa en el primer acceso a un atributo:
+
+        stripe = LazyModule('stripe', on_import=configure_stripe)
+        ...
+        stripe.Customer.create(...)  # aquí se importa (y configura) stripe
+
+    on_import recibe el módulo real y se ejecuta una sola vez, antes de que
+    ningún otro hilo pueda usarlo. Asignar un atributo (stripe.api_key = ...)
+    lo asigna en el módulo real.
+    """
+
+    def __init__(self, name: str, on_import=None):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_on_import', on_import)
+        object.__setattr__(self, '_module', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _load(self):
+        module = self._module
+        if module is not None:
+            return module
+        with self._lock:
+            if self._module is None:
+                module = import_module(self._name)
+                if self._on_import is not None:
+                    self._on_import(module)
+                object.__setattr__(self, '_module', module)
+        return self._module
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'cargado' if self.is_loaded else 'sin cargar'
+        return f"<LazyModule '{self._name}' ({state})>"
@@ -0,0 +1,230 @@
+"""
+Métricas del proceso en formato de texto de Prometheus, servidas en /metrics.
+
+Los contadores e histogramas están repartidos por hilo: cada hilo escribe en
+su propia copia sin bloquear a nadie (con WSGI multihilo no se pelean por un
+lock en cada petición) y solo al leer /metrics se suman todas las copias.
+Cuando un hilo termina, su copia se suma a un total base y se libera.
+Los valores que se calculan al leer (tamaño de la bandeja de webhooks,
+breakers...) se añaden con register_collector.
+"""
+import ipaddress
+import threading
+import weakref
+from bisect import bisect_left
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+# Buckets en segundos, de 5ms a 10s
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics = []
+_collectors = []
+_registry_lock = threading.Lock()
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(label_value) -> str:
+    return str(label_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _ShardOwner:
+    """
+    Vive en el threading.local de la métrica: cuando su hilo termina, se
+    libera y un weakref.finalize pasa su copia al total base.
+    """
+    __slots__ = ('__weakref__',)
+
+
+class _ThreadShardedMetric:
+    """
+    Base de Counter e Histogram: un dict {valor de la etiqueta: datos} por hilo.
+    Las subclases definen _merge para sumar una copia a un total.
+    """
+    kind = None
+
+    def __init__(self, name: str, documentation: str, label: str = None, register: bool = True):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self._local = threading.local()
+        self._shards = []
+        # Lo acumulado por hilos que ya han terminado (p. ej. los de cada lote de webhooks)
+        self._retired = {}
+        # RLock: el finalizer puede ejecutarse en cualquier hilo, también en uno que ya lo tiene
+        self._shards_lock = threading.RLock()
+        if register:
+            with _registry_lock:
+                _metrics.append(self)
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            owner = self._local.owner = _ShardOwner()
+            with self._shards_lock:
+                self._shards.append(shard)
+            weakref.finalize(owner, self._retire, shard).atexit = False
+        return shard
+
+    def _retire(self, shard: dict):
+        with self._shards_lock:
+            # Por identidad: dos copias pueden tener los mismos valores
+            self._shards = [other for other in self._shards if other is not shard]
+            self._merge(self._retired, list(shard.items()))
+
+    def _merge(self, totals: dict, items):
+        raise NotImplementedError
+
+    def _totals(self) -> dict:
+        totals = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+            self._merge(totals, self._retired.items())
+        # list() copia cada dict de una vez (bajo el GIL), aunque su hilo siga escribiendo
+        for shard in shards:
+            self._merge(totals, list(shard.items()))
+        return totals
+
+    def _labels(self, label_value, extra: str = '') -> str:
+        labels = [f'{self.label}="{_escape(label_value)}"'] if self.label else []
+        if extra:
+            labels.append(extra)
+        return '{' + ','.join(labels) + '}' if labels else ''
+
+    def reset(self):
+        with self._shards_lock:
+            self._retired.clear()
+            for shard in self._shards:
+                shard.clear()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return '\n'.join(lines + self._render_samples())
+
+
+class Counter(_ThreadShardedMetric):
+    kind = 'counter'
+
+    def inc(self, label_value=None, amount: float = 1):
+        shard = self._shard()
+        shard[label_value] = shard.get(label_value, 0) + amount
+
+    def _merge(self, totals: dict, items):
+        for label_value, value in items:
+            totals[label_value] = totals.get(label_value, 0) + value
+
+    def values(self) -> dict:
+        return self._totals()
+
+    def _render_samples(self) -> list:
+        return [f"{self.name}{self._labels(label_value)} {_format_value(value)}"
+                for label_value, value in sorted(self.values().items(), key=lambda item: str(item[0]))]
+
+
+class Histogram(_ThreadShardedMetric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label: str = None, buckets=DEFAULT_BUCKETS,
+                 register: bool = True):
+        super().__init__(name, documentation, label, register)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, label_value=None):
+        shard = self._shard()
+        # [cuenta por bucket (+Inf al final), suma, total]
+        data = shard.get(label_value)
+        if data is None:
+            data = shard[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        data[0][bisect_left(self.buckets, value)] += 1
+        data[1] += value
+        data[2] += 1
+
+    def _merge(self, totals: dict, items):
+        for label_value, (counts, total_sum, count) in items:
+            merged = totals.setdefault(label_value, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total_sum
+            merged[2] += count
+
+    def values(self) -> dict:
+        """
+        {valor de la etiqueta: (cuentas por bucket, suma, total)}, sumando los hilos.
+        """
+        return {label_value: tuple(data) for label_value, data in self._totals().items()}
+
+    def _render_samples(self) -> list:
+        lines = []
+        for label_value, (counts, total_sum, count) in sorted(self.values().items(), key=lambda item: str(item[0])):
+            cumulative = 0
+            for upper, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if upper == float('inf') else _format_value(upper)
+                le_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{self._labels(label_value, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(label_value)} {_format_value(total_sum)}")
+            lines.append(f"{self.name}_count{self._labels(label_value)} {count}")
+        return lines
+
+
+def register_collector(collector):
+    """
+    Registra una función que devuelve métricas calculadas al leer /metrics,
+    como lista de (nombre, tipo, ayuda, {etiquetas: valor}). Las etiquetas
+    son una tupla de pares (nombre, valor); () si no tiene.
+    """
+    with _registry_lock:
+        if collector not in _collectors:
+            _collectors.append(collector)
+
+
+def _render_collected(name, kind, documentation, samples) -> list:
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples.items():
+        label_text = ','.join(f'{key}="{_escape(label_value)}"' for key, label_value in labels)
+        lines.append(f"{name}{{{label_text}}} {_format_value(value)}" if label_text else f"{name} {_format_value(value)}")
+    return lines
+
+
+def render_metrics() -> str:
+    with _registry_lock:
+        metrics, collectors = list(_metrics), list(_collectors)
+    lines = []
+    for metric in metrics:
+        lines.append(metric.render())
+    for collector in collectors:
+        for name, kind, documentation, samples in collector():
+            lines.extend(_render_collected(name, kind, documentation, samples))
+    return '\n'.join(lines) + '\n'
+
+
+# ----- Métricas comunes -----
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', "Duración de las peticiones HTTP por nombre de URL", label='view',
+)
+PSP_CALL_LATENCY = Histogram(
+    'stripe_call_duration_seconds', "Duración de cada llamada a Stripe por operación", label='operation',
+)
+
+
+def _client_allowed(request) -> bool:
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network) for network in settings.METRICS_ALLOWED_NETWORKS)
+
+
+def metrics_view(request):
+    """
+    GET /metrics: solo desde las redes de METRICS_ALLOWED_NETWORKS (el
+    Prometheus local o el balanceador), sin autenticación.
+    """
+    if not _client_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,329 @@
+import logging
+import re
+import secrets
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_sequence, compress_string
+
+from .instrumentation import install_query_recorders, start_request_stats, stop_request_stats
+from .metrics import REQUEST_LATENCY
+from .routers import current_routing_state, pin_user_to_primary, start_routing, stop_routing
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Una vista ha hecho más consultas (o llamadas a Stripe) de las que declara.
+    Solo se lanza con QUERY_BUDGET_ENFORCE (activo al ejecutar los tests).
+    """
+
+
+class RequestTimingMiddleware:
+    """
+    Mide cada petición: número de consultas y tiempo en la BBDD, llamadas y
+    tiempo en Stripe y duración total. Lo devuelve en la cabecera
+    Server-Timing y lo deja en el log.
+
+    Las vistas pueden declarar su presupuesto como atributos de clase:
+
+        class CartRetrieveAPIView(generics.RetrieveAPIView):
+            query_budget = 5
+            psp_call_budget = 0
+
+    Si se supera, se avisa en el log; con QUERY_BUDGET_ENFORCE se lanza
+    QueryBudgetExceeded, así un N+1 nuevo rompe los tests.
+    Va la primera en MIDDLEWARE para contar también sesión y autenticación.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        install_query_recorders()
+        start = time.perf_counter()
+        stats, token = start_request_stats()
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_request_stats(token)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        stats, token = start_request_stats()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_request_stats(token)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    def finish(self, request, response, stats, duration):
+        # Por nombre de URL (no por ruta) para no crear una serie por cada pedido
+        resolver_match = request.resolver_match
+        view_name = (resolver_match.url_name or resolver_match.view_name) if resolver_match else 'unmatched'
+        REQUEST_LATENCY.observe(duration, view_name)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} consultas"',
+            f'psp;dur={stats.psp_time * 1000:.1f};desc="{stats.psp_calls} llamadas a Stripe"',
+            f'total;dur={duration * 1000:.1f}',
+        ])
+        logger.info(
+            f"{request.method} {request.path} {response.status_code} {duration * 1000:.1f}ms - "
+            f"BBDD: {stats.queries} consultas ({stats.db_time * 1000:.1f}ms), "
+            f"Stripe: {stats.psp_calls} llamadas ({stats.psp_time * 1000:.1f}ms)"
+        )
+        self.check_budget(request, stats)
+        return response
+
+    def check_budget(self, request, stats):
+        view_class = getattr(getattr(request.resolver_match, 'func', None), 'view_class', None)
+        if view_class is None:
+            return
+        exceeded = []
+        query_budget = getattr(view_class, 'query_budget', None)
+        if query_budget is not None and stats.queries > query_budget:
+            exceeded.append(f"{stats.queries} consultas (presupuesto {query_budget})")
+        psp_call_budget = getattr(view_class, 'psp_call_budget', None)
+        if psp_call_budget is not None and stats.psp_calls > psp_call_budget:
+            exceeded.append(f"{stats.psp_calls} llamadas a Stripe (presupuesto {psp_call_budget})")
+        if not exceeded:
+            return
+        message = f"{view_class.__name__} ({request.method} {request.path}): {', '.join(exceeded)}"
+        if settings.QUERY_BUDGET_ENFORCE:
+            raise QueryBudgetExceeded(message)
+        logger.warning(f"Presupuesto superado en {message}")
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lleva a la réplica las lecturas de las peticiones de solo lectura (ver
+    proyecto_gps_25_26_ga02_pagos.routers). Las vistas lo activan con un
+    atributo de clase:
+
+        class CartRetrieveAPIView(generics.RetrieveAPIView):
+            read_replica = True
+
+    Si durante la petición se ha escrito algo, el usuario queda fijado a la
+    principal durante REPLICA_PIN_SECONDS. Va después de AuthenticationMiddleware.
+    Sin réplica configurada no hace nada.
+    """
+    sync_capable = True
+    async_capable = True
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICA_ALIAS:
+            return self.get_response(request)
+        state, token = start_routing(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_routing(token)
+        self.finish(state)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICA_ALIAS:
+            return await self.get_response(request)
+        state, token = start_routing(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_routing(token)
+        await sync_to_async(self.finish)(state)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = current_routing_state()
+        if state is not None and request.method in self.safe_methods:
+            state.use_replica = getattr(getattr(view_func, 'view_class', None), 'read_replica', False)
+        return None
+
+    @staticmethod
+    def finish(state):
+        if state.wrote:
+            user_id = state.user_id()
+            if user_id is not None:
+                pin_user_to_primary(user_id)
+
+
+# Tipos que merece la pena comprimir. PDF, ZIP e imágenes ya van comprimidos
+COMPRESSIBLE_CONTENT_TYPES = (
+    'text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml',
+)
+# Eventos en streaming: el compresor retendría cada evento hasta llenar su buffer
+NEVER_COMPRESS_CONTENT_TYPES = ('text/event-stream',)
+
+_accept_encoding_re = re.compile(r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*')
+
+
+def parse_accept_encoding(header: str) -> dict:
+    """
+    {codificación: q} de una cabecera Accept-Encoding.
+    """
+    accepted = {}
+    for part in header.split(','):
+        match = _accept_encoding_re.fullmatch(part)
+        if not match:
+            continue
+        try:
+            accepted[match.group(1).lower()] = float(match.group(2)) if match.group(2) else 1.0
+        except ValueError:
+            continue
+    return accepted
+
+
+def choose_encoding(header: str):
+    """
+    'br', 'gzip' o None según lo que acepte el cliente. A igual q se prefiere br.
+    """
+    accepted = parse_accept_encoding(header)
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_q = None, 0.0
+    for encoding in candidates:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _brotli_padding(max_random_bytes: int) -> bytes:
+    """
+    Bloque de metadatos Brotli con 1 a max_random_bytes (<= 256) bytes
+    aleatorios, que el decodificador se salta. Como el nombre de fichero
+    aleatorio del gzip de Django, varía la longitud de la respuesta contra
+    BREACH. Tiene que ir detrás de un flush(), que deja la salida alineada a byte.
+    """
+    length = secrets.randbelow(max_random_bytes) + 1
+    # ISLAST=0, MNIBBLES=0 (11), reservado, MSKIPBYTES=1, MSKIPLEN-1 en 8 bits y relleno hasta el byte
+    header = bytes([0x16 | ((length - 1) & 0x3) << 6, (length - 1) >> 2])
+    return header + secrets.token_bytes(length)
+
+
+def _brotli_finish(compressor, max_random_bytes: int) -> bytes:
+    return compressor.flush() + _brotli_padding(max_random_bytes) + compressor.finish()
+
+
+def _brotli_sequence(sequence, quality: int, max_random_bytes: int):
+    compressor = brotli.Compressor(quality=quality)
+    for chunk in sequence:
+        # flush por trozo: el cliente recibe cada trozo sin esperar al siguiente
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield _brotli_finish(compressor, max_random_bytes)
+
+
+async def _abrotli_sequence(sequence, quality: int, max_random_bytes: int):
+    compressor = brotli.Compressor(quality=quality)
+    async for chunk in sequence:
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield _brotli_finish(compressor, max_random_bytes)
+
+
+async def _agzip_sequence(sequence, max_random_bytes: int):
+    # Un miembro gzip por trozo, como GZipMiddleware de Django
+    async for chunk in sequence:
+        yield compress_string(chunk, max_random_bytes=max_random_bytes)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Comprime con Brotli o gzip, según Accept-Encoding, las respuestas de tipos
+    comprimibles (JSON, texto...) de al menos COMPRESSION_MIN_SIZE bytes.
+
+    No toca las que ya tienen Content-Encoding, las de tipos ya comprimidos
+    (facturas PDF, ZIP de facturas), las parciales (206) ni las marcadas con
+    Cache-Control: no-transform. Las respuestas en streaming de tipos
+    comprimibles se comprimen trozo a trozo, salvo text/event-stream.
+    Sustituye a django.middleware.gzip.GZipMiddleware.
+
+    Como ella, añade de 1 a max_random_bytes bytes aleatorios a cada respuesta
+    comprimida (en gzip y en Brotli) para mitigar BREACH: el client_secret de
+    los cobros y el token CSRF van en respuestas comprimidas.
+    """
+    max_random_bytes = 100
+
+    def process_response(self, request, response):
+        if not self.should_compress(response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = self.compress_stream(response, encoding)
+            # No se sabe el tamaño comprimido hasta terminar
+            del response.headers['Content-Length']
+        else:
+            compressed = self.compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # Un ETag fuerte identifica los bytes exactos: pasa a débil (RFC 9110 8.8.1)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def should_compress(response) -> bool:
+        if response.has_header('Content-Encoding') or response.status_code == 206:
+            return False
+        if 'no-transform' in response.get('Cache-Control', ''):
+            return False
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type.startswith(NEVER_COMPRESS_CONTENT_TYPES):
+            return False
+        if not content_type.startswith(COMPRESSIBLE_CONTENT_TYPES):
+            return False
+        return response.streaming or len(response.content) >= settings.COMPRESSION_MIN_SIZE
+
+    def compress(self, content: bytes, encoding: str) -> bytes:
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+            return compressor.process(content) + _brotli_finish(compressor, self.max_random_bytes)
+        return compress_string(content, max_random_bytes=self.max_random_bytes)
+
+    def compress_stream(self, response, encoding: str):
+        content = response.streaming_content
+        quality = settings.COMPRESSION_BROTLI_QUALITY
+        if response.is_async:
+            if encoding == 'br':
+                return _abrotli_sequence(content, quality, self.max_random_bytes)
+            return _agzip_sequence(content, self.max_random_bytes)
+        if encoding == 'br':
+            return _brotli_sequence(content, quality, self.max_random_bytes)
+        return compress_sequence(content, max_random_bytes=self.max_random_bytes)
@@ -0,0 +1,139 @@
+"""
+Lecturas en la réplica (DATABASE_REPLICA_URL).
+
+Solo se leen de la réplica las peticiones GET/HEAD de vistas que lo declaran
+con `read_replica = True` (carrito, pedidos, métodos de pago). Todo lo demás,
+y en particular las escrituras, los select_for_update (webhook, checkout) y
+cualquier lectura dentro de un atomic(), va a la principal.
+
+La réplica va con retraso, así que tras escribir un usuario se queda unos
+segundos (REPLICA_PIN_SECONDS) leyendo de la principal para ver sus propios
+cambios. La marca se guarda en la caché, que tiene que ser compartida entre
+procesos: con la LocMemCache la siguiente petición del usuario puede caer en
+otro worker, que no la ve, y leer de la réplica.
+"""
+import contextvars
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Sesiones y usuarios siempre de la principal: un login recién hecho podría no
+# estar aún en la réplica
+PRIMARY_ONLY_APPS = {'admin', 'auth', 'contenttypes', 'sessions'}
+
+# Cachés que el resto de procesos no ve (o que no guardan nada)
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+class RoutingState:
+    """
+    Estado de la petición en curso. ReplicaRoutingMiddleware decide
+    use_replica; el router anota wrote en cuanto se escribe algo, y desde ese
+    momento la petición lee de la principal.
+    """
+    __slots__ = ('request', 'use_replica', 'wrote', '_pinned')
+
+    def __init__(self, request):
+        self.request = request
+        self.use_replica = False
+        self.wrote = False
+        self._pinned = None
+
+    def user_id(self):
+        # request.user se resuelve aquí y no en el middleware: con la
+        # autenticación de DRF el usuario no se conoce hasta entrar en la vista
+        user = getattr(self.request, 'user', None)
+        return user.pk if user is not None and user.is_authenticated else None
+
+    def pinned(self) -> bool:
+        if self._pinned is None:
+            user_id = self.user_id()
+            self._pinned = user_id is not None and is_user_pinned_to_primary(user_id)
+        return self._pinned
+
+
+_routing_state = contextvars.ContextVar('db_routing_state', default=None)
+
+
+def start_routing(request):
+    """
+    Devuelve (state, token); el token se pasa a stop_routing al terminar.
+    """
+    state = RoutingState(request)
+    return state, _routing_state.set(state)
+
+
+def stop_routing(token):
+    _routing_state.reset(token)
+
+
+def current_routing_state():
+    return _routing_state.get()
+
+
+def _pin_cache_key(user_id) -> str:
+    return f"db-primary-pin:{user_id}"
+
+
+def pin_user_to_primary(user_id):
+    """
+    El usuario lee de la principal durante REPLICA_PIN_SECONDS.
+    """
+    if settings.DATABASE_REPLICA_ALIAS:
+        cache.set(_pin_cache_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_user_pinned_to_primary(user_id) -> bool:
+    return cache.get(_pin_cache_key(user_id), False)
+
+
+def check_pin_cache():
+    """
+    Con réplica, ImproperlyConfigured si la caché no es compartida.
+    """
+    backend = settings.CACHES[DEFAULT_CACHE_ALIAS]['BACKEND']
+    if settings.DATABASE_REPLICA_ALIAS and backend in PROCESS_LOCAL_CACHES:
+        raise ImproperlyConfigured(
+            f"DATABASE_REPLICA_URL necesita una caché compartida entre procesos (CACHE_BACKEND), no {backend}"
+        )
+
+
+class ReplicaRouter:
+
+    def __init__(self):
+        check_pin_cache()
+
+    def db_for_read(self, model, **hints):
+        replica = settings.DATABASE_REPLICA_ALIAS
+        state = _routing_state.get()
+        if not replica or state is None or not state.use_replica or state.wrote:
+            return None
+        if model._meta.app_label in PRIMARY_ONLY_APPS:
+            return None
+        # Dentro de una transacción se lee lo que se va a escribir
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        if state.pinned():
+            return None
+        return replica
+
+    def db_for_write(self, model, **hints):
+        state = _routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # La réplica tiene los mismos datos que la principal
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # La réplica se migra por replicación, no con migrate
+        if db == settings.DATABASE_REPLICA_ALIAS:
+            return False
+        return None
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class BudgetEnforcingTestRunner(DiscoverRunner):
+    """
+    Test runner por defecto con QUERY_BUDGET_ENFORCE activo: una vista que
+    supera su query_budget / psp_call_budget hace fallar el test
+    (ver RequestTimingMiddleware).
+    """
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._query_budget_enforce = settings.QUERY_BUDGET_ENFORCE
+        settings.QUERY_BUDGET_ENFORCE = True
+
+    def teardown_test_environment(self, **kwargs):
+        settings.QUERY_BUDGET_ENFORCE = self._query_budget_enforce
+        super().teardown_test_environment(**kwargs)
@@ -19,16 +19,21 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .metrics import metrics_view
+from .views import APITokenObtainView
+
 API_PREFIX = "api/v1/"
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-
-    # Conecta todas las URLs de la app 'cart' bajo el prefijo 'api/v1/cart/'
-
-    path(f"{API_PREFIX}payments/", include("payments.urls")),
-    path(f"{API_PREFIX}pricing/", include("pricing.urls")),
-    path(f"{API_PREFIX}invoices/", include("invoices.urls")),
+    path('metrics', metrics_view, name='metrics'),
+
+    # Cada app define sus rutas completas ('cart/', 'orders/', 'invoices/',
+    # 'payment-methods/', 'payments/', 'webhooks/') bajo el prefijo 'api/v1/'
+    path(API_PREFIX, include("cart.urls")),
+    path(API_PREFIX, include("orders.urls")),
+    path(API_PREFIX, include("payments.urls")),
+    path(API_PREFIX + "auth/token/", APITokenObtainView.as_view(), name="api-token-obtain"),
 
 ]
 
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.contrib.auth import authenticate
+from rest_framework import serializers, status
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .authentication import issue_api_token
+
+
+class APITokenRequestSerializer(serializers.Serializer):
+    username = serializers.CharField()
+    password = serializers.CharField(trim_whitespace=False)
+
+
+class APITokenObtainView(APIView):
+    """
+    Corresponde a: POST /api/v1/auth/token/
+    Cambia usuario y contraseña por un token para la cabecera
+    Authorization: Bearer <token>, válido durante API_TOKEN_MAX_AGE segundos.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request, *args, **kwargs):
+        serializer = APITokenRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        user = authenticate(request, **serializer.validated_data)
+        if user is None:
+            return Response({"error": "Usuario o contraseña incorrectos."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            "token": issue_api_token(user),
+            "token_type": "Bearer",
+            "expires_in": settings.API_TOKEN_MAX_AGE,
+        })